@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from util.googlemusic_util import GoogleMusic_Util
+from util.fake_mobileclient import FakeMobileclient
+from util.play_history import PlayHistory
+from util.playlist_executor import PlaylistMutationExecutor
+from util.snapshot_history import SnapshotHistory
+from util.snapshot_io import DumpTracksToJSONL
+from util.synthetic_library import SyntheticLibrary, GENRES
+
+# Benchmarks GoogleMusic_Util operations against synthetic libraries and a
+# FakeMobileclient. Every operation runs in a forked child process so its
+# peak memory can be measured on its own. Results are written as one JSON
+# object per line:
+#
+#    {"operation": "FindNewPlays", "tracks": 10000, "seconds": 0.02,
+#     "peak_rss_kb": 91000, "rss_growth_kb": 1200, "api_calls": {},
+#     "api_errors": {}, "timers": {"method{method=FindNewPlays}": {...}}}
+#
+# Usage:
+#    ./benchmark_library.py --sizes 1000,10000,100000,500000 --output bench.jsonl
+
+
+class StubLastFMSession(object):
+    # Answers play count lookups and scrobbles like Last.FM would, without
+    # the network, so the Last.FM operations can be benchmarked
+
+    def GetUserPlayCount(self, artist, title):
+        return len(title) % 5
+
+    def Scrobble(self, scrobbles):
+        return len(scrobbles)
+
+    def Metrics(self):
+        return {'requests': 0, 'operations': 0, 'connections_opened': 0, 'handshakes': 0,
+                'connections_saved': 0, 'handshakes_saved': 0}
+
+
+def Operations(data, work_dir):
+    library = data['library']
+    playlists = data['playlists']
+    songs = [track['id'] for track in library[:1000]]
+    entries = [entry['id'] for entry in playlists[0]['tracks']]
+    play_counts = [(track, track.get('playCount', 0) + 1) for track in library[:1000]]
+    return [
+        ('GetLibrary', lambda util: util.GetLibrary()),
+        ('GetPlaylists', lambda util: util.GetPlaylists()),
+        ('SyncLibrary', lambda util: util.SyncLibrary('library.db')),
+        ('SyncPlaylists', lambda util: util.SyncPlaylists('library.db')),
+        ('LoadLocalJSON', lambda util: util.LoadLocalJSON(data['snapshot'])),
+        ('IterLocalJSONL', lambda util: sum(1 for _ in util.IterLocalJSONL(data['snapshot_jsonl']))),
+        ('FindNewPlays', lambda util: util.FindNewPlays(library, data['newer'])),
+        ('DiffLibraries', lambda util: util.DiffLibraries(library, data['newer'])),
+        ('FindNewPlaysSince', lambda util: util.FindNewPlaysSince(1, data['history'])),
+        ('RecordSnapshot', lambda util: util.RecordSnapshot(library, 'history.db')),
+        ('RecordPlays', lambda util: util.RecordPlays(data['new_plays'])),
+        ('FilterForPlayed', lambda util: util.FilterForPlayed(library)),
+        ('FilterForUnplayed', lambda util: util.FilterForUnplayed(library)),
+        ('ToColumnar', lambda util: util.ToColumnar(library)),
+        ('AddSongsToPlaylist', lambda util: util.AddSongsToPlaylist(playlists, playlists[0]['name'], songs)),
+        ('AddSongsToPlaylists', lambda util: util.AddSongsToPlaylists(
+            playlists, dict((playlist['name'], songs[:100]) for playlist in playlists[:5]))),
+        ('RemoveTracksFromPlaylist', lambda util: util.RemoveTracksFromPlaylist(entries)),
+        ('SetPlayCount', lambda util: util.SetPlayCount(library[0], library[0].get('playCount', 0) + 1)),
+        ('SetPlayCounts', lambda util: util.SetPlayCounts(play_counts)),
+        ('LeastPlayed', lambda util: util.LeastPlayed(library, playlists)),
+        ('NotRecentlyPlayed', lambda util: util.NotRecentlyPlayed(library, playlists)),
+        ('UnratedPlaylist', lambda util: util.UnratedPlaylist(library, playlists)),
+        ('NotRecentlyPlayedByGenre', lambda util: util.NotRecentlyPlayedByGenre(library, playlists, GENRES[0])),
+        ('LeastPlayedByGenre', lambda util: util.LeastPlayedByGenre(library, playlists, GENRES[0])),
+        ('MostPlayedByGenre', lambda util: util.MostPlayedByGenre(library, playlists, GENRES[0])),
+        ('UnratedByGenre', lambda util: util.UnratedByGenre(library, playlists, GENRES[0])),
+        ('HeavyRotation', lambda util: util.HeavyRotation(library, playlists, times=3)),
+        ('BuildPlaylists', lambda util: util.BuildPlaylists(library, playlists,
+                                                            util.GenrePlaylistSpecs(GENRES))),
+        ('ArtistPlaylist', lambda util: util.ArtistPlaylist(library, playlists, library[0]['artist'])),
+        ('AlbumPlaylist', lambda util: util.AlbumPlaylist(library, playlists, 'Albums',
+                                                          [library[0]['album'].split()[0]])),
+        ('ScrobbleRecentPlays', lambda util: util.ScrobbleRecentPlays(data['newer'])),
+        ('SyncLastFMPlayCount', lambda util: util.SyncLastFMPlayCount([dict(track) for track in library],
+                                                                      workers=8, rate=1000000.0)),
+        ('DumpTracksToJSON', lambda util: util.DumpTracksToJSON(library, os.path.join(work_dir, 'library.json'))),
+        ('DumpTracksToJSONL', lambda util: util.DumpTracksToJSONL(library, os.path.join(work_dir, 'library.jsonl.gz'))),
+        ('DumpTracksToCSV', lambda util: util.DumpTracksToCSV(library, os.path.join(work_dir, 'library.csv'))),
+    ]
+
+
+def PrepareFiles(data, generator, selected):
+    # Writes the snapshots and histories the selected operations read,
+    # replacing those of the previous library size
+    def Wanted(*names):
+        return selected is None or any(name in selected for name in names)
+    for key in ('snapshot', 'snapshot_jsonl', 'history', 'play_history'):
+        if os.path.exists(data[key]):
+            os.remove(data[key])
+    library = data['library']
+    if Wanted('LoadLocalJSON'):
+        with open(data['snapshot'], 'w') as fp:
+            json.dump(library, fp)
+            fp.write('\n')
+    if Wanted('IterLocalJSONL'):
+        DumpTracksToJSONL(library, data['snapshot_jsonl'])
+    if Wanted('FindNewPlaysSince'):
+        history = SnapshotHistory(data['history'])
+        history.Record(library)
+        history.Record(data['newer'])
+        history.Close()
+    if Wanted('HeavyRotation', 'NotRecentlyPlayed', 'NotRecentlyPlayedByGenre'):
+        # Five days of plays, so some tracks are in heavy rotation
+        history = PlayHistory(data['play_history'])
+        now = time.time()
+        for days_ago in range(5):
+            old = library
+            library = generator.PlayTracks(library, fraction=0.3)
+            history.Record([(new, now - days_ago * 24 * 3600) for new, before in zip(library, old)
+                            if new.get('playCount') != before.get('playCount')])
+        history.Close()
+
+
+def MaxRSS():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def RunInChild(name, operation, data, args):
+    # Runs one operation in a forked child and returns its measurements
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        result = {'operation': name, 'tracks': len(data['library'])}
+        api = FakeMobileclient(data['library'], data['playlists'],
+                               latency=args.latency, error_rate=args.error_rate,
+                               seed=args.seed)
+        util = GoogleMusic_Util(backend=api)
+        # The rate cap is meant for Google's servers, not the fake
+        util.playlist_executor = PlaylistMutationExecutor(util.api, rate=args.api_rate,
+                                                          instrumentation=util.instrumentation)
+        util.lastfm = util.instrumentation.Wrap(StubLastFMSession(), 'lastfm_call')
+        # Outboxes, caches and stores are created in the working directory,
+        # so every operation starts without them, except for the prepared
+        # play history
+        os.chdir(tempfile.mkdtemp(dir=args.work_dir))
+        if os.path.exists(data['play_history']):
+            shutil.copy(data['play_history'], 'play_history.db')
+        rss_before = MaxRSS()
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            start = time.time()
+            operation(util)
+            result['seconds'] = time.time() - start
+        except Exception as e:
+            result['error'] = repr(e)
+        sys.stdout = stdout
+        result['peak_rss_kb'] = MaxRSS()
+        result['rss_growth_kb'] = MaxRSS() - rss_before
+        result['api_calls'] = dict(api.calls)
+        result['api_errors'] = dict(api.errors)
+        result['timers'] = util.instrumentation.Report()['timers']
+        os.write(write_fd, json.dumps(result))
+        os.close(write_fd)
+        os._exit(0)
+
+    os.close(write_fd)
+    output = ''
+    while True:
+        chunk = os.read(read_fd, 65536)
+        if not chunk:
+            break
+        output += chunk
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark GoogleMusic_Util on synthetic libraries.')
+    parser.add_argument('--sizes', default='1000,10000,100000,500000',
+                        help='comma separated library sizes')
+    parser.add_argument('--operations', default=None,
+                        help='comma separated operation names (default: all)')
+    parser.add_argument('--playlists', type=int, default=50,
+                        help='number of existing playlists')
+    parser.add_argument('--api-rate', type=float, default=1000000.0,
+                        help='API calls per second allowed by the playlist executor')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds each fake API call takes')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of fake API calls which fail')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None,
+                        help='file to write JSON lines to (default: stdout)')
+    args = parser.parse_args()
+
+    selected = set(args.operations.split(',')) if args.operations else None
+    output = open(args.output, 'w') if args.output else sys.stdout
+    work_dir = args.work_dir = tempfile.mkdtemp()
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            generator = SyntheticLibrary(seed=args.seed)
+            library = generator.Library(size)
+            newer = generator.PlayTracks(library)
+            data = {'library': library,
+                    'playlists': generator.Playlists(library, args.playlists),
+                    'newer': newer,
+                    'new_plays': [new for new, old in zip(newer, library)
+                                  if new.get('playCount') != old.get('playCount')],
+                    'snapshot': os.path.join(work_dir, 'snapshot.json'),
+                    'snapshot_jsonl': os.path.join(work_dir, 'snapshot.jsonl'),
+                    'history': os.path.join(work_dir, 'history.db'),
+                    'play_history': os.path.join(work_dir, 'play_history.db')}
+            PrepareFiles(data, generator, selected)
+            for name, operation in Operations(data, work_dir):
+                if selected is None or name in selected:
+                    output.write(json.dumps(RunInChild(name, operation, data, args)) + '\n')
+                    output.flush()
+    finally:
+        shutil.rmtree(work_dir)
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from util.synthetic_library import SyntheticLibrary
+
+# Measures how long the offline path takes in a fresh interpreter: importing
+# GoogleMusic_Util, loading two local snapshots, diffing them with
+# FindNewPlays and exporting a CSV. Nothing here should need gmusicapi or a
+# login. Prints one JSON object with the fastest, median and slowest wall
+# time of the runs and the heavy modules which were imported.
+#
+# Usage:
+#    ./benchmark_startup.py --runs 10 --tracks 1000
+
+# Modules the offline path should not import
+HEAVY_MODULES = ('gmusicapi', 'smtplib', 'numpy', 'pyarrow', 'zstandard')
+
+CHILD = """
+import sys, time, json
+start = time.time()
+sys.path.insert(0, %(root)r)
+from util.googlemusic_util import GoogleMusic_Util
+imported = time.time()
+util = GoogleMusic_Util()
+old = util.LoadLocalJSON(%(old)r)
+new = util.LoadLocalJSON(%(new)r)
+util.FindNewPlays(old, new)
+util.DumpTracksToCSV(new, %(csv)r)
+done = time.time()
+sys.stderr.write(json.dumps({'import_seconds': imported - start, 'seconds': done - start,
+                             'heavy_modules': [name for name in %(heavy)r if name in sys.modules]}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of offline GoogleMusic_Util tasks.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--tracks', type=int, default=1000,
+                        help='number of tracks in each local snapshot')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        generator = SyntheticLibrary(seed=1)
+        library = generator.Library(args.tracks)
+        paths = {'root': os.path.dirname(os.path.abspath(__file__)),
+                 'old': os.path.join(work_dir, 'old.json'),
+                 'new': os.path.join(work_dir, 'new.json'),
+                 'csv': os.path.join(work_dir, 'library.csv'),
+                 'heavy': HEAVY_MODULES}
+        with open(paths['old'], 'w') as fp:
+            json.dump(library, fp)
+        with open(paths['new'], 'w') as fp:
+            json.dump(generator.PlayTracks(library), fp)
+
+        runs = []
+        for _ in range(args.runs):
+            child = subprocess.Popen([sys.executable, '-c', CHILD % paths],
+                                     stdout=open(os.devnull, 'w'), stderr=subprocess.PIPE)
+            _, output = child.communicate()
+            runs.append(json.loads(output.splitlines()[-1]))
+    finally:
+        shutil.rmtree(work_dir)
+
+    seconds = sorted(run['seconds'] for run in runs)
+    imports = sorted(run['import_seconds'] for run in runs)
+    print json.dumps({'runs': len(runs), 'tracks': args.tracks,
+                      'min_seconds': seconds[0],
+                      'median_seconds': seconds[len(seconds) // 2],
+                      'max_seconds': seconds[-1],
+                      'median_import_seconds': imports[len(imports) // 2],
+                      'heavy_modules': sorted(set(name for run in runs for name in run['heavy_modules']))})
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 from util.googlemusic_util import GoogleMusic_Util
+from util.job_runner import JobRunner
 
 if __name__ == '__main__':
     util = GoogleMusic_Util()
-    util.DumpLibrary('/tmp/library.json')
-    util.DumpPlaylists('/tmp/playlists.json')
+    JobRunner(util, {'jobs': [{'type': 'dump_library', 'file': '/tmp/library.json'},
+                              {'type': 'dump_playlists', 'file': '/tmp/playlists.json'}]}).Run()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+import argparse
+import sys
+
+from util.googlemusic_util import GoogleMusic_Util
+from util.job_runner import JobRunner
+
+# Runs the jobs in a JobRunner config (see util/job_runner.py), fetching the
+# library and playlists once for all of them, and prints how long each took.
+#
+# Usage:
+#    ./run_jobs.py jobs.json
+#    ./run_jobs.py --dry-run jobs.json
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run Google Music jobs from a config file.')
+    parser.add_argument('config', help='JSON file listing the jobs')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='log changes to Google Music instead of making them')
+    args = parser.parse_args()
+
+    util = GoogleMusic_Util(dry_run=args.dry_run)
+    results = JobRunner(util, JobRunner.LoadConfig(args.config)).Run()
+    if not all(result.success for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
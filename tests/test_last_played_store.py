@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util'))
+
+from last_played_store import LastPlayedStore
+
+# Records plays in a LastPlayedStore and reads them back, including after a
+# crash left the log with a partial last line.
+
+
+class LastPlayedStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.work_dir, 'last_played.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def testCommitAndCompact(self):
+        store = LastPlayedStore(self.file_name, compact_after=3)
+        store.Record('a', 1.0)
+        store.Record('b', 2.0)
+        self.assertEqual(store.Commit(), 2)
+        self.assertEqual(LastPlayedStore(self.file_name).Load(), {'a': 1.0, 'b': 2.0})
+
+        store.Record('a', 3.0)
+        store.Record('c', 4.0)
+        store.Commit()
+        self.assertFalse(os.path.exists(store.log_file))
+        self.assertEqual(LastPlayedStore(self.file_name).Load(), {'a': 3.0, 'b': 2.0, 'c': 4.0})
+
+    def testTornLastLine(self):
+        store = LastPlayedStore(self.file_name)
+        store.Record('a', 1.0)
+        store.Commit()
+        with open(store.log_file, 'a') as f:
+            f.write('b\t')
+
+        store.Record('c', 5.0)
+        store.Commit()
+        self.assertEqual(LastPlayedStore(self.file_name).Load(), {'a': 1.0, 'c': 5.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util'))
+
+from fake_lastfm import FakeLastFM
+from fake_mobileclient import FakeMobileclient
+from googlemusic_util import GoogleMusic_Util
+from lastfm_fetcher import PlayCountFetcher
+from lastfm_session import LastFMSession
+
+# Fetches play counts with PlayCountFetcher from a FakeLastFM, reached
+# through a LastFMSession pointed at it with LASTFM_WS_SERVER.
+
+ENVIRONMENT = {'LASTFM_APIKEY': 'key', 'LASTFM_APISECRET': 'secret',
+               'LASTFM_USERNAME': 'user', 'LASTFM_PASSWORD': 'password'}
+
+
+def Tracks(count):
+    return [{'id': 't' + n.__str__(), 'artist': u'Artist', 'album': u'Album',
+             'title': u'Song ' + n.__str__(), 'playCount': 0} for n in range(count)]
+
+
+class PlayCountFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = Tracks(60)
+        self.server = FakeLastFM(
+            play_counts=dict(((track['artist'], track['title'].encode('utf-8')), n)
+                             for n, track in enumerate(self.tracks)),
+            failing=['Song 7', 'Song 8'])
+        self.server.Start()
+        self.environment = dict((name, os.environ.get(name)) for name in ENVIRONMENT)
+        os.environ.update(ENVIRONMENT)
+        os.environ['LASTFM_WS_SERVER'] = self.server.URL()
+        self.session = LastFMSession.FromEnvironment()
+
+    def tearDown(self):
+        self.session.Close()
+        self.server.Stop()
+        del os.environ['LASTFM_WS_SERVER']
+        for name, value in self.environment.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+    def Lookup(self, track):
+        return self.session.GetUserPlayCount(track['artist'], track['title'])
+
+    def testCountsAndErrors(self):
+        fetcher = PlayCountFetcher(self.Lookup, workers=4, rate=1000)
+        counts = fetcher.FetchAll(self.tracks)
+        self.assertEqual(len(counts), 60)
+        self.assertEqual(counts['t0'], 0)
+        self.assertEqual(counts['t59'], 59)
+        self.assertEqual(counts['t7'], None)
+        self.assertEqual(counts['t8'], None)
+        self.assertEqual(fetcher.errors, 2)
+        self.assertEqual(self.server.calls['track.getInfo'], 60)
+        # Lookups don't need a session key, and connections are reused
+        self.assertEqual(self.server.calls['auth.getMobileSession'], 0)
+        self.assertTrue(self.session.Metrics()['connections_opened'] <= 4)
+
+    def testRateCap(self):
+        # A bucket of 40 tokens a second starts full, so the other 20
+        # lookups take at least half a second more
+        fetcher = PlayCountFetcher(self.Lookup, workers=8, rate=40)
+        fetcher.FetchAll(self.tracks)
+        times = sorted(self.server.request_times)
+        self.assertEqual(len(times), 60)
+        self.assertTrue(times[-1] - times[0] >= 0.45)
+        # and no more than the burst plus the refill go out in a quarter second
+        self.assertTrue(len([t for t in times if t - times[0] < 0.25]) <= 40 + 10 + 1)
+
+    def testBulkLookup(self):
+        util = GoogleMusic_Util(backend=FakeMobileclient(self.tracks))
+        counts = util.GetLastFMPlaysBulk(self.tracks, workers=4, rate=1000, use_cache=False)
+        self.assertEqual(counts['t3'], 3)
+        self.assertEqual(counts['t7'], None)
+        self.assertEqual(len(counts), 60)
+        self.assertEqual(self.server.calls['track.getInfo'], 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import calendar
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util'))
+
+from googlemusic_util import GoogleMusic_Util
+from last_played_store import LastPlayedStore
+from play_history import DAY, Day, PlayHistory, WeekStart
+
+# Records plays in a PlayHistory and checks the month partitions, the
+# rollups and the last played times the recency playlists rank by.
+
+
+def At(year, month, day, hour=12):
+    return calendar.timegm((year, month, day, hour, 0, 0))
+
+
+def Track(track_id, artist='Artist', genre='Rock'):
+    return {'id': track_id, 'artist': artist, 'genre': genre}
+
+
+class PlayHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.history = PlayHistory(os.path.join(self.work_dir, 'play_history.db'))
+
+    def tearDown(self):
+        self.history.Close()
+        shutil.rmtree(self.work_dir)
+
+    def testSamePlayIsRecordedOnce(self):
+        played = At(2024, 1, 3)
+        self.assertEqual(self.history.Record([(Track('a'), played), (Track('a'), played)]), 1)
+        self.assertEqual(self.history.Record([(Track('a'), played), (Track('a'), played + 60)]), 1)
+        self.assertEqual(self.history.PlayCounts(), {'a': 2})
+        self.assertEqual(self.history.PlaysByArtist(), [('Artist', 2, played + 60)])
+        self.assertEqual(self.history.RecordTracks([dict(Track('a'), lastModifiedTimestamp=str(played * 1000000))]), 0)
+
+    def testMonthPartitions(self):
+        self.history.Record([(Track('a'), At(2024, 1, 31, 23)), (Track('b'), At(2024, 2, 1, 0)),
+                             (Track('c'), At(2024, 3, 15))])
+        self.assertEqual(self.history._Partitions(), ['plays_202401', 'plays_202402', 'plays_202403'])
+        # A range only reads the months it overlaps
+        self.assertEqual(self.history._Partitions(At(2024, 2, 10), At(2024, 3, 1)),
+                         ['plays_202402', 'plays_202403'])
+        self.assertEqual([row[0] for row in self.history.Events(At(2024, 2, 1, 0), At(2024, 3, 31))],
+                         ['b', 'c'])
+        self.assertEqual([row[0] for row in self.history.Events()], ['a', 'b', 'c'])
+
+    def testDropBeforeKeepsRollups(self):
+        self.history.Record([(Track('a'), At(2024, 1, 10)), (Track('a'), At(2024, 2, 10)),
+                             (Track('b', genre='Jazz'), At(2024, 2, 11))])
+        self.assertEqual(self.history.DropBefore(At(2024, 2, 1)), ['plays_202401'])
+        self.assertEqual([row[0] for row in self.history.Events()], ['a', 'b'])
+        self.assertEqual(self.history.PlayCounts(), {'a': 2, 'b': 1})
+        self.assertEqual(self.history.LastPlayed(), {'a': At(2024, 2, 10), 'b': At(2024, 2, 11)})
+        self.assertEqual(sum(plays for _, _, plays in self.history.PlaysByGenre()), 3)
+
+    def testWeekStart(self):
+        # 1 January 2024 was a Monday
+        monday = Day(At(2024, 1, 1))
+        for offset in range(7):
+            self.assertEqual(WeekStart(monday + offset), monday)
+        self.assertEqual(WeekStart(monday + 7), monday + 7)
+        self.assertEqual(WeekStart(0), -3)
+
+        self.history.Record([(Track('a'), At(2024, 1, 1)), (Track('b'), At(2024, 1, 7)),
+                             (Track('c'), At(2024, 1, 8)), (Track('d', genre='Jazz'), At(2024, 1, 3))])
+        self.assertEqual(self.history.PlaysByGenre('week'),
+                         [('Jazz', monday, 1), ('Rock', monday, 2), ('Rock', monday + 7, 1)])
+
+    def testPlayCountsOverDays(self):
+        now = At(2024, 3, 31)
+        self.history.Record([(Track('a'), now), (Track('a'), now - DAY), (Track('a'), now - 40 * DAY),
+                             (Track('b'), now - 29 * DAY), (Track('c'), now - 30 * DAY)])
+        self.assertEqual(self.history.PlayCounts(30, now), {'a': 2, 'b': 1})
+        self.assertEqual(self.history.PlayCounts(1, now), {'a': 1})
+        self.assertEqual(self.history.PlayCounts(), {'a': 3, 'b': 1, 'c': 1})
+        self.assertEqual(self.history.TracksPlayedAtLeast(2, 30, now), ['a'])
+
+
+class LastPlayedTimesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.work_dir)
+
+    def testLaterOfHistoryAndLastPlayedDB(self):
+        util = GoogleMusic_Util()
+        self.assertEqual(util.LastPlayedTimes(), None)
+
+        util.GetPlayHistory().Record([(Track('a'), 100), (Track('b'), 300)])
+        store = LastPlayedStore('last_played.json')
+        store.Record('a', 200.0)
+        store.Record('b', 250.0)
+        store.Record('c', 50.0)
+        store.Commit()
+        self.assertEqual(util.LastPlayedTimes(), {'a': 200.0, 'b': 300, 'c': 50.0})
+        util.GetPlayHistory().Close()
+
+
+if __name__ == '__main__':
+    unittest.main()
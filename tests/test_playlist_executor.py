@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+import os
+import random
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util'))
+
+from fake_mobileclient import FakeBackendError, FakeMobileclient
+from playlist_executor import PlaylistMutationExecutor
+from synthetic_library import SyntheticLibrary
+
+# Runs PlaylistMutationExecutor against a FakeMobileclient which injects
+# errors and latency, and checks retries, backoff, the reported failures and
+# how many calls run at once.
+
+
+class PlaylistMutationExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.library = SyntheticLibrary(seed=1).Library(30)
+        self.song_ids = [track['id'] for track in self.library]
+
+    def Api(self, **kwargs):
+        return FakeMobileclient(self.library, [{'id': 'p', 'name': 'Test', 'tracks': []}],
+                                seed=1, **kwargs)
+
+    def Executor(self, api, **kwargs):
+        kwargs.setdefault('rate', 1000)
+        kwargs.setdefault('base_delay', 0)
+        return PlaylistMutationExecutor(api, **kwargs)
+
+    def testRetriesUntilEveryBatchSucceeds(self):
+        api = self.Api(error_rate=0.5)
+        executor = self.Executor(api, max_retries=20)
+        results = executor.AddSongs('p', self.song_ids, batch_size=5, playlist_name='Test')
+
+        self.assertEqual(len(results), 6)
+        self.assertTrue(all(result.success for result in results))
+        self.assertEqual(executor.Failures(), [])
+        # Failed calls change nothing, so every song is added exactly once
+        self.assertEqual([entry['trackId'] for entry in api.playlists['p']['tracks']], self.song_ids)
+        self.assertTrue(api.errors['add_songs_to_playlist'] > 0)
+        self.assertEqual(sum(result.attempts for result in results), api.calls['add_songs_to_playlist'])
+
+    def testBackoffIsFullJitter(self):
+        executor = self.Executor(self.Api(), base_delay=0.5, max_delay=4.0)
+        random.seed(1)
+        for attempt in range(8):
+            cap = min(4.0, 0.5 * 2 ** attempt)
+            delays = [executor.Backoff(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= cap for delay in delays))
+            # Spread over the whole range rather than bunched at the cap
+            self.assertTrue(min(delays) < cap * 0.1)
+            self.assertTrue(max(delays) > cap * 0.9)
+
+    def testFailedBatchesAreReported(self):
+        api = self.Api(error_rate=1.0)
+        executor = self.Executor(api, max_retries=3)
+        results = executor.AddSongs('p', self.song_ids[:5], batch_size=2, playlist_name='Test')
+
+        self.assertEqual([result.size for result in results], [2, 2, 1])
+        self.assertEqual(executor.Failures(), results)
+        for result in results:
+            self.assertFalse(result.success)
+            self.assertEqual(result.attempts, 3)
+            self.assertTrue(isinstance(result.error, FakeBackendError))
+        self.assertEqual(results[2].items, self.song_ids[4:5])
+        self.assertEqual(api.calls['add_songs_to_playlist'], 9)
+        self.assertEqual(api.playlists['p']['tracks'], [])
+
+    def testRunAllRunsJobsConcurrently(self):
+        api = self.Api(latency=0.2)
+        executor = self.Executor(api, max_workers=4)
+        start = time.time()
+        results = executor.IncrementPlayCounts(dict((song_id, 2) for song_id in self.song_ids[:8]))
+        seconds = time.time() - start
+
+        # Eight calls of 0.2 seconds on four workers take two rounds
+        self.assertTrue(0.35 < seconds < 0.75)
+        self.assertTrue(all(result.success for result in results))
+        self.assertEqual(api.calls['increment_song_playcount'], 8)
+        for song_id in self.song_ids[:8]:
+            self.assertEqual(api.songs[song_id]['playCount'],
+                             self.library[self.song_ids.index(song_id)].get('playCount', 0) + 2)
+
+    def testRunAllKeepsOrderAndExceptions(self):
+        executor = self.Executor(self.Api(), max_workers=3)
+
+        def Fail():
+            raise ValueError("job failed")
+        values = executor.RunAll([lambda: 1, Fail, lambda: 3])
+        self.assertEqual(values[0], 1)
+        self.assertTrue(isinstance(values[1], ValueError))
+        self.assertEqual(values[2], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
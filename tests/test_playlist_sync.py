@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+import itertools
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util'))
+
+from fake_mobileclient import FakeMobileclient
+from playlist_sync import PlaylistSyncPlan
+
+# Applies PlaylistSyncPlans to a FakeMobileclient playlist and checks the
+# order the playlist ends up in.
+
+
+def Playlist(track_ids):
+    return {'id': 'p', 'name': 'Test', 'tracks': [
+        {'id': 'e' + track_id, 'trackId': track_id, 'playlistId': 'p'} for track_id in track_ids]}
+
+
+def Apply(track_ids, wanted):
+    # Returns the playlist's track ids after syncing it to wanted
+    api = FakeMobileclient(playlists=[Playlist(track_ids)])
+    plan = PlaylistSyncPlan.Build(api.playlists['p']['tracks'], wanted, 'Test')
+    api.remove_entries_from_playlist(plan.to_remove)
+    if plan.to_add:
+        api.add_songs_to_playlist('p', plan.to_add)
+    for entry, to_follow, to_precede in plan.moves:
+        api.reorder_playlist_entry(entry, to_follow_entry=to_follow, to_precede_entry=to_precede)
+    return [entry['trackId'] for entry in api.playlists['p']['tracks']], plan
+
+
+class PlaylistSyncPlanTest(unittest.TestCase):
+
+    def testEveryPermutation(self):
+        track_ids = ['t0', 't1', 't2', 't3', 't4']
+        for wanted in itertools.permutations(track_ids):
+            result, plan = Apply(track_ids, list(wanted))
+            self.assertEqual(result, list(wanted))
+            self.assertEqual(plan.to_add, [])
+            self.assertEqual(plan.to_remove, [])
+
+    def testMovesOnlyEntriesOffTheLongestRun(self):
+        result, plan = Apply(['t0', 't1', 't2', 't3'], ['t3', 't0', 't1', 't2'])
+        self.assertEqual(result, ['t3', 't0', 't1', 't2'])
+        self.assertEqual(len(plan.moves), 1)
+
+    def testUnchangedPlaylist(self):
+        result, plan = Apply(['t0', 't1', 't2'], ['t0', 't1', 't2'])
+        self.assertTrue(plan.IsEmpty())
+
+    def testRemovedAndAdded(self):
+        generator = random.Random(1)
+        for _ in range(100):
+            track_ids = ['t' + n.__str__() for n in range(8)]
+            wanted = generator.sample(track_ids, 5) + ['n0', 'n1']
+            generator.shuffle(wanted)
+            result, plan = Apply(track_ids, wanted)
+            # Kept entries are in the requested order, added ones follow
+            kept = [track_id for track_id in wanted if track_id in track_ids]
+            added = [track_id for track_id in wanted if track_id not in track_ids]
+            self.assertEqual(result, kept + added)
+            self.assertEqual(len(plan.to_remove), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util'))
+
+from snapshot_history import SnapshotHistory
+
+# Records library snapshots in a SnapshotHistory and reconstructs them from
+# the base and deltas, with and without rebasing.
+
+
+def Track(track_id, plays=0, **fields):
+    track = {'id': track_id, 'title': 'Title ' + track_id, 'playCount': plays}
+    track.update(fields)
+    return track
+
+
+class SnapshotHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def History(self, **kwargs):
+        return SnapshotHistory(os.path.join(self.work_dir, 'history.db'), **kwargs)
+
+    def testRemovedAndAddedAgain(self):
+        history = self.History()
+        snapshots = [[Track('a'), Track('b')],
+                     [Track('b')],
+                     [Track('a', 3), Track('b')]]
+        for snapshot in snapshots:
+            history.Record(snapshot)
+        for version, snapshot in enumerate(snapshots, 1):
+            self.assertEqual(history.Snapshot(version), snapshot)
+        self.assertEqual(history.Tracks(['a'], 2), {})
+        self.assertEqual(history.Tracks(['a'], 3), {'a': Track('a', 3)})
+        history.Close()
+
+    def testChangesAndNewPlays(self):
+        history = self.History()
+        history.Record([Track('a'), Track('b', 1), Track('c', rating='5')])
+        history.Record([Track('a', 2), Track('b', 1), Track('c'), Track('d', 1)])
+        self.assertEqual(history.Snapshot(1), [Track('a'), Track('b', 1), Track('c', rating='5')])
+        self.assertEqual(history.Snapshot(), [Track('a', 2), Track('b', 1), Track('c'), Track('d', 1)])
+        self.assertEqual(sorted(track['id'] for track in history.NewPlays(1)), ['a', 'd'])
+        history.Close()
+
+    def testRebase(self):
+        history = self.History(rebase_every=2)
+        snapshots = [[Track('a'), Track('b')],
+                     [Track('b', 1)],
+                     [Track('a'), Track('b', 2)],
+                     [Track('a', 1), Track('b', 2), Track('c')],
+                     [Track('c', 1)]]
+        for snapshot in snapshots:
+            history.Record(snapshot)
+        bases = [version for version, _, is_base, _, _ in history.Versions() if is_base]
+        self.assertEqual(bases, [1, 4])
+        for version, snapshot in enumerate(snapshots, 1):
+            self.assertEqual(history.Snapshot(version), snapshot)
+        # Deltas are kept across bases, so new plays can be found across them
+        self.assertEqual(sorted(track['id'] for track in history.NewPlays(2, 4)), ['a', 'b'])
+        self.assertEqual([track['id'] for track in history.NewPlays(2)], ['c'])
+        history.Close()
+
+
+if __name__ == '__main__':
+    unittest.main()
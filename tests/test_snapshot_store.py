@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'util'))
+
+from fake_mobileclient import FakeMobileclient
+from googlemusic_util import GoogleMusic_Util
+from snapshot_store import SnapshotStore
+from synthetic_library import SyntheticLibrary
+
+# Syncs a SnapshotStore from a FakeMobileclient. The fake has no incremental
+# list calls, so GetChangedItems is replaced by one answering from the fake.
+
+
+def Changed(items, updated_after):
+    return [dict(item) for item in items if int(item['lastModifiedTimestamp']) > updated_after]
+
+
+class SnapshotStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        generator = SyntheticLibrary(seed=1)
+        self.library = generator.Library(50)
+        self.api = FakeMobileclient(self.library, generator.Playlists(self.library, 3, 10))
+        self.util = GoogleMusic_Util(backend=self.api)
+        self.store = SnapshotStore(os.path.join(self.work_dir, 'library.db'))
+        self.deleted = []
+
+    def tearDown(self):
+        self.store.Close()
+        shutil.rmtree(self.work_dir)
+
+    def Incremental(self):
+        # Answers like Mobileclient's incremental calls, including deleted items
+        def GetChangedItems(call_name, updated_after):
+            if call_name == 'ListTracks':
+                return Changed(self.api.songs.values(), updated_after) + self.deleted
+            if call_name == 'ListPlaylists':
+                return Changed(self.api.playlists.values(), updated_after)
+            entries = [entry for playlist in self.api.playlists.values() for entry in playlist['tracks']]
+            return Changed(entries, updated_after) + self.deleted
+        self.util.GetChangedItems = GetChangedItems
+
+    def Touch(self, item, **changes):
+        item.update(changes)
+        item['lastModifiedTimestamp'] = str(int(self.store.LastModified('tracks')) + 1000000)
+
+    def testIncrementalMerge(self):
+        self.util.SyncLibrary(self.store)
+        self.Incremental()
+        changed, removed = self.api.songs.values()[:2]
+        self.Touch(changed, playCount=999)
+        del self.api.songs[removed['id']]
+        self.deleted = [{'id': removed['id'], 'deleted': True, 'lastModifiedTimestamp': '0'}]
+
+        library = dict((track['id'], track) for track in self.util.SyncLibrary(self.store))
+        self.assertEqual(len(library), 49)
+        self.assertNotIn(removed['id'], library)
+        self.assertEqual(library[changed['id']]['playCount'], 999)
+        self.assertEqual(self.api.calls['get_all_songs'], 1)
+
+    def testUnchangedRowsAreNotRewritten(self):
+        self.util.SyncLibrary(self.store)
+        self.assertEqual(self.store.ReplaceTracks(self.api.get_all_songs()), (0, 0))
+
+        changes = self.store.db.total_changes
+        self.util.SyncLibrary(self.store)
+        self.assertEqual(self.store.db.total_changes, changes)
+
+        self.Touch(self.api.songs.values()[0], rating='5')
+        self.assertEqual(self.store.ReplaceTracks(self.api.get_all_songs()), (1, 0))
+
+    def testFullFetchDeletesMissingTracks(self):
+        self.util.SyncLibrary(self.store)
+        removed = self.api.songs.keys()[0]
+        del self.api.songs[removed]
+
+        # Without gmusicapi there is no incremental fetch, so this is a full one
+        library = self.util.SyncLibrary(self.store)
+        self.assertEqual(len(library), 49)
+        self.assertNotIn(removed, [track['id'] for track in library])
+
+    def testPlaylists(self):
+        playlists = self.util.SyncPlaylists(self.store)
+        self.assertEqual(sorted(len(playlist['tracks']) for playlist in playlists), [10, 10, 10])
+
+        # A full fetch drops entries which are gone
+        playlist = self.api.playlists.values()[0]
+        playlist['tracks'] = playlist['tracks'][1:]
+        playlists = dict((playlist['id'], playlist) for playlist in self.util.SyncPlaylists(self.store))
+        self.assertEqual(len(playlists[playlist['id']]['tracks']), 9)
+
+        # An incremental fetch merges renamed playlists and removed entries
+        self.Incremental()
+        later = str(int(self.store.LastModified('playlist_entries')) + 1000000)
+        playlist.update(name='Renamed', lastModifiedTimestamp=later)
+        removed = playlist['tracks'].pop(0)
+        self.deleted = [dict(removed, deleted=True, lastModifiedTimestamp=later)]
+        playlists = dict((playlist['id'], playlist) for playlist in self.util.SyncPlaylists(self.store))
+        self.assertEqual(playlists[playlist['id']]['name'], 'Renamed')
+        self.assertEqual([entry['id'] for entry in playlists[playlist['id']]['tracks']],
+                         [entry['id'] for entry in playlist['tracks']])
+        self.assertEqual(self.api.calls['get_all_user_playlist_contents'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
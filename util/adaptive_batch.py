@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+import threading
+
+# Picks batch sizes for bulk API calls. The size grows while calls succeed
+# quickly and shrinks when they fail or get slow, so bulk operations settle
+# at the largest batch the backend handles comfortably. Every change in size
+# is logged.
+#
+# Usage:
+#    sizer = AdaptiveBatchSizer('adding')
+#    size = sizer.Size()
+#    ... send a batch of size items, taking seconds ...
+#    sizer.Record(seconds, success)
+
+
+class AdaptiveBatchSizer(object):
+
+    def __init__(self, name, initial=100, minimum=10, maximum=1000,
+                 target_seconds=2.0, growth=1.5, shrink=0.5):
+        self.name = name
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.growth = growth
+        self.shrink = shrink
+        self.history = [initial]
+        self.lock = threading.Lock()
+
+    def Size(self):
+        with self.lock:
+            return self.size
+
+    def Record(self, seconds, success):
+        # Adjust the batch size after a call. Returns the new size.
+        with self.lock:
+            if not success:
+                size = self.size * self.shrink
+            elif seconds > self.target_seconds:
+                # Too slow: scale down towards the target time
+                size = self.size * max(self.shrink, self.target_seconds / seconds)
+            elif seconds < self.target_seconds / 2:
+                size = self.size * self.growth
+            else:
+                size = self.size
+            size = int(max(self.minimum, min(self.maximum, size)))
+            if size != self.size:
+                print "Batch size for " + self.name + ": " + self.size.__str__() + \
+                    " -> " + size.__str__()
+                self.size = size
+                self.history.append(size)
+            return size
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+import array
+import heapq
+
+# NumPy is imported when the first ColumnarLibrary is created, so importing
+# this module stays cheap
+numpy = None
+_numpy_checked = False
+
+
+def _ImportNumpy():
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_checked = True
+
+# Compact, column oriented copy of a library (the list of track dictionaries
+# returned by GetLibrary or LoadLocalJSON). Numbers are kept in typed arrays
+# and genre, artist and album names are interned into integer codes, which
+# takes a fraction of the memory of the gmusicapi dictionaries. Filters are
+# evaluated as masks over whole columns, using NumPy when it is installed.
+#
+# Usage:
+#    columns = ColumnarLibrary.FromTracks(library)
+#    played = columns.Take(columns.PlayedMask())
+#    columns[0]['title']  # rows still behave like track dictionaries
+
+# Value stored when a track has no value for a numeric field
+MISSING = -1
+
+
+class StringTable(object):
+    # Interns strings into small integer codes
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def Code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+
+class TrackRow(object):
+    # Dict-like view of one track of a ColumnarLibrary. The FIELDS can be
+    # assigned (e.g. by LoadLastPlayedDB); other keys can't be stored.
+
+    __slots__ = ('library', 'index')
+
+    def __init__(self, library, index):
+        self.library = library
+        self.index = index
+
+    def __getitem__(self, key):
+        value = self.library.Value(key, self.index)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.library.Value(key, self.index) is not None
+
+    def __setitem__(self, key, value):
+        self.library.SetValue(key, self.index, value)
+
+    def get(self, key, default=None):
+        value = self.library.Value(key, self.index)
+        if value is None:
+            return default
+        return value
+
+    def keys(self):
+        return [key for key in ColumnarLibrary.FIELDS if key in self]
+
+    def ToDict(self):
+        return dict((key, self[key]) for key in self.keys())
+
+
+class ColumnarLibrary(object):
+
+    FIELDS = ('id', 'title', 'artist', 'album', 'genre', 'playCount', 'rating',
+              'lastPlayed', 'lastModifiedTimestamp', 'year', 'trackNumber')
+
+    def __init__(self):
+        _ImportNumpy()
+        self.ids = []
+        self.titles = []
+        self.artists = StringTable()
+        self.albums = StringTable()
+        self.genres = StringTable()
+        self.artist_codes = array.array('i')
+        self.album_codes = array.array('i')
+        self.genre_codes = array.array('i')
+        self.play_counts = array.array('l')
+        self.ratings = array.array('b')
+        self.years = array.array('i')
+        self.track_numbers = array.array('i')
+        # Timestamps are doubles, which hold microsecond epochs exactly
+        self.last_played = array.array('d')
+        self.last_modified = array.array('d')
+        self._numpy_columns = {}
+        self._id_ranks = None
+
+    @classmethod
+    def FromTracks(cls, library):
+        columns = cls()
+        for track in library:
+            columns.Append(track)
+        return columns
+
+    def Append(self, track):
+        self.ids.append(track.get('id'))
+        self.titles.append(track.get('title'))
+        self.artist_codes.append(self.artists.Code(track.get('artist')))
+        self.album_codes.append(self.albums.Code(track.get('album')))
+        self.genre_codes.append(self.genres.Code(track.get('genre')))
+        self.play_counts.append(int(track.get('playCount', MISSING)))
+        self.ratings.append(int(track.get('rating', MISSING)))
+        self.years.append(int(track.get('year', MISSING)))
+        self.track_numbers.append(int(track.get('trackNumber', MISSING)))
+        self.last_played.append(float(track.get('lastPlayed', MISSING)))
+        self.last_modified.append(float(track.get('lastModifiedTimestamp', MISSING)))
+        self._numpy_columns = {}
+        self._id_ranks = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return TrackRow(self, index)
+
+    def __iter__(self):
+        for index in xrange(len(self.ids)):
+            yield TrackRow(self, index)
+
+    def Value(self, key, index):
+        # Returns the value of a field for one track, or None if it is unset
+        if key == 'id':
+            return self.ids[index]
+        if key == 'title':
+            return self.titles[index]
+        if key == 'artist':
+            return self.artists.values[self.artist_codes[index]]
+        if key == 'album':
+            return self.albums.values[self.album_codes[index]]
+        if key == 'genre':
+            return self.genres.values[self.genre_codes[index]]
+        if key == 'playCount':
+            return self._Number(self.play_counts[index])
+        if key == 'rating':
+            rating = self.ratings[index]
+            return None if rating == MISSING else str(rating)
+        if key == 'year':
+            return self._Number(self.years[index])
+        if key == 'trackNumber':
+            return self._Number(self.track_numbers[index])
+        if key == 'lastPlayed':
+            return self._Number(self.last_played[index])
+        if key == 'lastModifiedTimestamp':
+            timestamp = self.last_modified[index]
+            # gmusicapi returns this one as a string
+            return None if timestamp == MISSING else str(int(timestamp))
+        return None
+
+    # Numeric fields and their columns
+    NUMBER_COLUMNS = {'playCount': ('play_counts', int), 'rating': ('ratings', int),
+                      'year': ('years', int), 'trackNumber': ('track_numbers', int),
+                      'lastPlayed': ('last_played', float),
+                      'lastModifiedTimestamp': ('last_modified', float)}
+
+    def SetValue(self, key, index, value):
+        # Sets a field of one track; None unsets it
+        if key in self.NUMBER_COLUMNS:
+            name, convert = self.NUMBER_COLUMNS[key]
+            getattr(self, name)[index] = MISSING if value is None else convert(value)
+            self._numpy_columns.pop(name, None)
+        elif key == 'id':
+            self.ids[index] = value
+            self._id_ranks = None
+        elif key == 'title':
+            self.titles[index] = value
+        elif key in ('artist', 'album', 'genre'):
+            name = key + '_codes'
+            getattr(self, name)[index] = getattr(self, key + 's').Code(value)
+            self._numpy_columns.pop(name, None)
+        else:
+            raise KeyError("ColumnarLibrary has no column for " + key.__str__())
+
+    def _Number(self, value):
+        return None if value == MISSING else value
+
+    def Column(self, name):
+        # Returns a column as a NumPy array if NumPy is available
+        column = getattr(self, name)
+        if numpy is None:
+            return column
+        if name not in self._numpy_columns:
+            self._numpy_columns[name] = numpy.asarray(column)
+        return self._numpy_columns[name]
+
+    def _Compare(self, name, test):
+        column = self.Column(name)
+        if numpy is not None:
+            return test(column)
+        return [test(value) for value in column]
+
+    def AllMask(self):
+        if numpy is not None:
+            return numpy.ones(len(self.ids), dtype=bool)
+        return [True] * len(self.ids)
+
+    def PlayedMask(self, played=True):
+        if played:
+            return self._Compare('play_counts', lambda value: value != MISSING)
+        return self._Compare('play_counts', lambda value: value == MISSING)
+
+    def RatingMask(self, ratings):
+        codes = [int(rating) for rating in ratings]
+        if numpy is not None:
+            return numpy.in1d(self.Column('ratings'), codes)
+        codes = set(codes)
+        return [rating in codes for rating in self.ratings]
+
+    def GenreMask(self, genres, exclude=False):
+        codes = [self.genres.codes[genre] for genre in genres if genre in self.genres.codes]
+        if numpy is not None:
+            return numpy.in1d(self.Column('genre_codes'), codes, invert=exclude)
+        codes = set(codes)
+        return [(code in codes) != exclude for code in self.genre_codes]
+
+    def And(self, mask, other):
+        if numpy is not None:
+            return numpy.logical_and(mask, other)
+        return [a and b for a, b in zip(mask, other)]
+
+    def Indices(self, mask):
+        if numpy is not None:
+            return numpy.flatnonzero(mask)
+        return [index for index, selected in enumerate(mask) if selected]
+
+    def Take(self, mask):
+        # Returns a new ColumnarLibrary holding only the selected tracks
+        subset = ColumnarLibrary()
+        for index in self.Indices(mask):
+            subset.Append(self[index].ToDict())
+        return subset
+
+    def SpecMask(self, spec):
+        # Mask of the tracks matching a PlaylistSpec's declarative filters
+        mask = None
+        if spec.ratings is not None:
+            mask = self.RatingMask(spec.ratings)
+        if spec.genre is not None:
+            genre_mask = self.GenreMask([spec.genre])
+            mask = genre_mask if mask is None else self.And(mask, genre_mask)
+        if spec.excluded_genres is not None:
+            genre_mask = self.GenreMask(spec.excluded_genres, exclude=True)
+            mask = genre_mask if mask is None else self.And(mask, genre_mask)
+        if mask is None:
+            mask = self.AllMask()
+        return mask
+
+    # PlaylistSpec sort keys which map straight onto a column
+    SORT_COLUMNS = {'playCount': 'play_counts', 'lastPlayed': 'last_played',
+                    'year': 'years', 'trackNumber': 'track_numbers'}
+
+    def TopRows(self, spec):
+        # Returns the rows a PlaylistSpec selects, in playlist order
+        indices = self.Indices(self.SpecMask(spec))
+        if spec.track_filter is not None:
+            indices = [index for index in indices if spec.track_filter(self[index])]
+        column_name = self.SORT_COLUMNS.get(spec.sort_key)
+        if column_name is None or spec.values is not None:
+            rows = [self[index] for index in indices]
+            return heapq.nsmallest(spec.limit, rows, key=spec.Rank)
+
+        # Missing values sort as 0, the same as PlaylistSpec.Rank
+        if numpy is not None and len(indices) > 0:
+            indices = numpy.asarray(indices)
+            values = self.Column(column_name)[indices].astype(float)
+            values[values == MISSING] = 0
+            if spec.reverse:
+                values = -values
+            order = numpy.lexsort((self.IdRanks()[indices], values))
+            return [self[int(index)] for index in indices[order[:spec.limit]]]
+
+        column = getattr(self, column_name)
+        sign = -1 if spec.reverse else 1
+
+        def Rank(index):
+            value = column[index]
+            return (sign * (0 if value == MISSING else value), self.ids[index])
+        return [self[index] for index in heapq.nsmallest(spec.limit, indices, key=Rank)]
+
+    def IdRanks(self):
+        # Position of each track when ordered by id, used to break ties
+        if self._id_ranks is None:
+            order = sorted(xrange(len(self.ids)), key=self.ids.__getitem__)
+            ranks = numpy.empty(len(order), dtype=numpy.int64)
+            ranks[order] = numpy.arange(len(order))
+            self._id_ranks = ranks
+        return self._id_ranks
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+import BaseHTTPServer
+import SocketServer
+import collections
+import json
+import threading
+import time
+import urlparse
+
+# Local stand-in for the Last.FM web service, serving the calls LastFMSession
+# makes (auth.getMobileSession, track.getInfo and track.scrobble) on
+# 127.0.0.1. Point LASTFM_WS_SERVER at its URL to run lookups and scrobbles
+# offline. Play counts are looked up by (artist, title); titles listed in
+# failing answer with a Last.FM error instead.
+#
+# Usage:
+#    server = FakeLastFM(play_counts={('Artist', 'Title'): 3})
+#    server.Start()
+#    os.environ['LASTFM_WS_SERVER'] = server.URL()
+#    ...
+#    server.calls          # Counter of methods called
+#    server.request_times  # time.time() of every request
+#    server.Stop()
+
+# Last.FM's "invalid parameters" error, sent for titles in failing
+ERROR_CODE = 6
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        params = dict(urlparse.parse_qsl(body, True))
+        data = json.dumps(self.server.fake.Answer(params))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', len(data).__str__())
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeLastFM(object):
+
+    def __init__(self, play_counts=None, failing=None):
+        self.play_counts = dict(play_counts or {})
+        self.failing = set(failing or [])
+        self.calls = collections.Counter()
+        self.request_times = []
+        self.scrobbles = []
+        self.lock = threading.Lock()
+        self.server = None
+
+    def Start(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.fake = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def Stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def URL(self):
+        return 'http://127.0.0.1:' + self.server.server_port.__str__() + '/2.0/'
+
+    def Answer(self, params):
+        method = params.get('method')
+        with self.lock:
+            self.calls[method] += 1
+            self.request_times.append(time.time())
+        if method == 'auth.getMobileSession':
+            return {'session': {'name': params.get('username'), 'key': 'fake-session-key'}}
+        if method == 'track.getInfo':
+            if params.get('track') in self.failing:
+                return {'error': ERROR_CODE, 'message': 'Track not found'}
+            plays = self.play_counts.get((params.get('artist'), params.get('track')), 0)
+            return {'track': {'name': params.get('track'), 'userplaycount': plays.__str__()}}
+        if method == 'track.scrobble':
+            count = 0
+            while 'artist[' + count.__str__() + ']' in params:
+                index = '[' + count.__str__() + ']'
+                with self.lock:
+                    self.scrobbles.append((params['artist' + index], params['track' + index],
+                                           int(params['timestamp' + index])))
+                count += 1
+            return {'scrobbles': {'@attr': {'accepted': count, 'ignored': 0}}}
+        return {'error': 3, 'message': 'Invalid method'}
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+import collections
+import random
+import threading
+import time
+import uuid
+
+from music_backend import MusicBackend
+
+# In-memory stand-in for gmusicapi's Mobileclient. It implements the calls
+# GoogleMusic_Util makes, keeps the library and playlists in dictionaries and
+# counts every call, so GoogleMusic_Util can be exercised offline.
+#
+# Each call can be given a simulated latency, a random error rate and a
+# quota (at most quota_calls calls per quota_window seconds), to test
+# throughput, retries and backoff without Google's servers.
+#
+# Usage:
+#    api = FakeMobileclient(library, playlists, latency=(0.1, 0.5),
+#                           error_rate=0.05, quota_calls=20, quota_window=1)
+#    util = GoogleMusic_Util(backend=api)
+#    util.UnratedPlaylist(util.GetLibrary(), util.GetPlaylists())
+#    api.calls   # Counter of API calls made
+#    api.errors  # Counter of errors injected
+
+
+def _Now():
+    # Microsecond timestamps, as strings, like the real API
+    return str(int(time.time() * 1000000))
+
+
+class FakeBackendError(Exception):
+    pass
+
+
+class FakeQuotaExceeded(FakeBackendError):
+    pass
+
+
+class FakeMobileclient(MusicBackend):
+
+    # latency is a number of seconds or a (minimum, maximum) range
+    def __init__(self, library=None, playlists=None, latency=0, error_rate=0.0,
+                 quota_calls=None, quota_window=1.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_calls = quota_calls
+        self.quota_window = quota_window
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.recent_calls = collections.deque()
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self.songs = collections.OrderedDict()
+        self.playlists = collections.OrderedDict()
+        self.entries = {}
+        for track in library or []:
+            self.songs[track['id']] = dict(track)
+        for playlist in playlists or []:
+            playlist = dict(playlist)
+            tracks = playlist.pop('tracks', [])
+            playlist['tracks'] = []
+            self.playlists[playlist['id']] = playlist
+            for entry in tracks:
+                entry = dict(entry)
+                entry.setdefault('playlistId', playlist['id'])
+                self.entries[entry['id']] = entry
+                playlist['tracks'].append(entry)
+
+    def _Call(self, name):
+        # Counts the call, then waits and fails like a real server might.
+        # Fails before changing anything, so a retried call is safe.
+        with self.lock:
+            self.calls[name] += 1
+            now = time.time()
+            if self.quota_calls is not None:
+                while self.recent_calls and self.recent_calls[0] <= now - self.quota_window:
+                    self.recent_calls.popleft()
+                if len(self.recent_calls) >= self.quota_calls:
+                    self.errors[name] += 1
+                    raise FakeQuotaExceeded("Quota exceeded for " + name)
+                self.recent_calls.append(now)
+            if isinstance(self.latency, tuple):
+                delay = self.random.uniform(*self.latency)
+            else:
+                delay = self.latency
+            fail = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            with self.lock:
+                self.errors[name] += 1
+            raise FakeBackendError("Injected error in " + name)
+
+    def login(self, *args, **kwargs):
+        self._Call('login')
+        return True
+
+    def is_authenticated(self):
+        return True
+
+    def get_all_songs(self, incremental=False, include_deleted=None):
+        self._Call('get_all_songs')
+        with self.lock:
+            songs = [dict(track) for track in self.songs.values()]
+            if incremental:
+                return iter([songs])
+            return songs
+
+    def get_all_user_playlist_contents(self):
+        self._Call('get_all_user_playlist_contents')
+        with self.lock:
+            playlists = []
+            for playlist in self.playlists.values():
+                playlist = dict(playlist)
+                playlist['tracks'] = [dict(entry) for entry in playlist['tracks']]
+                playlists.append(playlist)
+            return playlists
+
+    def create_playlist(self, name, description=None, public=False):
+        self._Call('create_playlist')
+        with self.lock:
+            playlist_id = str(uuid.uuid4())
+            self.playlists[playlist_id] = {'id': playlist_id, 'name': name,
+                                           'description': description or '',
+                                           'type': 'USER_GENERATED',
+                                           'lastModifiedTimestamp': _Now(),
+                                           'tracks': []}
+            return playlist_id
+
+    def edit_playlist(self, playlist_id, new_name=None, new_description=None, public=None):
+        self._Call('edit_playlist')
+        with self.lock:
+            playlist = self.playlists[playlist_id]
+            if new_name is not None:
+                playlist['name'] = new_name
+            if new_description is not None:
+                playlist['description'] = new_description
+            playlist['lastModifiedTimestamp'] = _Now()
+            return playlist_id
+
+    def add_songs_to_playlist(self, playlist_id, song_ids):
+        self._Call('add_songs_to_playlist')
+        with self.lock:
+            if isinstance(song_ids, basestring):
+                song_ids = [song_ids]
+            playlist = self.playlists[playlist_id]
+            entry_ids = []
+            for song_id in song_ids:
+                entry = {'id': str(uuid.uuid4()), 'trackId': song_id,
+                         'playlistId': playlist_id, 'clientId': str(uuid.uuid4()),
+                         'absolutePosition': '%020d' % len(playlist['tracks']),
+                         'lastModifiedTimestamp': _Now()}
+                self.entries[entry['id']] = entry
+                playlist['tracks'].append(entry)
+                entry_ids.append(entry['id'])
+            return entry_ids
+
+    def remove_entries_from_playlist(self, entry_ids):
+        self._Call('remove_entries_from_playlist')
+        with self.lock:
+            if isinstance(entry_ids, basestring):
+                entry_ids = [entry_ids]
+            removed = {}
+            removed_ids = []
+            for entry_id in entry_ids:
+                entry = self.entries.pop(entry_id, None)
+                if entry is not None:
+                    removed.setdefault(entry['playlistId'], set()).add(entry_id)
+                    removed_ids.append(entry_id)
+            for playlist_id, playlist_entry_ids in removed.items():
+                playlist = self.playlists[playlist_id]
+                playlist['tracks'] = [entry for entry in playlist['tracks']
+                                      if entry['id'] not in playlist_entry_ids]
+            return removed_ids
+
+    def reorder_playlist_entry(self, entry, to_follow_entry=None, to_precede_entry=None):
+        self._Call('reorder_playlist_entry')
+        with self.lock:
+            playlist = self.playlists[entry['playlistId']]
+            tracks = [track for track in playlist['tracks'] if track['id'] != entry['id']]
+            if to_follow_entry is not None:
+                position = [track['id'] for track in tracks].index(to_follow_entry['id']) + 1
+            elif to_precede_entry is not None:
+                position = [track['id'] for track in tracks].index(to_precede_entry['id'])
+            else:
+                position = len(tracks)
+            tracks.insert(position, self.entries[entry['id']])
+            playlist['tracks'] = tracks
+            return entry
+
+    def increment_song_playcount(self, song_id, plays=1, playtime=None):
+        self._Call('increment_song_playcount')
+        with self.lock:
+            track = self.songs[song_id]
+            track['playCount'] = track.get('playCount', 0) + plays
+            track['lastModifiedTimestamp'] = _Now()
+            return song_id
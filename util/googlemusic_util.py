@@ -1,15 +1,32 @@
 #!/usr/bin/env python
-from gmusicapi import Mobileclient
 import json
 import os
 import sys
-import smtplib
-import pylast
+import threading
 import time
 import random
 import operator
-import csv
-from datetime import datetime, timedelta
+from datetime import datetime
+from columnar_library import ColumnarLibrary
+from instrumentation import Instrumentation, Timed
+from lastfm_fetcher import PlayCountFetcher
+from last_played_store import LastPlayedStore
+from lastfm_session import LastFMSession
+from library_diff import LibraryDiff
+from library_index import LibraryIndex
+from playlist_executor import PlaylistMutationExecutor
+from play_history import PlayHistory
+from playlist_index import PlaylistIndex
+from playcount_cache import PlayCountCache
+from playlist_sync import PlaylistSyncPlan
+from scrobble_log import ScrobbleLog
+from scrobble_outbox import ScrobbleOutbox
+from snapshot_io import DumpTracksToJSONL, IterTracksFromJSONL
+from snapshot_history import SnapshotHistory
+from snapshot_store import SnapshotStore
+from track_export import ExportTracks
+from track_match import CleanName, MatchIndex
+from playlist_specs import PlaylistSpec, PlaylistGenerator, THUMBS_UP, UNRATED
 
 # This class is a collection of useful methods for dealing with the unofficial
 # Google Music python API. (https://github.com/simon-weber/gmusicapi)
@@ -25,7 +42,11 @@ from datetime import datetime, timedelta
 #
 #    from googlemusic_util import GoogleMusic_Util
 #    util = GoogleMusic_Util()
-#    util.DumpLibrary('library.json')
+#    util.DumpTracksToJSON(util.GetLibrary(), 'library.json')
+#
+#    gmusicapi is only imported, and the login only happens, when the first
+#    Google Music call is made, so offline work on local snapshots (e.g.
+#    LoadLocalJSON, FindNewPlays, DumpTracksToCSV) starts quickly.
 #
 # Notes:
 # Warning: When you log in with this utility, it registers your computer as an
@@ -35,36 +56,106 @@ from datetime import datetime, timedelta
 
 class GoogleMusic_Util(object):
 
-    def __init__(self, login=True, dry_run=False):
-        if login:
-            try:
-                google_username = os.environ.get('USERNAME')
-                google_password = os.environ.get('PASSWORD')
-
-                api = Mobileclient()
-                api.login(google_username, google_password,
-                          Mobileclient.FROM_MAC_ADDRESS)
-                if api.is_authenticated():
-                    self.api = api
-            except:
-                print "ERROR: Unable to login with the credentials provided!"
-                sys.exit(1)
+    # backend replaces the Mobileclient login, e.g. with a FakeMobileclient
+    # for offline testing. It must implement the calls in MusicBackend.
+    #
+    # Every API and Last.fm call and every @Timed method is recorded in
+    # self.instrumentation; see WriteMetrics.
+    def __init__(self, login=True, dry_run=False, backend=None):
+        self.instrumentation = Instrumentation()
+        self._api = self.instrumentation.Wrap(backend, 'api_call') if backend is not None else None
+        self.login = login and backend is None
+        self.lastfm = None
+        self.lastfm_lock = threading.Lock()
+        self.scrobble_outbox = None
+        self.playcount_cache = None
+        self.play_history = None
+        self.play_history_lock = threading.Lock()
+        self.playlist_executor = None
+        self.playlist_index = None
+        self.library_index = None
+        self.match_index = None
         if dry_run:
             print "Dry-run mode enabled. Logging only. No changes will be made."
             self.dry_run = True
         else:
             self.dry_run = False
 
-    def AddSongsToPlaylist(self, playlists, playlist_name, list_of_songs, batch_size=100):
+    @property
+    def api(self):
+        # The Mobileclient session is created on first use
+        if self._api is None and self.login:
+            self.login = False
+            self._api = self.Login()
+        return self._api
+
+    @api.setter
+    def api(self, api):
+        self._api = api
+
+    def Login(self):
+        try:
+            from gmusicapi import Mobileclient
+            google_username = os.environ.get('USERNAME')
+            google_password = os.environ.get('PASSWORD')
+
+            api = self.instrumentation.Wrap(Mobileclient(), 'api_call')
+            api.login(google_username, google_password,
+                      Mobileclient.FROM_MAC_ADDRESS)
+            if api.is_authenticated():
+                return api
+        except:
+            pass
+        print "ERROR: Unable to login with the credentials provided!"
+        sys.exit(1)
+
+    @Timed
+    def AddSongsToPlaylist(self, playlists, playlist_name, list_of_songs, batch_size=None, reorder=False):
+        prepared = self.PreparePlaylistSync(playlists, playlist_name, list_of_songs)
+        if prepared is None:
+            return False
+        playlist_id, plan = prepared
+        return self.ApplyPlaylistPlan(playlist_id, plan, batch_size, reorder,
+                                      self.GetPlaylistIndex(playlists))
+
+    @Timed
+    def AddSongsToPlaylists(self, playlists, songs_by_playlist, batch_size=None, reorder=False):
+        # Sync several playlists at once. songs_by_playlist maps playlist name
+        # to list of song ids. Playlists are planned one after another, then
+        # their changes are sent concurrently. Returns {playlist name: bool}.
+        prepared = []
+        results = {}
+        for playlist_name, list_of_songs in songs_by_playlist.items():
+            sync = self.PreparePlaylistSync(playlists, playlist_name, list_of_songs)
+            if sync is None:
+                results[playlist_name] = False
+            else:
+                prepared.append((playlist_name, sync[0], sync[1]))
+
+        index = self.GetPlaylistIndex(playlists)
+        values = self.GetPlaylistExecutor().RunAll(
+            [lambda playlist_id=playlist_id, plan=plan:
+                self.ApplyPlaylistPlan(playlist_id, plan, batch_size, reorder, index)
+             for _, playlist_id, plan in prepared])
+        for (playlist_name, _, _), value in zip(prepared, values):
+            if isinstance(value, Exception):
+                print "Error syncing playlist " + playlist_name + ":", value
+            results[playlist_name] = value is True
+        return results
+
+    def PreparePlaylistSync(self, playlists, playlist_name, list_of_songs):
+        # Find or create the playlist and plan the changes to it. Returns
+        # (playlist_id, plan), or None if the list of songs is unusable.
+
         # Dont continue if new list is empty
         if len(list_of_songs) < 1:
             print 'ERROR: No songs to add!'
-            return False
+            return None
 
         # Dont continue if new list contains too many songs
         if len(list_of_songs) > 1000:
             print 'ERROR: List contains more than 1000 songs!'
-            return False
+            return None
 
         # Get the ID of the playlist if it already exists
         playlist_id = self.GetPlaylistID(playlists, playlist_name)
@@ -73,68 +164,97 @@ class GoogleMusic_Util(object):
                 print "DRY-RUN: Would create playlist", playlist_name
             else:
                 # Create a new playlist
-                playlist_id = self.api.create_playlist(playlist_name)
+                playlist_id = self.GetPlaylistExecutor().CreatePlaylist(playlist_name)
+                if playlist_id is None:
+                    return None
+                self.GetPlaylistIndex(playlists).AddPlaylist(playlist_id, playlist_name)
                 print "Created new playlist:", playlist_name
             existing_tracks = [] # empty
         else:
-            # Remove tracks from existing playlist if needed
             existing_tracks = self.GetTracksInPlaylist(playlists, playlist_name)
-            tracks_to_remove = []
-            if len(existing_tracks) > 0:
-                for track in existing_tracks:
-                    if track['trackId'] not in list_of_songs:
-                        tracks_to_remove.append(track['id'])
-
-            if len(tracks_to_remove) > 0:
-                self.RemoveTracksFromPlaylist(tracks_to_remove)
-
-        tracks_to_add = []
-        for new_track in list_of_songs:
-            if any(new_track == old_track['trackId'] for old_track in existing_tracks):
-                True # track already exists in playlist
-            else:
-                tracks_to_add.append(new_track)
 
+        plan = self.PlanPlaylistSync(existing_tracks, list_of_songs, playlist_name)
+        return playlist_id, plan
+
+    def PlanPlaylistSync(self, existing_tracks, list_of_songs, playlist_name=None):
+        # Returns a PlaylistSyncPlan with the tracks to add, the entries to
+        # remove and the entries to move
+        plan = PlaylistSyncPlan.Build(existing_tracks, list_of_songs, playlist_name)
+        plan.Print()
+        return plan
+
+    def GetPlaylistExecutor(self):
+        # One executor per run, so every playlist shares its rate limit
+        if self.playlist_executor is None:
+            self.playlist_executor = PlaylistMutationExecutor(self.api, instrumentation=self.instrumentation)
+        return self.playlist_executor
+
+    @Timed
+    def ApplyPlaylistPlan(self, playlist_id, plan, batch_size=None, reorder=False, index=None):
+        # Returns True if every batch succeeded. If a PlaylistIndex is given
+        # it is kept up to date with the changes.
+        success = True
+
+        # Remove tracks from existing playlist if needed
+        if len(plan.to_remove) > 0:
+            success = self.RemoveTracksFromPlaylist(plan.to_remove, batch_size, plan.playlist_name, index)
+
+        tracks_to_add = plan.to_add
         if len(tracks_to_add) > 0:
             print "Adding " + len(tracks_to_add).__str__() + " tracks to playlist..."
             if self.dry_run:
-                print "DRY-RUN: Would add these songs to playlist", playlist_name
+                print "DRY-RUN: Would add these songs to playlist", plan.playlist_name
             else:
-                for i in range(0, len(tracks_to_add), batch_size):
-                    for retries in range(0,5):
-                        try:
-                            tracks_added = self.api.add_songs_to_playlist(playlist_id, tracks_to_add[i:i+batch_size])
-                            #print "Successfully added " + len(tracks_added).__str__() + " tracks to playlist."
-                            #sleep(0.5)
-                        except:
-                            print "Error adding tracks. Trying again..."
-                            continue
-                        break
-            print "Successfully added " + len(tracks_to_add).__str__() + " tracks to playlist."
+                batches = self.GetPlaylistExecutor().AddSongs(playlist_id, tracks_to_add,
+                                                              batch_size, plan.playlist_name)
+                added = 0
+                for batch in batches:
+                    if batch.success:
+                        added += batch.size
+                        if index is not None and batch.value:
+                            index.AddEntries(playlist_id, batch.value, batch.items)
+                print "Successfully added " + added.__str__() + " tracks to playlist."
+                if added < len(tracks_to_add):
+                    success = False
         else:
             print "No new tracks to add"
+
+        # Moving entries costs one call each, so it is only done on request.
+        # Only kept entries are moved; added tracks stay at the end.
+        if reorder and len(plan.moves) > 0:
+            if self.dry_run:
+                print "DRY-RUN: Would move " + len(plan.moves).__str__() + " tracks in playlist", plan.playlist_name
+            else:
+                for entry, to_follow, to_precede in plan.moves:
+                    self.api.reorder_playlist_entry(entry,
+                                                    to_follow_entry=to_follow,
+                                                    to_precede_entry=to_precede)
+                print "Moved " + len(plan.moves).__str__() + " tracks in playlist."
+
         # Update playlist description
         if not self.dry_run:
-            self.api.edit_playlist(playlist_id, new_description="Synced " + time.strftime('%m/%d/%Y, %I:%M:%S %p', time.localtime()))
-        return True
-
-    def RemoveTracksFromPlaylist(self, list_of_tracks, batch_size=100):
+            self.GetPlaylistExecutor().EditPlaylist(
+                playlist_id, plan.playlist_name,
+                new_description="Synced " + time.strftime('%m/%d/%Y, %I:%M:%S %p', time.localtime()))
+        return success
+
+    @Timed
+    def RemoveTracksFromPlaylist(self, list_of_tracks, batch_size=None, playlist_name=None, index=None):
+        # Returns True if every batch was removed
         print "Removing " + len(list_of_tracks).__str__() + ' tracks from playlist...'
         if self.dry_run:
             print "DRY-RUN: Not removing tracks from playlist"
-        else:
-            for i in range(0, len(list_of_tracks), batch_size):
-                for retries in range(0, 5):
-                    try:
-                        tracks_removed = self.api.remove_entries_from_playlist(list_of_tracks[i:i+batch_size])
-                        #print len(tracks_removed).__str__() + ' tracks removed from playlist.'
-                        #sleep(0.5)
-                    except:
-                        "Error removing tracks. Trying again..."
-                        continue
-                    break
-
-        print len(list_of_tracks).__str__() + ' tracks removed from playlist.'
+            return True
+
+        batches = self.GetPlaylistExecutor().RemoveEntries(list_of_tracks, batch_size, playlist_name)
+        removed = 0
+        for batch in batches:
+            if batch.success:
+                removed += batch.size
+                if index is not None:
+                    index.RemoveEntries(batch.items)
+        print removed.__str__() + ' tracks removed from playlist.'
+        return removed == len(list_of_tracks)
 
     def LoadLocalJSON(self, file_name):
         # Open tracks from previous run json file
@@ -148,12 +268,14 @@ class GoogleMusic_Util(object):
         except:
             print "ERROR: Unable to load local library file!"
 
+    @Timed
     def GetLibrary(self):
         print "Getting library..."
         library = self.api.get_all_songs()
         print len(library), 'tracks detected.'
         return library
 
+    @Timed
     def GetPlaylists(self):
         # Get all playlists including tracks in each
         print "Getting list of playlists..."
@@ -161,6 +283,63 @@ class GoogleMusic_Util(object):
         print len(all_playlists), 'playlists detected.'
         return all_playlists
 
+    def GetChangedItems(self, call_name, updated_after):
+        # Fetch only the items of a Mobileclient list call (e.g. 'ListTracks'),
+        # including deleted ones, modified after the given timestamp in
+        # microseconds. Falls back to None if the API (or a stub backend
+        # without gmusicapi) doesn't support incremental fetches.
+        try:
+            from gmusicapi.protocol import mobileclient
+            return self.api._get_all_items(getattr(mobileclient, call_name), False, True,
+                                           updated_after=datetime.utcfromtimestamp(updated_after / 1000000.0))
+        except Exception:
+            print "Incremental fetch not supported, fetching everything..."
+            return None
+
+    @Timed
+    def SyncLibrary(self, store='library.db'):
+        # Bring a SnapshotStore up to date and return the library from it.
+        # Only tracks changed since the last sync are downloaded. store can
+        # also be the file name of the SQLite database.
+        if not isinstance(store, SnapshotStore):
+            store = SnapshotStore(store)
+        last_modified = store.LastModified('tracks')
+        changed = None
+        if last_modified is not None:
+            print "Getting library changes..."
+            changed = self.GetChangedItems('ListTracks', last_modified)
+        if changed is None:
+            upserted, deleted = store.ReplaceTracks(self.api.get_all_songs())
+        else:
+            upserted, deleted = store.UpsertTracks(changed)
+        print upserted, 'tracks updated,', deleted, 'tracks deleted.'
+        library = store.Library()
+        print len(library), 'tracks detected.'
+        return library
+
+    @Timed
+    def SyncPlaylists(self, store='library.db'):
+        # Bring the playlists in a SnapshotStore up to date and return them
+        # in the same shape as GetPlaylists
+        if not isinstance(store, SnapshotStore):
+            store = SnapshotStore(store)
+        if store.LastModified('playlists') is None:
+            store.ReplacePlaylists(self.api.get_all_user_playlist_contents())
+        else:
+            print "Getting playlist changes..."
+            playlists = self.GetChangedItems('ListPlaylists', store.LastModified('playlists'))
+            entries = self.GetChangedItems('ListPlaylistEntries',
+                                           store.LastModified('playlist_entries') or 0)
+            if playlists is None or entries is None:
+                store.ReplacePlaylists(self.api.get_all_user_playlist_contents())
+            else:
+                store.UpsertPlaylists(playlists)
+                store.UpsertPlaylistEntries(entries)
+        all_playlists = store.Playlists()
+        print len(all_playlists), 'playlists detected.'
+        return all_playlists
+
+    @Timed
     def DumpTracksToJSON(self, list_of_tracks, json_file):
         try:
             with open(json_file, 'wb') as fp:
@@ -171,82 +350,60 @@ class GoogleMusic_Util(object):
 
         print "Wrote " + len(list_of_tracks).__str__() + " total tracks to " + json_file
 
-    def DumpTracksToCSV(self, list_of_tracks, csv_file):
-        # print "Opening CSV for writing..."
-        # Open CSV file
-        f = open(csv_file, 'wt')
-
-        # Write header row
-        writer = csv.writer(f, delimiter=',')
-        writer.writerow(('Artist', 'Album', 'Title', 'Genre', 'Plays', 'Rating', 'Last Played'))
-
-        # Write each track to CSV
-        for track in list_of_tracks:
-
-            # Not all fields may be present and usable
-            try:
-                artist = (track['artist']).encode('utf-8')
-            except:
-                artist = ''
-
-            try:
-                album = (track['album']).encode('utf-8')
-            except:
-                album = ''
-
-            try:
-                title = (track['title']).encode('utf-8')
-            except:
-                title = ''
-
-            try:
-                genre = (track['genre']).encode('utf-8')
-            except:
-                genre = ''
-
-            try:
-                plays = track['playCount']
-            except:
-                plays = ''
-
-            try:
-                rating = track['rating']
-            except:
-                rating = ''
-
-            try:
-                lastPlayed = (track['lastPlayed']).encode('utf-8')
-            except:
-                lastPlayed = ''
-
-
-            writer.writerow((artist, album, title, genre, plays, rating, lastPlayed))
-
-        f.close()
-        print "Wrote " + len(list_of_tracks).__str__() + " total tracks to " + csv_file
-        # print
+    @Timed
+    def DumpTracksToJSONL(self, list_of_tracks, jsonl_file, compression=None):
+        # Streams one track per line. Compression is 'gzip' or 'zstd', or is
+        # picked from a .gz/.zst file extension.
+        try:
+            count = DumpTracksToJSONL(list_of_tracks, jsonl_file, compression)
+        except Exception as e:
+            print "ERROR: Unable to dump library to JSON Lines file!", e
+            return
+
+        print "Wrote " + count.__str__() + " total tracks to " + jsonl_file
+
+    def IterLocalJSONL(self, file_name, compression=None):
+        # Generator over the tracks in a snapshot file. It can be passed
+        # straight to FindNewPlays, the filters and BuildPlaylists.
+        return IterTracksFromJSONL(file_name, compression)
+
+    @Timed
+    def DumpTracksToCSV(self, list_of_tracks, csv_file, fields=None):
+        # Writes the tracks (any iterable) as CSV, or as TSV or Parquet
+        # depending on the extension; fields is a field spec, see
+        # track_export. A .gz or .zst extension compresses the file.
+        count = ExportTracks(list_of_tracks, csv_file, fields)
+        print "Wrote " + count.__str__() + " total tracks to " + csv_file
 
     def FilterForUnplayed(self, library):
         # Returns library of unplayed songs
-        unplayed_songs = []
-        for track in library:
-            if 'playCount' not in track.keys():
-                unplayed_songs.append(track)
+        if isinstance(library, ColumnarLibrary):
+            unplayed_songs = library.Take(library.PlayedMask(False))
+        else:
+            unplayed_songs = [track for track in library if 'playCount' not in track]
 
         print len(unplayed_songs), 'unplayed songs.'
         return unplayed_songs
 
     def FilterForPlayed(self, library):
         # Returns library of played songs
-        played_songs = []
-        for track in library:
-            if 'playCount' in track.keys():
-                played_songs.append(track)
+        if isinstance(library, ColumnarLibrary):
+            played_songs = library.Take(library.PlayedMask())
+        else:
+            played_songs = [track for track in library if 'playCount' in track]
 
         print len(played_songs), 'played songs.'
         return played_songs
 
+    def ToColumnar(self, library):
+        # Returns a compact ColumnarLibrary copy of a GetLibrary or
+        # LoadLocalJSON library. Filters and playlist builders accept either.
+        columns = ColumnarLibrary.FromTracks(library)
+        print len(columns), 'tracks converted to columnar library.'
+        return columns
+
     def SendEmail(self, from_address, to_address, body):
+        import smtplib
         try:
             smtpObj = smtplib.SMTP('localhost')
             smtpObj.sendmail(from_address, to_address, body)
@@ -254,399 +411,492 @@ class GoogleMusic_Util(object):
         except:
             print "Error: unable to send email"
 
-    def FindNewPlays(self, old_library, new_library):
+    @Timed
+    def FindNewPlays(self, old_library, new_library, record_plays=False):
         # This returns a list of track dictionaries which have been played in
-        # the time between old_library and new_library
-        print "Scanning library for new plays. This may take some time..."
-        # Compare each entry of current library against old library.
-        # Add new track plays to list
-        new_plays = []
-        for new_track in new_library:
-            for old_track in old_library:
-                try:
-                    # For each track in the old library, look for a match
-                    # in the old library
-                    if new_track['id'] == old_track['id']:
-                        # If a match is found, check if the playcount is higher
-                        # now. First check if the playcount key even exists in
-                        # new and old tracks. If the track has never been
-                        # played then the key may not exist.
-                        if 'playCount' in new_track.keys() and 'playCount' in old_track.keys():
-                            if new_track['playCount'] > old_track['playCount']:
-                                print "Found new track play:", new_track['artist'], '-', new_track['title']
-                                # Add track to scrobble list
-                                new_plays.append(new_track)
-                        elif 'playCount' in new_track.keys() and 'playCount' not in old_track.keys():
-                            # This means the track has been played for the
-                            # first time and playCount key was created.
-                            print "Found new track play:", new_track['artist'], '-', new_track['title']
-                            # Add track to scrobble list
-                            new_plays.append(new_track)
-                        break  # Break out to for loop
-                except:
-                    continue
-            else:
-                try:
-                    # If no matches are found in old library it must be new
-                    # print "Newly added track found"
-                    if 'playCount' in new_track.keys() and new_track['playCount'] > 0:
-                        print "Found new track play:", new_track['artist'], '-', new_track['title']
-                        new_plays.append(new_track)
-                except:
-                    continue
+        # the time between old_library and new_library. With record_plays
+        # they are also added to the PlayHistory.
+        print "Scanning library for new plays..."
+        new_plays = self.DiffLibraries(old_library, new_library).new_plays
+        for track in new_plays:
+            print "Found new track play:", track.get('artist'), '-', track.get('title')
 
         print len(new_plays).__str__() + ' new plays found.'
+        if record_plays:
+            self.RecordPlays(new_plays)
         return new_plays
 
-    def ScrobbleTrack(self, track):
-        try:
-            lastfm_username = os.environ.get('LASTFM_USERNAME')
-            lastfm_password = pylast.md5(os.environ.get('LASTFM_PASSWORD'))
-            lastfm_apikey = os.environ.get('LASTFM_APIKEY')
-            lastfm_apisecret = os.environ.get('LASTFM_APISECRET')
-
-            lastfm = pylast.LastFMNetwork(api_key=lastfm_apikey,
-                                          api_secret=lastfm_apisecret,
-                                          username=lastfm_username,
-                                          password_hash=lastfm_password)
-
-            # Get last modified time of track (which seems to be last played)
-            # Divide by 1,000,000 to get unix timestamp in seconds
-            time_played = (int(track['lastModifiedTimestamp']) / 1000000)
-            print 'Scrobbling track:', \
-                track['artist'], '-', \
-                track['title'], '-', \
-                datetime.fromtimestamp(float(time_played))
+    @Timed
+    def FindNewPlaysSince(self, version, history='history.db', until=None, record_plays=False):
+        # Like FindNewPlays, but compares two versions of a SnapshotHistory
+        # (until defaults to the latest) using only the stored deltas.
+        # history can also be the file name of the SQLite database.
+        if not isinstance(history, SnapshotHistory):
+            history = SnapshotHistory(history)
+        print "Scanning snapshot history for new plays since version " + version.__str__() + "..."
+        new_plays = history.NewPlays(version, until)
+        for track in new_plays:
+            print "Found new track play:", track.get('artist'), '-', track.get('title')
 
-            lastfm.scrobble(artist=track['artist'],
-                            title=track['title'],
-                            timestamp=time_played)
+        print len(new_plays).__str__() + ' new plays found.'
+        if record_plays:
+            self.RecordPlays(new_plays)
+        return new_plays
 
-            time.sleep(0.5)
+    def GetPlayHistory(self, create=True):
+        # Every recorded play, with rollups for the recency and frequency
+        # based playlists. Without create, returns None if there is no
+        # history yet. It is shared by jobs running on different threads.
+        with self.play_history_lock:
+            if self.play_history is None:
+                if not create and not os.path.exists('play_history.db'):
+                    return None
+                self.play_history = PlayHistory()
+        return self.play_history
+
+    @Timed
+    def RecordPlays(self, tracks):
+        # Adds newly played tracks (e.g. from FindNewPlays) to the PlayHistory
+        added = self.GetPlayHistory().RecordTracks(tracks)
+        print "Recorded " + added.__str__() + " plays in play history."
+        return added
+
+    def LastPlayedTimes(self):
+        # {track id: last played} for PlaylistSpec values: the later of the
+        # PlayHistory's time and last_played.json's (the lastPlayed that
+        # LoadLastPlayedDB sets). Tracks missing from both are ranked by
+        # their own lastPlayed. None if there is no play history.
+        history = self.GetPlayHistory(create=False)
+        if history is None:
+            return None
+        last_played = history.LastPlayed()
+        for track_id, played in LastPlayedStore('last_played.json').Load().iteritems():
+            if played > last_played.get(track_id, 0):
+                last_played[track_id] = played
+        return last_played or None
+
+    @Timed
+    def RecordSnapshot(self, library, history='history.db'):
+        # Adds the library to a SnapshotHistory and returns its version
+        if not isinstance(history, SnapshotHistory):
+            history = SnapshotHistory(history)
+        version = history.Record(library)
+        print "Recorded snapshot version " + version.__str__() + "."
+        return version
+
+    def DiffLibraries(self, old_library, new_library):
+        # Returns a LibraryDiffResult with new plays, added tracks, removed
+        # tracks and metadata changes between the two snapshots
+        diff = LibraryDiff().Compare(old_library, new_library)
+        print len(diff.added).__str__() + ' added, ' + \
+            len(diff.removed).__str__() + ' removed, ' + \
+            len(diff.changed).__str__() + ' changed tracks.'
+        return diff
+
+    def GetScrobbleOutbox(self):
+        # Scrobbles go through a durable outbox so failed ones are retried
+        # later instead of being lost
+        if self.scrobble_outbox is None:
+            self.scrobble_outbox = ScrobbleOutbox()
+        return self.scrobble_outbox
+
+    def QueueScrobble(self, track):
+        # Get last modified time of track (which seems to be last played)
+        # Divide by 1,000,000 to get unix timestamp in seconds
+        time_played = (int(track['lastModifiedTimestamp']) / 1000000)
+        # Featured artists and edition suffixes are left out, so the scrobble
+        # counts towards the same Last.FM track GetLastFMPlays looks up
+        artist = CleanName(track['artist'])
+        title = CleanName(track['title'])
+        if self.dry_run:
+            print 'DRY-RUN: Would scrobble:', \
+                artist, '-', \
+                title, '-', \
+                datetime.fromtimestamp(float(time_played))
+            return
+        print 'Queueing scrobble:', \
+            artist, '-', \
+            title, '-', \
+            datetime.fromtimestamp(float(time_played))
+        self.GetScrobbleOutbox().Enqueue([(artist, title, time_played)])
+
+    @Timed
+    def FlushScrobbles(self):
+        # Send everything in the outbox to Last.FM, 50 scrobbles per request
+        outbox = self.GetScrobbleOutbox()
+        pending = outbox.Pending()
+        if pending == 0:
+            return 0
+        if self.dry_run:
+            print "DRY-RUN: Would scrobble " + pending.__str__() + " tracks"
+            return 0
+        print "Scrobbling " + pending.__str__() + " tracks..."
+        try:
+            sent = outbox.Flush(self.GetLastFMSession())
+        except Exception as e:
+            print "There was a problem scrobbling tracks:", e
+            return 0
+        print "Scrobbled " + sent.__str__() + " tracks."
+        dead_letters = len(outbox.DeadLetters())
+        if dead_letters > 0:
+            print dead_letters.__str__() + " scrobbles in the outbox are no longer sent (see DeadLetters)."
+        return sent
+
+    def ScrobbleTrack(self, track):
+        try:
+            self.QueueScrobble(track)
+            self.FlushScrobbles()
         except:
             print "There was a problem scrobbling the track."
 
     def SetPlayCount(self, track, new_plays):
-        if track['playCount'] < new_plays:
-            increment_count = new_plays - track['playCount']
-            print "incrementing play count by " + increment_count.__str__()
-            if self.dry_run:
-                print "DRY-RUN: Would increment playcount of", track['artist'] + '-' + track['album'] + '-' + track['title']
+        self.SetPlayCounts([(track, new_plays)])
+
+    @Timed
+    def SetPlayCounts(self, updates):
+        # Accepts a list of (track, new play count) tuples. Updates for the
+        # same track are coalesced into a single increment.
+        tracks = {}
+        targets = {}
+        for track, new_plays in updates:
+            if track.get('playCount', 0) < new_plays:
+                tracks[track['id']] = track
+                targets[track['id']] = max(new_plays, targets.get(track['id'], 0))
             else:
-                self.api.increment_song_playcount(track['id'], plays=increment_count)
-                time.sleep(0.5)  # Throttle calls to Google API
-        else:
-            print "Error: Current plays is higher than value provided!"
-
-    def GetLastFMPlays(self, track):
-        try:
-            lastfm_username = os.environ.get('LASTFM_USERNAME')
-            lastfm_password = pylast.md5(os.environ.get('LASTFM_PASSWORD'))
-            lastfm_apikey = os.environ.get('LASTFM_APIKEY')
-            lastfm_apisecret = os.environ.get('LASTFM_APISECRET')
+                print "Error: Current plays is higher than value provided!"
 
-            lastfm = pylast.LastFMNetwork(api_key=lastfm_apikey,
-                                          api_secret=lastfm_apisecret,
-                                          username=lastfm_username,
-                                          password_hash=lastfm_password)
+        increments = {}
+        for track_id, new_plays in targets.items():
+            track = tracks[track_id]
+            increments[track_id] = new_plays - track.get('playCount', 0)
+            print "incrementing play count of", track['artist'] + '-' + track['album'] + '-' + \
+                track['title'], "by " + increments[track_id].__str__()
 
-            lastfm_track = pylast.Track(artist=track['artist'],
-                                        title=track['title'],
-                                        network=lastfm,
-                                        username=lastfm_username)
+        if not increments:
+            return
+        if self.dry_run:
+            print "DRY-RUN: Would increment playcount of " + len(increments).__str__() + " tracks"
+            return
+        results = self.GetPlaylistExecutor().IncrementPlayCounts(increments)
+        failed = len([result for result in results if not result.success])
+        print "Incremented playcount of " + (len(results) - failed).__str__() + " tracks."
+
+    def GetLastFMSession(self):
+        # Create the Last.FM session on first use and share it for the rest
+        # of the run. It keeps its HTTP connections alive and only logs in
+        # once. PlayCountFetcher workers ask for it concurrently.
+        with self.lastfm_lock:
+            if self.lastfm is None:
+                self.lastfm = self.instrumentation.Wrap(LastFMSession.FromEnvironment(), 'lastfm_call')
+        return self.lastfm
+
+    def PrintLastFMMetrics(self):
+        if self.lastfm is None:
+            return
+        metrics = self.lastfm.Metrics()
+        print "Last.FM: " + metrics['requests'].__str__() + " requests over " + \
+            metrics['connections_opened'].__str__() + " connections (" + \
+            metrics['connections_saved'].__str__() + " saved), " + \
+            metrics['handshakes'].__str__() + " handshakes (" + \
+            metrics['handshakes_saved'].__str__() + " saved)"
+
+    def WriteMetrics(self, json_file=None, prometheus_file=None):
+        # Write the timings and counters recorded so far, as a JSON report
+        # and/or a Prometheus text file
+        if json_file:
+            self.instrumentation.WriteJSON(json_file)
+        if prometheus_file:
+            self.instrumentation.WritePrometheus(prometheus_file)
+
+    def LookupLastFMPlays(self, track):
+        # Query Last.FM for the user's play count of a track. Raises on error.
+        return self.GetLastFMSession().GetUserPlayCount(CleanName(track['artist']),
+                                                        CleanName(track['title']))
 
+    def GetLastFMPlays(self, track):
+        try:
+            plays = self.LookupLastFMPlays(track)
             time.sleep(0.5)
-            return lastfm_track.get_userplaycount()
+            return plays
         except:
             print "There was a problem connecting to Last.FM."
 
-    def SyncLastFMPlayCount(self, library):
+    def GetPlayCountCache(self):
+        # Last.FM play counts of tracks which haven't changed since they were
+        # last looked up are kept on disk
+        if self.playcount_cache is None:
+            self.playcount_cache = PlayCountCache()
+        return self.playcount_cache
+
+    def GetMatchIndex(self, library):
+        # Returns a MatchIndex of the library. It is only built once for the
+        # same library.
+        if self.match_index is None or self.match_index.library is not library \
+                or len(self.match_index) != len(library):
+            self.match_index = MatchIndex(library)
+        return self.match_index
+
+    @Timed
+    def GetLastFMPlaysBulk(self, library, workers=4, rate=5.0, use_cache=True):
+        # Look up the Last.FM play count of every track concurrently, limited
+        # to rate requests per second. Returns {track id: plays or None}.
+        # Tracks with the same MatchKey are looked up once, and with
+        # use_cache, only those missing from the PlayCountCache (or changed or
+        # expired there) are looked up.
+        queries = [group.Query() for group in self.GetMatchIndex(library).Groups()]
+        counts = {}
+        to_fetch = queries
+        if use_cache:
+            cache = self.GetPlayCountCache()
+            counts, to_fetch = cache.Split(queries)
+            print len(counts).__str__() + " Last.FM play counts cached."
+        print "Getting Last.FM play counts for " + len(to_fetch).__str__() + " tracks..."
+        fetcher = PlayCountFetcher(self.LookupLastFMPlays, workers=workers, rate=rate)
+        fetched = fetcher.FetchAll(to_fetch)
+        if fetcher.errors > 0:
+            print "There was a problem getting " + fetcher.errors.__str__() + " play counts from Last.FM."
+        if use_cache:
+            cache.Store(to_fetch, fetched)
+            cache.Evict()
+        counts.update(fetched)
+
+        index = self.GetMatchIndex(library)
+        return dict((track['id'], counts.get(index.keys[track['id']])) for track in library)
+
+    @Timed
+    def SyncLastFMPlayCount(self, library, workers=4, rate=5.0, use_cache=True):
+        # Google tracks with the same MatchKey (e.g. a remaster and the
+        # original) are one Last.FM track, so their plays are compared as a
+        # whole
+        lastfm_counts = self.GetLastFMPlaysBulk(library, workers, rate, use_cache)
+        groups = self.GetMatchIndex(library).Groups()
+        play_count_updates = []
+        changed = []
         index = 1
-        for track in library:
+        for group in groups:
             try:
                 # If the playCount key doesnt exist for this track, set it to 0
-                if 'playCount' not in track.keys():
-                    track['playCount'] = 0
+                for track in group.tracks:
+                    if 'playCount' not in track:
+                        track['playCount'] = 0
+                google_plays = group.PlayCount()
 
-                # Query Last.FM for the user's play count of this track
-                lastfm_plays = self.GetLastFMPlays(track)
+                # The user's Last.FM play count of this track
+                lastfm_plays = lastfm_counts.get(group.tracks[0]['id'])
 
                 # Debugging information
-                print index.__str__() + "/" + len(library).__str__() + " Last.fm: " + lastfm_plays.__str__() + \
-                      ", Google: " + track['playCount'].__str__() + ", " + track['artist'] \
-                      + ' - ' + track['album'] + ' - ' + track['title']
+                print index.__str__() + "/" + len(groups).__str__() + " Last.fm: " + lastfm_plays.__str__() + \
+                      ", Google: " + google_plays.__str__() + " (" + len(group.tracks).__str__() + \
+                      " tracks), " + group.artist + ' - ' + group.title
 
-                # If the Last.FM play count is higher, increment the Google music play count
-                if lastfm_plays > track['playCount']:
-                    self.SetPlayCount(track, lastfm_plays)
+                if lastfm_plays is None:
+                    index += 1
+                    continue
+
+                # If the Last.FM play count is higher, increment the Google
+                # music play count of the most played track
+                if lastfm_plays > google_plays:
+                    track = group.MostPlayed()
+                    play_count_updates.append((track, track['playCount'] + lastfm_plays - google_plays))
+                    changed.append(group.Query())
 
                 # If the Google Music play count is higher, scrobble the track to Last.FM
-                if track['playCount'] > lastfm_plays:
-                    self.ScrobbleTrack(track)
+                if google_plays > lastfm_plays:
+                    self.QueueScrobble(group.LastModified())
+                    changed.append(group.Query())
 
                 index += 1
             except:
-                print index.__str__() + "/" + len(library).__str__() + " ERROR"
+                print index.__str__() + "/" + len(groups).__str__() + " ERROR"
                 continue
 
-    def ScrobbleRecentPlays(self, library):
-        previous_scrobbles = []
-        try:
-            # Load list of previous scrobbles (in epochs)
-            with open('previous_scrobbles.txt') as f:
-                previous_scrobbles = f.read().splitlines()
-                print "Previous scrobbles:", len(previous_scrobbles)
-                f.close()
-        except:
-            print
+        # The cached counts of scrobbled and incremented tracks are out of
+        # date, even if their Google state looks the same next time
+        if use_cache:
+            self.GetPlayCountCache().Invalidate(changed)
+        self.SetPlayCounts(play_count_updates)
+        self.FlushScrobbles()
+        self.PrintLastFMMetrics()
+
+    @Timed
+    def ScrobbleRecentPlays(self, library, days_ago=14, log_file='previous_scrobbles.txt'):
+        # Scrobble plays from the last days_ago days which haven't been
+        # scrobbled yet. Previous scrobbles are kept in log_file.
+        scrobble_log = ScrobbleLog(log_file, window_days=days_ago)
+        print "Previous scrobbles:", len(scrobble_log)
 
-        days_ago = 14
         # Get epoch time from N days ago
-        start_time_window = time.mktime((datetime.now() - timedelta(days=days_ago)).timetuple())
+        start_time_window = scrobble_log.WindowStart()
 
         new_scrobbles = []
 
         for track in library:
             time_played = (int(track['lastModifiedTimestamp']) / 1000000)
             if time_played > start_time_window:
-                if time_played.__str__() not in previous_scrobbles:
-                    print 'Scrobbling track:', \
-                        track['artist'], '-', \
-                        track['title'], '-', \
-                        datetime.fromtimestamp(float(time_played))
-                    self.ScrobbleTrack(track)
-                    new_scrobbles.append(time_played.__str__())
-
-        # Write out new scrobbles to log
+                if not scrobble_log.Contains(track['id'], time_played):
+                    self.QueueScrobble(track)
+                    scrobble_log.Add(track['id'], time_played)
+                    new_scrobbles.append(track)
+
+        # Write out new scrobbles to log. Queued plays are already durable,
+        # so they are logged before sending.
         print "New scrobbles: ", len(new_scrobbles).__str__()
-        with open('previous_scrobbles.txt', 'a') as f:
-            for item in new_scrobbles:
-                f.write("%s\n" % item)
+        scrobble_log.Save()
+        if scrobble_log.NeedsCompaction():
+            scrobble_log.Compact()
+        if new_scrobbles:
+            self.RecordPlays(new_scrobbles)
+
+        self.FlushScrobbles()
+        self.PrintLastFMMetrics()
+
+    def GetPlaylistIndex(self, playlists):
+        # Returns a PlaylistIndex of the playlists from GetPlaylists. It is
+        # only built once for the same list, and playlists can also be an
+        # index already.
+        if isinstance(playlists, PlaylistIndex):
+            return playlists
+        if self.playlist_index is None or self.playlist_index.source is not playlists:
+            self.playlist_index = PlaylistIndex(playlists)
+        return self.playlist_index
 
     def GetPlaylistID(self, list_of_playlists, playlist_name):
-        for playlist in list_of_playlists:
-            #print playlist['name']
-            if playlist['name'] == playlist_name:
-                return playlist['id']
-        print "Playlist not found: " + playlist_name
-        return False
+        playlist_id = self.GetPlaylistIndex(list_of_playlists).PlaylistID(playlist_name)
+        if playlist_id is None:
+            print "Playlist not found: " + playlist_name
+            return False
+        return playlist_id
 
     def GetTracksInPlaylist(self, list_of_playlists, playlist_name):
-        list_of_tracks = []
-        for playlist in list_of_playlists:
-            if playlist['name'] == playlist_name:
-                for track in playlist['tracks']:
-                    list_of_tracks.append(track)
+        list_of_tracks = self.GetPlaylistIndex(list_of_playlists).Entries(playlist_name)
         print "Found " + len(list_of_tracks).__str__() + " tracks in existing playlist: " + playlist_name
         return list_of_tracks
 
+    @Timed
+    def BuildPlaylists(self, library, playlists, specs):
+        # Evaluates every PlaylistSpec in one pass over the library and syncs
+        # the resulting playlists concurrently
+        results = PlaylistGenerator().Evaluate(library, specs)
+        songs_by_playlist = {}
+        for spec in specs:
+            tracks = results[spec.name]
+            print "Selected " + len(tracks).__str__() + " tracks for playlist: " + spec.name
+            if self.dry_run:
+                for track in tracks:
+                    self.PrintTrack(track)
+            songs_by_playlist[spec.name] = [track['id'] for track in tracks]
+
+        # Call function to add songs to playlists
+        synced = self.AddSongsToPlaylists(playlists, songs_by_playlist)
+        for spec in specs:
+            if synced[spec.name]:
+                print spec.name + ": Done!"
+            else:
+                print spec.name + ": Failed!"
+        return results
+
+    def PrintTrack(self, track):
+        print 'Plays:', track.get('playCount'), ' - ', \
+                        track['artist'].encode('utf-8'), ' - ', \
+                        track['title'].encode('utf-8'), ' - ', \
+                        datetime.fromtimestamp(float(track.get('lastPlayed', 0)))
+
+    @Timed
     def LeastPlayed(self, library, playlists, number_of_tracks=1000):
         print "Creating playlist of least played thumbs up tracks"
-        least_played_tracks = []
-        library.sort(key=operator.itemgetter('id'))
-        library.sort(key=operator.itemgetter('playCount'))
-        for track in library:
-            if 'rating' in track.keys():
-                if track['rating'] == '4' or track['rating'] == '5':  # 4-5 stars is thumbs up
-                    if len(least_played_tracks) < number_of_tracks:
-                        if self.dry_run:
-                            print 'Plays:', track['playCount'], ' - ', \
-                                            track['artist'].encode('utf-8'), ' - ', \
-                                            track['title'].encode('utf-8'), ' - ', \
-                                            datetime.fromtimestamp(float(track['lastPlayed']))
-                        least_played_tracks.append(track['id'])
-                    else:
-                        break
-
-        # Call function to add songs to playlist
-        if self.AddSongsToPlaylist(playlists, 'Thumbs Up Least Played', least_played_tracks):
-            print "Done!"
-        else:
-            print "Failed!"
+        self.BuildPlaylists(library, playlists, [
+            PlaylistSpec('Thumbs Up Least Played', 'playCount',
+                         limit=number_of_tracks, ratings=THUMBS_UP)])
 
+    @Timed
     def NotRecentlyPlayed(self, library, playlists, number_of_tracks=1000, excluded_genres=None):
-        library.sort(key=operator.itemgetter('id'))
-        library.sort(key=operator.itemgetter('lastPlayed'))
-        not_recently_played = []
-        for track in library:
-            if 'rating' in track.keys():
-                if track['rating'] == '4' or track['rating'] == '5':  # 4-5 stars is thumbs up
-                    if excluded_genres is not None:
-                        if track['genre'] not in excluded_genres:
-                            if len(not_recently_played) < number_of_tracks:
-                                if self.dry_run:
-                                    print 'Plays:', track['playCount'], ' - ', \
-                                                    track['artist'].encode('utf-8'), ' - ', \
-                                                    track['title'].encode('utf-8'), ' - ', \
-                                                    datetime.fromtimestamp(float(track['lastPlayed']))
-                                not_recently_played.append(track['id'])
-                            else:
-                                break
-                    else:
-                        if len(not_recently_played) < number_of_tracks:
-                            not_recently_played.append(track['id'])
-                        else:
-                            break
-
-        # Call function to add songs to playlist
-        if self.AddSongsToPlaylist(playlists, 'Thumbs Up Not Recently Played', not_recently_played):
-            print "Done!"
-        else:
-            print "Failed!"
+        self.BuildPlaylists(library, playlists, [
+            PlaylistSpec('Thumbs Up Not Recently Played', 'lastPlayed',
+                         limit=number_of_tracks, ratings=THUMBS_UP,
+                         excluded_genres=excluded_genres,
+                         values=self.LastPlayedTimes())])
 
+    @Timed
     def LeastPlayedByGenre(self, library, playlists, genre, number_of_tracks=1000):
         print "Creating playlist of least played tracks in genre: " + genre
-        genre_tracks = []
-        for track in library:
-            if track['genre'] == genre:
-                genre_tracks.append(track)
-
-        print "Found " + len(genre_tracks).__str__() + " tracks in genre: " + genre
-        least_played_tracks = []
-        genre_tracks.sort(key=operator.itemgetter('id'))
-        genre_tracks.sort(key=operator.itemgetter('playCount'))
-        for track in genre_tracks:
-            if 'rating' in track.keys():
-                if track['rating'] == '4' or track['rating'] == '5':  # 4-5 stars is thumbs up
-                    if len(least_played_tracks) < number_of_tracks:
-                        if self.dry_run:
-                            print 'Plays:', track['playCount'], ' - ', \
-                                            track['artist'].encode('utf-8'), ' - ', \
-                                            track['title'].encode('utf-8'), ' - ', \
-                                            datetime.fromtimestamp(float(track['lastPlayed']))
-                        least_played_tracks.append(track['id'])
-                    else:
-                        break
-                        
-        # Call function to add songs to playlist
-        if self.AddSongsToPlaylist(playlists, genre + ' Least Played', least_played_tracks):
-            print "Done!"
-        else:
-            print "Failed!"
+        self.BuildPlaylists(self.GetLibraryIndex(library), playlists, [
+            PlaylistSpec(genre + ' Least Played', 'playCount',
+                         limit=number_of_tracks, ratings=THUMBS_UP, genre=genre)])
 
+    @Timed
     def MostPlayedByGenre(self, library, playlists, genre, number_of_tracks=1000):
         print "Creating playlist of most played tracks in genre: " + genre
-        genre_tracks = []
-        for track in library:
-            if track['genre'] == genre:
-                genre_tracks.append(track)
-
-        print "Found " + len(genre_tracks).__str__() + " tracks in genre: " + genre
-
-        most_played_tracks = []
-        genre_tracks.sort(key=operator.itemgetter('id'))
-        genre_tracks.sort(key=operator.itemgetter('playCount'), reverse=True)
-        for track in genre_tracks:
-            if 'rating' in track.keys():
-                if track['rating'] == '4' or track['rating'] == '5':  # 4-5 stars is thumbs up
-                    if len(most_played_tracks) < number_of_tracks:
-                        if self.dry_run:
-                            print 'Plays:', track['playCount'], ' - ', \
-                                            track['artist'].encode('utf-8'), ' - ', \
-                                            track['title'].encode('utf-8'), ' - ', \
-                                            datetime.fromtimestamp(float(track['lastPlayed']))
-                        most_played_tracks.append(track['id'])
-                    else:
-                        break
-
-        # Call function to add songs to playlist
-        if self.AddSongsToPlaylist(playlists, genre + ' Most Played', most_played_tracks):
-            print "Done!"
-        else:
-            print "Failed!"
+        self.BuildPlaylists(self.GetLibraryIndex(library), playlists, [
+            PlaylistSpec(genre + ' Most Played', 'playCount', reverse=True,
+                         limit=number_of_tracks, ratings=THUMBS_UP, genre=genre)])
 
+    @Timed
     def NotRecentlyPlayedByGenre(self, library, playlists, genre, number_of_tracks=1000):
         print "Creating playlist of not recently played tracks in genre: " + genre
-        genre_tracks = []
-        for track in library:
-            if track['genre'] == genre:
-                genre_tracks.append(track)
-
-        print "Found " + len(genre_tracks).__str__() + " tracks in genre: " + genre
-
-        genre_tracks.sort(key=operator.itemgetter('id'))
-        genre_tracks.sort(key=operator.itemgetter('lastPlayed'))
-        not_recently_played = []
-        for track in genre_tracks:
-            if 'rating' in track.keys():
-                if track['rating'] == '4' or track['rating'] == '5':  # 4-5 stars is thumbs up
-                    if len(not_recently_played) < number_of_tracks:
-                        if self.dry_run:
-                            print 'Plays:', track['playCount'], ' - ', \
-                                            track['artist'].encode('utf-8'), ' - ', \
-                                            track['title'].encode('utf-8'), ' - ', \
-                                            datetime.fromtimestamp(float(track['lastPlayed']))
-                        not_recently_played.append(track['id'])
-                    else:
-                        break
-
-        # Call function to add songs to playlist
-        if self.AddSongsToPlaylist(playlists, genre + ' Not Recently Played', not_recently_played):
-            print "Done!"
-        else:
-            print "Failed!"
-
+        self.BuildPlaylists(self.GetLibraryIndex(library), playlists, [
+            PlaylistSpec(genre + ' Not Recently Played', 'lastPlayed',
+                         limit=number_of_tracks, ratings=THUMBS_UP, genre=genre,
+                         values=self.LastPlayedTimes())])
+
+    @Timed
+    def HeavyRotation(self, library, playlists, times=5, days=30, number_of_tracks=1000):
+        # Tracks played at least times times in the last days days, most
+        # played first, from the PlayHistory
+        print "Creating playlist of tracks played " + times.__str__() + "+ times in the last " + \
+            days.__str__() + " days"
+        recent_plays = self.GetPlayHistory().PlayCounts(days)
+        self.BuildPlaylists(library, playlists, [
+            PlaylistSpec('Heavy Rotation', 'playCount', reverse=True, limit=number_of_tracks,
+                         track_filter=lambda track: recent_plays.get(track.get('id'), 0) >= times,
+                         values=recent_plays)])
+
+    @Timed
     def UnratedByGenre(self, library, playlists, genre, number_of_tracks=999):
         print "Creating playlist of unrated tracks in genre: " + genre
-        genre_tracks = []
-        for track in library:
-            if track['genre'] == genre:
-                genre_tracks.append(track)
-
-        print "Found " + len(genre_tracks).__str__() + " tracks in genre: " + genre
-        unrated_tracks = []
-        genre_tracks.sort(key=operator.itemgetter('id'))
-        genre_tracks.sort(key=operator.itemgetter('playCount'), reverse=True)
-        for track in genre_tracks:
-            if 'rating' in track.keys():
-                if track['rating'] == '0' or track['rating'] == '3':  # 0 or 3 stars is unrated
-                    if len(unrated_tracks) < number_of_tracks:
-                        if self.dry_run:
-                            print 'Plays:', track['playCount'], ' - ', \
-                                            track['artist'].encode('utf-8'), ' - ', \
-                                            track['title'].encode('utf-8'), ' - ', \
-                                            datetime.fromtimestamp(float(track['lastPlayed']))
-                        unrated_tracks.append(track['id'])
-                    else:
-                        break
-
-
-        # Call function to add songs to playlist
-        if self.AddSongsToPlaylist(playlists, genre + ' Unrated', unrated_tracks):
-            print "Done!"
-        else:
-            print "Failed!"
+        self.BuildPlaylists(self.GetLibraryIndex(library), playlists, [
+            PlaylistSpec(genre + ' Unrated', 'playCount', reverse=True,
+                         limit=number_of_tracks, ratings=UNRATED, genre=genre)])
 
+    @Timed
     def UnratedPlaylist(self, library, playlists, number_of_tracks=1000):
         print "Creating playlist of most played unrated tracks"
-        unrated_tracks = []
-        library.sort(key=operator.itemgetter('id'))
-        library.sort(key=operator.itemgetter('playCount'), reverse=True)
-        for track in library:
-            if 'rating' in track.keys():
-                if track['rating'] == '0' or track['rating'] == '3':  # 0 or 3 stars is unrated
-                    if len(unrated_tracks) < number_of_tracks:
-                        if self.dry_run:
-                            print 'Plays:', track['playCount'], ' - ', \
-                                            track['artist'].encode('utf-8'), ' - ', \
-                                            track['title'].encode('utf-8'), ' - ', \
-                                            datetime.fromtimestamp(float(track['lastPlayed']))
-                        unrated_tracks.append(track['id'])
-                    else:
-                        break
-
-        # Call function to add songs to playlist
-        if self.AddSongsToPlaylist(playlists, 'Unrated', unrated_tracks):
-            print "Done!"
-        else:
-            print "Failed!"
-
+        self.BuildPlaylists(library, playlists, [
+            PlaylistSpec('Unrated', 'playCount', reverse=True,
+                         limit=number_of_tracks, ratings=UNRATED)])
+
+    def GenrePlaylistSpecs(self, genres, number_of_tracks=1000):
+        # Returns the specs of every per-genre playlist for the given genres,
+        # so they can all be built with one call to BuildPlaylists
+        specs = []
+        for genre in genres:
+            specs.append(PlaylistSpec(genre + ' Least Played', 'playCount',
+                                      limit=number_of_tracks, ratings=THUMBS_UP, genre=genre))
+            specs.append(PlaylistSpec(genre + ' Most Played', 'playCount', reverse=True,
+                                      limit=number_of_tracks, ratings=THUMBS_UP, genre=genre))
+            specs.append(PlaylistSpec(genre + ' Not Recently Played', 'lastPlayed',
+                                      limit=number_of_tracks, ratings=THUMBS_UP, genre=genre))
+            specs.append(PlaylistSpec(genre + ' Unrated', 'playCount', reverse=True,
+                                      limit=min(number_of_tracks, 999), ratings=UNRATED, genre=genre))
+        return specs
+
+    def GetLibraryIndex(self, library, lookups=False):
+        # Returns a LibraryIndex of the library. It is only built once for the
+        # same library. Indexes are returned as is, and so are columnar
+        # libraries, which evaluate playlist specs themselves, unless the
+        # artist and album lookups are needed.
+        if isinstance(library, LibraryIndex):
+            return library
+        if isinstance(library, ColumnarLibrary) and not lookups:
+            return library
+        if self.library_index is None or self.library_index.library is not library \
+                or len(self.library_index) != len(library):
+            self.library_index = LibraryIndex(library)
+        return self.library_index
+
+    @Timed
     def ArtistPlaylist(self, library, playlists, artist, number_of_tracks=1000):
         print "Creating playlist of tracks by artist: " + artist
-        artist_tracks = []
-        for track in library:
-            if track['artist'] == artist:
-                artist_tracks.append(track)
+        artist_tracks = list(self.GetLibraryIndex(library, lookups=True).Artist(artist))
 
         print "Found " + len(artist_tracks).__str__() + " tracks by artist: " + artist
         tracks_to_add = []
@@ -659,15 +909,11 @@ class GoogleMusic_Util(object):
             artist_tracks.sort(key=operator.itemgetter('album'), reverse=True)
 
         for track in artist_tracks:
-            if 'rating' in track.keys():
+            if 'rating' in track:
                 if track['rating'] != '1': # 1 stars is thumbs down
                     if len(tracks_to_add) < number_of_tracks:
                         if self.dry_run:
-                            print 'Plays:', track['playCount'], ' - ', \
-                                            track['artist'].encode('utf-8'), ' - ', \
-                                            track['album'].encode('utf-8'), ' - ', \
-                                             track['title'].encode('utf-8'), ' - ', \
-                                            datetime.fromtimestamp(float(track['lastPlayed']))
+                            self.PrintTrack(track)
                         tracks_to_add.append(track['id'])
                     else:
                         break
@@ -678,28 +924,29 @@ class GoogleMusic_Util(object):
         else:
             print "Failed!"
 
+    @Timed
     def AlbumPlaylist(self, library, playlists, name, album_names, number_of_tracks=1000):
+        index = self.GetLibraryIndex(library, lookups=True)
+        matching_albums = set()
+        for album in album_names:
+            # Case-insentive matching
+            matching_albums.update(index.AlbumsContaining(album))
+
         album_tracks = []
-        for track in library:
-            for album in album_names:
-                # Case-insentive matching
-                if album.lower() in track['album'].lower():
-                    album_tracks.append(track)
+        for album in matching_albums:
+            album_tracks.extend(index.Album(album))
 
         print "Found " + len(album_tracks).__str__() + " album tracks."
         tracks_to_add = []
+        album_tracks.sort(key=operator.itemgetter('id'))
         album_tracks.sort(key=operator.itemgetter('trackNumber'))
         album_tracks.sort(key=operator.itemgetter('year', 'album'), reverse=True)
         for track in album_tracks:
-            if 'rating' in track.keys():
+            if 'rating' in track:
                 if track['rating'] != '1': # 1 stars is thumbs down
                     if len(tracks_to_add) < number_of_tracks:
                         if self.dry_run:
-                            print 'Plays:', track['playCount'], ' - ', \
-                                            track['album'].encode('utf-8'), ' - ', \
-                                            track['artist'].encode('utf-8'), ' - ', \
-                                            track['title'].encode('utf-8'), ' - ', \
-                                            datetime.fromtimestamp(float(track['lastPlayed']))
+                            self.PrintTrack(track)
                         tracks_to_add.append(track['id'])
                     else:
                         break
@@ -712,30 +959,23 @@ class GoogleMusic_Util(object):
 
     def UpdateLastPlayedDB(self, track):
         # Accepts one track (which is a new play) and updates the LastPlayed file.
-        file_name = 'last_played.json'
-        items = {}
-        # Open tracks from previous run json file
-        with open(file_name) as f:
-                items = json.load(f)
+        self.UpdateLastPlayedDBBatch([track])
 
-        # Add current track to DB
-        items[track['id']] = time.time()
+    @Timed
+    def UpdateLastPlayedDBBatch(self, tracks):
+        # Accepts a list of tracks (which are new plays) and records them all
+        # with a single write to the LastPlayed log
+        store = LastPlayedStore('last_played.json')
+        for track in tracks:
+            store.Record(track['id'])
+        count = store.Commit()
 
-        # Write out JSON file
-        with open(file_name, 'wb') as fp:
-            json.dump(items, fp)
-            fp.write('\n')
-
-        print "Wrote " + len(items).__str__() + " total tracks to " + file_name
+        print "Recorded " + count.__str__() + " plays in last_played.json"
 
     def LoadLastPlayedDB(self, library):
         # Loads the last_played DB and overlays it on the library
-        file_name = 'last_played.json'
-        items = {}
         tracks_appended = 0
-        # Open tracks from previous run json file
-        with open(file_name) as f:
-                items = json.load(f)
+        items = LastPlayedStore('last_played.json').Load()
 
         for track in library:
             if track['id'] in items:
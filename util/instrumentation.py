@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+import functools
+import json
+import os
+import threading
+import time
+
+# Counters and timing histograms for a run. API clients are wrapped in an
+# InstrumentedProxy, which times every call and counts errors, and
+# GoogleMusic_Util methods decorated with @Timed are timed as well. The
+# results can be written as a JSON report or in the Prometheus text format
+# (e.g. for node_exporter's textfile collector).
+#
+# Usage:
+#    metrics = Instrumentation()
+#    api = metrics.Wrap(Mobileclient(), 'api_call')
+#    with metrics.Timer('method', method='GetLibrary'):
+#        ...
+#    metrics.WriteJSON('metrics.json')
+#    metrics.WritePrometheus('metrics.prom')
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_PREFIX = 'gmusic_'
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * len(BUCKETS)
+
+    def Observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+    def ToDict(self):
+        return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max,
+                'buckets': [[bound, count] for bound, count in zip(BUCKETS, self.buckets)]}
+
+
+def _Key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _Name(key):
+    # "name{label=value,...}" for the JSON report
+    name, labels = key
+    if not labels:
+        return name
+    return name + '{' + ','.join(label + '=' + str(value) for label, value in labels) + '}'
+
+
+class _Timer(object):
+
+    def __init__(self, instrumentation, name, labels):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.Observe(self.name, time.time() - self.start, **self.labels)
+        if exc_type is not None:
+            self.instrumentation.Count(self.name + '_errors', **self.labels)
+        return False
+
+
+class Instrumentation(object):
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def Count(self, name, value=1, **labels):
+        key = _Key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def Observe(self, name, seconds, **labels):
+        key = _Key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].Observe(seconds)
+
+    def Timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def Wrap(self, target, name):
+        return InstrumentedProxy(target, self, name)
+
+    def Report(self):
+        with self.lock:
+            return {'seconds': time.time() - self.started,
+                    'counters': dict((_Name(key), value) for key, value in self.counters.items()),
+                    'timers': dict((_Name(key), histogram.ToDict())
+                                   for key, histogram in self.histograms.items())}
+
+    def WriteJSON(self, file_name):
+        with open(file_name, 'w') as fp:
+            json.dump(self.Report(), fp, indent=2, sort_keys=True)
+            fp.write('\n')
+
+    def Prometheus(self):
+        # Timers become histograms named <name>_seconds, counters become
+        # <name>_total
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            metric = PROMETHEUS_PREFIX + name + '_total'
+            if metric not in typed:
+                lines.append('# TYPE ' + metric + ' counter')
+                typed.add(metric)
+            lines.append(metric + _PrometheusLabels(labels) + ' ' + repr(value))
+
+        for (name, labels), histogram in histograms:
+            metric = PROMETHEUS_PREFIX + name + '_seconds'
+            if metric not in typed:
+                lines.append('# TYPE ' + metric + ' histogram')
+                typed.add(metric)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.buckets):
+                cumulative += count
+                lines.append(metric + '_bucket' + _PrometheusLabels(labels + (('le', repr(bound)),)) +
+                             ' ' + str(cumulative))
+            lines.append(metric + '_bucket' + _PrometheusLabels(labels + (('le', '+Inf'),)) +
+                         ' ' + str(histogram.count))
+            lines.append(metric + '_sum' + _PrometheusLabels(labels) + ' ' + repr(histogram.sum))
+            lines.append(metric + '_count' + _PrometheusLabels(labels) + ' ' + str(histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def WritePrometheus(self, file_name):
+        # Written to a temporary file first so a collector never reads a
+        # half written file
+        with open(file_name + '.tmp', 'w') as fp:
+            fp.write(self.Prometheus())
+        os.rename(file_name + '.tmp', file_name)
+
+
+def _PrometheusLabels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for label, value in labels) + '}'
+
+
+class InstrumentedProxy(object):
+    # Times every method call on the target as <name>{call=<method>} and
+    # counts the calls which raise. Other attributes are passed through.
+
+    def __init__(self, target, instrumentation, name):
+        self._target = target
+        self._instrumentation = instrumentation
+        self._name = name
+
+    def __getattr__(self, attribute):
+        value = getattr(self._target, attribute)
+        if not callable(value):
+            return value
+        instrumentation = self._instrumentation
+        name = self._name
+
+        @functools.wraps(value)
+        def Call(*args, **kwargs):
+            with instrumentation.Timer(name, call=attribute):
+                return value(*args, **kwargs)
+        return Call
+
+
+def Timed(method):
+    # Decorator timing a GoogleMusic_Util method as method{method=<name>}
+    @functools.wraps(method)
+    def Call(self, *args, **kwargs):
+        with self.instrumentation.Timer('method', method=method.__name__):
+            return method(self, *args, **kwargs)
+    return Call
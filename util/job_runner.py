@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+import copy
+import json
+import threading
+import time
+import traceback
+
+# Runs a list of jobs (dumps, CSV exports, playlist builds, scrobbling and
+# the Last.FM sync) described by a config, fetching the library and the
+# playlists only once for all of them.
+#
+# The fetched data is shared read-only: jobs which change tracks or
+# playlists as they go (the Last.FM sync and playlist builds) get their own
+# copies. Jobs run in parallel in "lanes"; jobs in the same lane run one after
+# another, in config order. Scrobbling and the Last.FM sync share the
+# "lastfm" lane by default, since they share the scrobble outbox.
+#
+# Config:
+#    {"workers": 4,
+#     "library_file": "library.json",   # optional, instead of GetLibrary
+#     "jobs": [
+#         {"type": "dump_library", "file": "/tmp/library.json"},
+#         {"type": "dump_playlists", "file": "/tmp/playlists.json"},
+#         {"type": "record_snapshot", "file": "history.db"},
+#         {"type": "export_csv", "file": "/tmp/library.csv.gz",
+#          "fields": ["artist", "title", "playCount"]},
+#         {"type": "playlist", "builder": "MostPlayedByGenre", "args": {"genre": "Rock"}},
+#         {"type": "genre_playlists", "genres": ["Rock", "Jazz"]},
+#         {"type": "scrobble", "days_ago": 14},
+#         {"type": "lastfm_sync", "workers": 4, "rate": 5},
+#         {"type": "metrics", "json_file": "metrics.json"}]}
+#
+# Usage:
+#    runner = JobRunner(GoogleMusic_Util(), JobRunner.LoadConfig('jobs.json'))
+#    results = runner.Run()  # list of JobResult
+
+# Playlist builders a "playlist" job may call. They are called as
+# builder(library, playlists, **args).
+PLAYLIST_BUILDERS = ('LeastPlayed', 'NotRecentlyPlayed', 'LeastPlayedByGenre',
+                     'MostPlayedByGenre', 'NotRecentlyPlayedByGenre', 'UnratedByGenre',
+                     'UnratedPlaylist', 'ArtistPlaylist', 'AlbumPlaylist', 'HeavyRotation')
+
+# Job types which need the library and the playlists
+NEEDS_LIBRARY = ('dump_library', 'record_snapshot', 'export_csv', 'playlist', 'genre_playlists',
+                 'scrobble', 'lastfm_sync')
+NEEDS_PLAYLISTS = ('dump_playlists', 'playlist', 'genre_playlists')
+
+# Job types which always run after every other job
+LAST_JOBS = ('metrics',)
+
+
+class JobResult(object):
+
+    def __init__(self, name, job_type):
+        self.name = name
+        self.job_type = job_type
+        self.success = False
+        self.error = None
+        self.seconds = 0.0
+        self.value = None
+
+    def __repr__(self):
+        return "<JobResult %s %s success=%s seconds=%.2f>" % (
+            self.name, self.job_type, self.success, self.seconds)
+
+
+class JobRunner(object):
+
+    def __init__(self, util, config):
+        self.util = util
+        self.config = config
+        self.jobs = config.get('jobs', [])
+        self.workers = config.get('workers', 4)
+        self.library = None
+        self.playlists = None
+        self.playlists_for_builds = None
+
+    @staticmethod
+    def LoadConfig(file_name):
+        with open(file_name) as fp:
+            return json.load(fp)
+
+    def Name(self, job):
+        return job.get('name') or (job['type'] + ' ' + (job.get('file') or job.get('builder') or '')).strip()
+
+    def Lane(self, job, index):
+        if 'lane' in job:
+            return job['lane']
+        if job['type'] in ('scrobble', 'lastfm_sync'):
+            return 'lastfm'
+        return index
+
+    def Fetch(self):
+        # Fetches (or loads) the library and the playlists once, if any job
+        # needs them
+        types = set(job['type'] for job in self.jobs)
+        if types.intersection(NEEDS_LIBRARY):
+            if self.config.get('library_file'):
+                self.library = self.util.LoadLocalJSON(self.config['library_file'])
+            else:
+                self.library = self.util.GetLibrary()
+        if types.intersection(NEEDS_PLAYLISTS):
+            self.playlists = self.util.GetPlaylists()
+        if types.intersection(('playlist', 'genre_playlists')):
+            # Playlist builds keep the playlists they change up to date, so
+            # they work on a copy. The indexes are built here rather than by
+            # the first of several concurrent jobs.
+            self.playlists_for_builds = copy.deepcopy(self.playlists)
+            self.util.GetPlaylistIndex(self.playlists_for_builds)
+            self.util.GetLibraryIndex(self.library)
+            self.util.GetPlaylistExecutor()
+
+    def RunJob(self, job):
+        util = self.util
+        job_type = job['type']
+        if job_type == 'dump_library':
+            if job['file'].endswith(('.jsonl', '.jsonl.gz', '.jsonl.zst')):
+                return util.DumpTracksToJSONL(self.library, job['file'])
+            return util.DumpTracksToJSON(self.library, job['file'])
+        if job_type == 'dump_playlists':
+            return util.DumpTracksToJSON(self.playlists, job['file'])
+        if job_type == 'record_snapshot':
+            return util.RecordSnapshot(self.library, job.get('file', 'history.db'))
+        if job_type == 'export_csv':
+            return util.DumpTracksToCSV(self.library, job['file'], job.get('fields'))
+        if job_type == 'playlist':
+            if job['builder'] not in PLAYLIST_BUILDERS:
+                raise ValueError("Unknown playlist builder: " + job['builder'])
+            return getattr(util, job['builder'])(self.library, self.playlists_for_builds,
+                                                 **job.get('args', {}))
+        if job_type == 'genre_playlists':
+            specs = util.GenrePlaylistSpecs(job['genres'], job.get('number_of_tracks', 1000))
+            return util.BuildPlaylists(self.library, self.playlists_for_builds, specs)
+        if job_type == 'scrobble':
+            return util.ScrobbleRecentPlays(self.library, job.get('days_ago', 14),
+                                            job.get('log_file', 'previous_scrobbles.txt'))
+        if job_type == 'lastfm_sync':
+            # The sync fills in missing play counts on the tracks it is given
+            library = [dict(track) for track in self.library]
+            return util.SyncLastFMPlayCount(library, job.get('workers', 4), job.get('rate', 5.0),
+                                            job.get('use_cache', True))
+        if job_type == 'metrics':
+            return util.WriteMetrics(job.get('json_file'), job.get('prometheus_file'))
+        raise ValueError("Unknown job type: " + job_type.__str__())
+
+    def _Timed(self, job, result):
+        start = time.time()
+        try:
+            with self.util.instrumentation.Timer('job', job=result.name):
+                result.value = self.RunJob(job)
+            result.success = True
+        except Exception as e:
+            result.error = e
+            print "ERROR: Job " + result.name + " failed:", e
+            traceback.print_exc()
+        result.seconds = time.time() - start
+
+    def Run(self):
+        # Runs every job and returns a JobResult for each, in config order
+        start = time.time()
+        self.Fetch()
+        fetch_seconds = time.time() - start
+
+        results = [JobResult(self.Name(job), job['type']) for job in self.jobs]
+        lanes = {}
+        order = []
+        for index, job in enumerate(self.jobs):
+            if job['type'] in LAST_JOBS:
+                continue
+            lane = self.Lane(job, index)
+            if lane not in lanes:
+                lanes[lane] = []
+                order.append(lane)
+            lanes[lane].append(index)
+
+        pending = list(order)
+        lock = threading.Lock()
+
+        def Worker():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    lane = pending.pop(0)
+                for index in lanes[lane]:
+                    self._Timed(self.jobs[index], results[index])
+
+        threads = [threading.Thread(target=Worker) for _ in range(min(self.workers, len(order)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for index, job in enumerate(self.jobs):
+            if job['type'] in LAST_JOBS:
+                self._Timed(job, results[index])
+
+        self.PrintReport(results, fetch_seconds, time.time() - start)
+        return results
+
+    def PrintReport(self, results, fetch_seconds, total_seconds):
+        print
+        print "Fetching library and playlists: %.2fs" % fetch_seconds
+        for result in results:
+            print "%-40s %-8s %8.2fs" % (result.name, 'OK' if result.success else 'FAILED', result.seconds)
+        print "Total: %.2fs" % total_seconds
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+import json
+import os
+import time
+
+# Last played time of each track, kept as a JSON snapshot (last_played.json,
+# the same format as before) plus an append-only log of newer plays next to
+# it. Recording plays only appends to the log, with a single fsync per
+# commit, and the log is folded back into the snapshot once it gets long.
+#
+# Usage:
+#    store = LastPlayedStore('last_played.json')
+#    for track in new_plays:
+#        store.Record(track['id'])
+#    store.Commit()
+#    last_played = store.Load()  # {track id: epoch seconds}
+
+
+class LastPlayedStore(object):
+
+    def __init__(self, file_name='last_played.json', compact_after=10000):
+        self.file_name = file_name
+        self.log_file = file_name + '.log'
+        self.compact_after = compact_after
+        self.pending = []
+        self.log_lines = None
+
+    def _ReadSnapshot(self):
+        if not os.path.exists(self.file_name):
+            return {}
+        with open(self.file_name) as f:
+            return json.load(f)
+
+    def _ReadLog(self, items):
+        # Replays the log over items. Returns the number of log lines.
+        if not os.path.exists(self.log_file):
+            return 0
+        lines = 0
+        with open(self.log_file) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                # A crash can leave a partial last line behind
+                if len(fields) != 2:
+                    continue
+                try:
+                    items[fields[0]] = float(fields[1])
+                except ValueError:
+                    continue
+                lines += 1
+        return lines
+
+    def _EndsTorn(self):
+        # Whether a crash left the log without its final newline
+        if not os.path.exists(self.log_file) or os.path.getsize(self.log_file) == 0:
+            return False
+        with open(self.log_file, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != '\n'
+
+    def Load(self):
+        items = self._ReadSnapshot()
+        self._ReadLog(items)
+        return items
+
+    def Record(self, track_id, when=None):
+        self.pending.append((track_id, time.time() if when is None else when))
+
+    def Commit(self):
+        # Append every recorded play to the log and sync it to disk once.
+        # Returns the number of plays written.
+        if not self.pending:
+            return 0
+        torn = self._EndsTorn()
+        with open(self.log_file, 'a') as f:
+            # Finish a partial last line, so the first play isn't appended to it
+            if torn:
+                f.write('\n')
+            for track_id, when in self.pending:
+                f.write("%s\t%r\n" % (track_id, when))
+            f.flush()
+            os.fsync(f.fileno())
+        count = len(self.pending)
+        self.pending = []
+        if self.log_lines is None:
+            self.log_lines = self._ReadLog({})
+        else:
+            self.log_lines += count
+        if self.log_lines > self.compact_after:
+            self.Compact()
+        return count
+
+    def Compact(self):
+        # Fold the log into the JSON snapshot. The snapshot is replaced
+        # atomically before the log is removed, so a crash in between only
+        # means the log is replayed again.
+        items = self.Load()
+        temp_file = self.file_name + '.tmp'
+        with open(temp_file, 'w') as fp:
+            json.dump(items, fp)
+            fp.write('\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(temp_file, self.file_name)
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self.log_lines = 0
+        return items
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+import threading
+import Queue
+
+from rate_limit import TokenBucket
+
+# Looks up Last.fm play counts for many tracks at once with a small pool of
+# worker threads. All workers share one TokenBucket so the combined request
+# rate stays within Last.fm's limits.
+#
+# lookup is any callable taking a track and returning its play count. In
+# GoogleMusic_Util it uses one shared network object; in tests it can point at
+# a local fake Last.fm endpoint.
+#
+# Usage:
+#    fetcher = PlayCountFetcher(util.LookupLastFMPlays, workers=4, rate=5)
+#    counts = fetcher.FetchAll(library)  # {track id: play count or None}
+
+
+class PlayCountFetcher(object):
+
+    def __init__(self, lookup, workers=4, rate=5.0, limiter=None):
+        self.lookup = lookup
+        self.workers = workers
+        self.limiter = limiter or TokenBucket(rate)
+        self.errors = 0
+
+    def FetchAll(self, tracks):
+        # Returns a dict of track id to play count. Tracks which couldn't be
+        # looked up map to None.
+        jobs = Queue.Queue()
+        for track in tracks:
+            jobs.put(track)
+
+        results = {}
+        lock = threading.Lock()
+
+        def Worker():
+            while True:
+                try:
+                    track = jobs.get_nowait()
+                except Queue.Empty:
+                    return
+                self.limiter.Acquire()
+                try:
+                    count = self.lookup(track)
+                except Exception:
+                    count = None
+                with lock:
+                    if count is None:
+                        self.errors += 1
+                    results[track['id']] = count
+
+        threads = [threading.Thread(target=Worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+import hashlib
+import httplib
+import json
+import os
+import threading
+import urllib
+import urlparse
+
+# One authenticated Last.FM session shared by every scrobble and lookup in a
+# run. The mobile session handshake is done once, lazily, and HTTP connections
+# are kept alive in a small pool instead of being opened for every request.
+#
+# Usage:
+#    session = LastFMSession.FromEnvironment()
+#    session.GetUserPlayCount(artist, title)
+#    session.Scrobble([(artist, title, timestamp)])
+#    session.Metrics()  # connections and handshakes saved so far
+
+DEFAULT_WS_URL = 'https://ws.audioscrobbler.com/2.0/'
+
+# Last.FM accepts up to 50 scrobbles in one request
+MAX_SCROBBLE_BATCH = 50
+
+# Last.FM error codes worth retrying: operation failed, service offline,
+# temporarily unavailable and rate limit exceeded
+TRANSIENT_ERRORS = (8, 11, 16, 29)
+
+# Error codes caused by the request itself (invalid parameters, invalid
+# resource), which fail the same way however often they are sent
+REJECTED_ERRORS = (6, 7)
+
+
+def md5(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.md5(text).hexdigest()
+
+
+class LastFMError(Exception):
+
+    def __init__(self, code, message):
+        Exception.__init__(self, "Last.FM error " + code.__str__() + ": " + message)
+        self.code = code
+
+    def IsTransient(self):
+        return int(self.code) in TRANSIENT_ERRORS
+
+    def IsRejected(self):
+        return int(self.code) in REJECTED_ERRORS
+
+
+class LastFMSession(object):
+
+    def __init__(self, api_key, api_secret, username, password_hash,
+                 ws_url=DEFAULT_WS_URL, pool_size=8, timeout=30):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.username = username
+        self.password_hash = password_hash
+        url = urlparse.urlparse(ws_url)
+        self.secure = url.scheme == 'https'
+        self.host = url.netloc
+        self.path = url.path or '/2.0/'
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session_key = None
+        self.idle_connections = []
+        self.lock = threading.Lock()
+        self.handshake_lock = threading.Lock()
+        self.metrics = {'requests': 0, 'operations': 0,
+                        'connections_opened': 0, 'handshakes': 0}
+
+    @classmethod
+    def FromEnvironment(cls, **kwargs):
+        # LASTFM_WS_SERVER can point the session at another server, e.g. a
+        # local fake Last.FM endpoint ("http://127.0.0.1:8080/2.0/"). A bare
+        # host name means https.
+        ws_url = os.environ.get('LASTFM_WS_SERVER') or DEFAULT_WS_URL
+        if '://' not in ws_url:
+            ws_url = 'https://' + ws_url + '/2.0/'
+        return cls(api_key=os.environ.get('LASTFM_APIKEY'),
+                   api_secret=os.environ.get('LASTFM_APISECRET'),
+                   username=os.environ.get('LASTFM_USERNAME'),
+                   password_hash=md5(os.environ.get('LASTFM_PASSWORD')),
+                   ws_url=ws_url, **kwargs)
+
+    def _Connection(self):
+        with self.lock:
+            if self.idle_connections:
+                return self.idle_connections.pop()
+            self.metrics['connections_opened'] += 1
+        if self.secure:
+            return httplib.HTTPSConnection(self.host, timeout=self.timeout)
+        return httplib.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _Release(self, connection):
+        with self.lock:
+            if len(self.idle_connections) < self.pool_size:
+                self.idle_connections.append(connection)
+                return
+        connection.close()
+
+    def Close(self):
+        with self.lock:
+            connections, self.idle_connections = self.idle_connections, []
+        for connection in connections:
+            connection.close()
+
+    def _Sign(self, params):
+        # Last.FM signature: md5 of the sorted parameters and the secret
+        text = ''.join(key + params[key] for key in sorted(params))
+        return md5(text + self.api_secret)
+
+    def _Post(self, body):
+        # Sends one request over a pooled connection. A kept-alive connection
+        # may have been closed by the server, so a failure on a reused
+        # connection is retried once on a fresh one.
+        for attempt in range(2):
+            connection = self._Connection()
+            try:
+                connection.request('POST', self.path, body,
+                                   {'Content-Type': 'application/x-www-form-urlencoded',
+                                    'Connection': 'keep-alive'})
+                response = connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, IOError):
+                connection.close()
+                if attempt == 0:
+                    continue
+                raise
+            with self.lock:
+                self.metrics['requests'] += 1
+            if response.getheader('connection', '').lower() == 'close':
+                connection.close()
+            else:
+                self._Release(connection)
+            return data
+
+    def Request(self, method, params, signed=False):
+        params = dict(params)
+        params['method'] = method
+        params['api_key'] = self.api_key
+        for key, value in params.items():
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            params[key] = str(value)
+        if signed:
+            params['api_sig'] = self._Sign(params)
+        params['format'] = 'json'
+
+        result = json.loads(self._Post(urllib.urlencode(params)))
+        if 'error' in result:
+            raise LastFMError(result['error'], result.get('message', ''))
+        return result
+
+    def SessionKey(self):
+        # The mobile session handshake, done only on first use
+        with self.handshake_lock:
+            if self.session_key is None:
+                result = self.Request('auth.getMobileSession',
+                                      {'username': self.username,
+                                       'authToken': md5(self.username + self.password_hash)},
+                                      signed=True)
+                self.session_key = result['session']['key']
+                with self.lock:
+                    self.metrics['handshakes'] += 1
+        return self.session_key
+
+    def _CountOperation(self):
+        with self.lock:
+            self.metrics['operations'] += 1
+
+    def GetUserPlayCount(self, artist, title):
+        self._CountOperation()
+        result = self.Request('track.getInfo', {'artist': artist, 'track': title,
+                                                'username': self.username})
+        return int(result['track'].get('userplaycount', 0))
+
+    def Scrobble(self, scrobbles):
+        # scrobbles is a list of (artist, title, timestamp) tuples, sent as
+        # one request. Returns the number of scrobbles Last.FM accepted.
+        if len(scrobbles) > MAX_SCROBBLE_BATCH:
+            raise ValueError("Last.FM accepts at most " + MAX_SCROBBLE_BATCH.__str__() + " scrobbles per request")
+        self._CountOperation()
+        params = {'sk': self.SessionKey()}
+        for i, (artist, title, timestamp) in enumerate(scrobbles):
+            params['artist[' + i.__str__() + ']'] = artist
+            params['track[' + i.__str__() + ']'] = title
+            params['timestamp[' + i.__str__() + ']'] = timestamp
+        result = self.Request('track.scrobble', params, signed=True)
+        return int(result['scrobbles']['@attr']['accepted'])
+
+    def Metrics(self):
+        # Compared to building a network per call, which opened a connection
+        # and did a handshake for every operation
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics['connections_saved'] = metrics['requests'] - metrics['connections_opened']
+        metrics['handshakes_saved'] = metrics['operations'] - metrics['handshakes']
+        return metrics
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Compares two library snapshots (lists of gmusicapi track dictionaries) in a
+# single linear pass. The old snapshot is indexed by track id once, then every
+# track in the new snapshot is looked up in that index instead of scanning the
+# whole old library for each track.
+#
+# Usage:
+#    diff = LibraryDiff().Compare(old_library, new_library)
+#    diff.new_plays  # tracks whose playCount went up (what ScrobbleTrack eats)
+#    diff.added      # tracks only present in new_library
+#    diff.removed    # tracks only present in old_library
+#    diff.changed    # (track, {field: (old_value, new_value)}) tuples
+
+# Fields compared when looking for metadata changes. playCount and the
+# timestamps are left out since they change on every play.
+METADATA_FIELDS = ('title', 'artist', 'album', 'albumArtist', 'genre',
+                   'year', 'trackNumber', 'discNumber', 'rating')
+
+
+class LibraryDiffResult(object):
+
+    def __init__(self):
+        self.new_plays = []
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+
+class LibraryDiff(object):
+
+    def __init__(self, metadata_fields=METADATA_FIELDS):
+        self.metadata_fields = metadata_fields
+
+    def IndexLibrary(self, library):
+        # Map track id to track. Tracks without an id can't be matched.
+        index = {}
+        for track in library:
+            if 'id' in track:
+                index[track['id']] = track
+        return index
+
+    def IsNewPlay(self, old_track, new_track):
+        # If the track has never been played the playCount key may not exist.
+        if 'playCount' not in new_track:
+            return False
+        if old_track is None:
+            # Newly added track, only counts if it has actually been played
+            return new_track['playCount'] > 0
+        if 'playCount' not in old_track:
+            # The track has been played for the first time and the
+            # playCount key was created.
+            return True
+        return new_track['playCount'] > old_track['playCount']
+
+    def ChangedFields(self, old_track, new_track):
+        changes = {}
+        for field in self.metadata_fields:
+            old_value = old_track.get(field)
+            new_value = new_track.get(field)
+            if old_value != new_value:
+                changes[field] = (old_value, new_value)
+        return changes
+
+    def Compare(self, old_library, new_library):
+        result = LibraryDiffResult()
+        old_index = self.IndexLibrary(old_library)
+        seen_ids = set()
+
+        for new_track in new_library:
+            track_id = new_track.get('id')
+            old_track = old_index.get(track_id)
+
+            if old_track is None:
+                result.added.append(new_track)
+            else:
+                seen_ids.add(track_id)
+                changes = self.ChangedFields(old_track, new_track)
+                if changes:
+                    result.changed.append((new_track, changes))
+
+            if self.IsNewPlay(old_track, new_track):
+                result.new_plays.append(new_track)
+
+        for track_id, old_track in old_index.iteritems():
+            if track_id not in seen_ids:
+                result.removed.append(old_track)
+
+        return result
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import bisect
+
+# Buckets of library tracks by genre, artist and album, built in one pass so
+# per-genre and per-artist playlists only touch their own tracks. Album names
+# are also case-folded into a trigram index for substring search and a sorted
+# list for prefix search.
+#
+# Usage:
+#    index = LibraryIndex(library)
+#    index.Genre('Rock')                # list of tracks
+#    index.AlbumsContaining('greatest')  # album names, matched ignoring case
+
+
+def Trigrams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class LibraryIndex(object):
+
+    def __init__(self, library):
+        self.library = library
+        self.by_genre = {}
+        self.by_artist = {}
+        self.by_album = {}
+        for track in library:
+            self.by_genre.setdefault(track.get('genre'), []).append(track)
+            self.by_artist.setdefault(track.get('artist'), []).append(track)
+            self.by_album.setdefault(track.get('album'), []).append(track)
+
+        # Case-folded album name -> album names with that spelling
+        self.folded_albums = {}
+        for album in self.by_album:
+            if album is not None:
+                self.folded_albums.setdefault(album.lower(), []).append(album)
+        self.sorted_albums = sorted(self.folded_albums)
+        self.album_trigrams = {}
+        for folded in self.folded_albums:
+            for trigram in Trigrams(folded):
+                self.album_trigrams.setdefault(trigram, set()).add(folded)
+
+    def __len__(self):
+        return len(self.library)
+
+    def __iter__(self):
+        return iter(self.library)
+
+    def Genre(self, genre):
+        return self.by_genre.get(genre, [])
+
+    def Artist(self, artist):
+        return self.by_artist.get(artist, [])
+
+    def Album(self, album):
+        return self.by_album.get(album, [])
+
+    def AlbumsContaining(self, text):
+        # Album names containing text, ignoring case
+        text = text.lower()
+        trigrams = Trigrams(text)
+        if trigrams:
+            # Only albums sharing every trigram of text can contain it
+            candidates = None
+            for trigram in trigrams:
+                albums = self.album_trigrams.get(trigram, set())
+                candidates = albums if candidates is None else candidates & albums
+                if not candidates:
+                    return []
+        else:
+            candidates = self.folded_albums
+        albums = []
+        for folded in candidates:
+            if text in folded:
+                albums.extend(self.folded_albums[folded])
+        return albums
+
+    def AlbumsStartingWith(self, text):
+        # Album names starting with text, ignoring case
+        text = text.lower()
+        albums = []
+        i = bisect.bisect_left(self.sorted_albums, text)
+        while i < len(self.sorted_albums) and self.sorted_albums[i].startswith(text):
+            albums.extend(self.folded_albums[self.sorted_albums[i]])
+            i += 1
+        return albums
+
+    def Candidates(self, specs):
+        # The tracks a set of PlaylistSpecs needs to look at: only the genre
+        # buckets if every spec is limited to one genre, else everything
+        if not specs or any(spec.genre is None for spec in specs):
+            return self.library
+        tracks = []
+        for genre in set(spec.genre for spec in specs):
+            tracks.extend(self.Genre(genre))
+        return tracks
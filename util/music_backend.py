@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+# The calls GoogleMusic_Util makes on its backend. A real gmusicapi
+# Mobileclient already provides all of them; anything else passed to
+# GoogleMusic_Util(backend=...) must implement them with the same signatures
+# and return values. FakeMobileclient is the in-memory implementation.
+
+
+class MusicBackend(object):
+
+    def get_all_songs(self, incremental=False, include_deleted=None):
+        raise NotImplementedError
+
+    def get_all_user_playlist_contents(self):
+        raise NotImplementedError
+
+    def create_playlist(self, name, description=None, public=False):
+        raise NotImplementedError
+
+    def edit_playlist(self, playlist_id, new_name=None, new_description=None, public=None):
+        raise NotImplementedError
+
+    def add_songs_to_playlist(self, playlist_id, song_ids):
+        raise NotImplementedError
+
+    def remove_entries_from_playlist(self, entry_ids):
+        raise NotImplementedError
+
+    def reorder_playlist_entry(self, entry, to_follow_entry=None, to_precede_entry=None):
+        raise NotImplementedError
+
+    def increment_song_playcount(self, song_id, plays=1, playtime=None):
+        raise NotImplementedError
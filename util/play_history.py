@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+import calendar
+import sqlite3
+import threading
+import time
+
+# Append-only history of play events in SQLite, with rollups kept up to date
+# as events are added, so questions like "plays per genre per week" or
+# "tracks played 5+ times in the last 30 days" are answered from small
+# aggregate tables instead of by rescanning snapshots.
+#
+# Events are partitioned into one table per month (plays_YYYYMM), so reading
+# a time range only touches the months in it and old months can be dropped
+# as a whole. The rollups are per track, per artist, per genre and day, and
+# per track and day. The same play (track id and time) is only stored once.
+#
+# One PlayHistory can be shared by threads (e.g. jobs run by JobRunner); its
+# connection is only used by one of them at a time.
+#
+# Usage:
+#    history = PlayHistory('play_history.db')
+#    history.RecordTracks(new_plays)        # tracks from FindNewPlays
+#    history.LastPlayed()                   # {track id: epoch seconds}
+#    history.PlayCounts(days=30)            # {track id: plays}
+#    history.TracksPlayedAtLeast(5, days=30)
+#    history.PlaysByGenre('week')           # [(genre, week start, plays)]
+
+DAY = 24 * 3600
+
+
+def Day(timestamp):
+    # Days since the epoch (UTC)
+    return int(timestamp // DAY)
+
+
+def WeekStart(day):
+    # First day (Monday) of the week containing day. Day 0 was a Thursday.
+    return day - (day + 3) % 7
+
+
+def PlayedAt(track):
+    # Google's lastModifiedTimestamp of a newly played track is the play
+    # time, in microseconds
+    return int(track['lastModifiedTimestamp']) / 1000000
+
+
+class PlayHistory(object):
+
+    def __init__(self, file_name='play_history.db'):
+        self.file_name = file_name
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(file_name, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS partitions (
+                name TEXT PRIMARY KEY,
+                first_day INTEGER,
+                last_day INTEGER);
+            CREATE TABLE IF NOT EXISTS track_plays (
+                track_id TEXT PRIMARY KEY,
+                artist TEXT,
+                genre TEXT,
+                plays INTEGER,
+                first_played REAL,
+                last_played REAL);
+            CREATE TABLE IF NOT EXISTS artist_plays (
+                artist TEXT PRIMARY KEY,
+                plays INTEGER,
+                last_played REAL);
+            CREATE TABLE IF NOT EXISTS genre_day_plays (
+                genre TEXT,
+                day INTEGER,
+                plays INTEGER,
+                PRIMARY KEY (genre, day));
+            CREATE TABLE IF NOT EXISTS track_day_plays (
+                track_id TEXT,
+                day INTEGER,
+                plays INTEGER,
+                PRIMARY KEY (track_id, day));
+            CREATE INDEX IF NOT EXISTS track_day_plays_by_day ON track_day_plays (day);
+        ''')
+        self.partitions = set(row[0] for row in self.db.execute('SELECT name FROM partitions'))
+
+    def Close(self):
+        with self.lock:
+            self.db.close()
+
+    def _Partition(self, played):
+        # Name of the month table for a play time, created when first needed
+        name = time.strftime('plays_%Y%m', time.gmtime(played))
+        if name not in self.partitions:
+            year, month = int(name[6:10]), int(name[10:12])
+            first_day = Day(calendar.timegm((year, month, 1, 0, 0, 0)))
+            last_day = first_day + calendar.monthrange(year, month)[1] - 1
+            self.db.execute('CREATE TABLE IF NOT EXISTS ' + name + ' ('
+                            'track_id TEXT, played REAL, artist TEXT, genre TEXT, '
+                            'PRIMARY KEY (track_id, played))')
+            self.db.execute('INSERT OR IGNORE INTO partitions VALUES (?, ?, ?)', (name, first_day, last_day))
+            self.partitions.add(name)
+        return name
+
+    def _Partitions(self, since=None, until=None):
+        # Month tables overlapping [since, until]
+        query = 'SELECT name FROM partitions WHERE 1'
+        params = []
+        if since is not None:
+            query += ' AND last_day >= ?'
+            params.append(Day(since))
+        if until is not None:
+            query += ' AND first_day <= ?'
+            params.append(Day(until))
+        return [row[0] for row in self.db.execute(query + ' ORDER BY first_day', params)]
+
+    def _Add(self, table, key_columns, rows, updates):
+        # Adds to the counters of rollup rows, creating them first if needed.
+        # rows is a list of (update parameters, key) tuples.
+        where = ' AND '.join(column + ' = ?' for column in key_columns)
+        self.db.executemany('INSERT OR IGNORE INTO ' + table + ' (' + ', '.join(key_columns) + ', plays) '
+                            'VALUES (' + ', '.join('?' * len(key_columns)) + ', 0)',
+                            [key for _, key in rows])
+        self.db.executemany('UPDATE ' + table + ' SET ' + updates + ' WHERE ' + where,
+                            [params + key for params, key in rows])
+
+    def Record(self, events):
+        # Appends plays. events is a list of (track, epoch seconds) tuples.
+        # Returns the number of plays which weren't recorded before.
+        tracks = {}
+        artists = {}
+        genre_days = {}
+        track_days = {}
+        with self.lock, self.db:
+            for track, played in events:
+                track_id = track['id']
+                artist = track.get('artist') or u''
+                genre = track.get('genre') or u''
+                cursor = self.db.execute('INSERT OR IGNORE INTO ' + self._Partition(played) +
+                                         ' VALUES (?, ?, ?, ?)', (track_id, played, artist, genre))
+                if cursor.rowcount != 1:
+                    continue
+                # Rollups are summed up here and written once per row
+                plays, first, last, _, _ = tracks.get(track_id, (0, played, played, None, None))
+                tracks[track_id] = (plays + 1, min(first, played), max(last, played), artist, genre)
+                plays, last = artists.get(artist, (0, played))
+                artists[artist] = (plays + 1, max(last, played))
+                day = Day(played)
+                genre_days[(genre, day)] = genre_days.get((genre, day), 0) + 1
+                track_days[(track_id, day)] = track_days.get((track_id, day), 0) + 1
+
+            self._Add('track_plays', ('track_id',),
+                      [((plays, artist, genre, first, first, last), (track_id,))
+                       for track_id, (plays, first, last, artist, genre) in tracks.iteritems()],
+                      'plays = plays + ?, artist = ?, genre = ?, '
+                      'first_played = MIN(COALESCE(first_played, ?), ?), '
+                      'last_played = MAX(COALESCE(last_played, 0), ?)')
+            self._Add('artist_plays', ('artist',),
+                      [((plays, last), (artist,)) for artist, (plays, last) in artists.iteritems()],
+                      'plays = plays + ?, last_played = MAX(COALESCE(last_played, 0), ?)')
+            self._Add('genre_day_plays', ('genre', 'day'),
+                      [((plays,), key) for key, plays in genre_days.iteritems()], 'plays = plays + ?')
+            self._Add('track_day_plays', ('track_id', 'day'),
+                      [((plays,), key) for key, plays in track_days.iteritems()], 'plays = plays + ?')
+        return sum(plays for plays, _, _, _, _ in tracks.values())
+
+    def RecordTracks(self, tracks):
+        # Appends one play per track, at its lastModifiedTimestamp, e.g. for
+        # the new plays found by FindNewPlays
+        return self.Record([(track, PlayedAt(track)) for track in tracks])
+
+    def Events(self, since=None, until=None):
+        # Yields (track id, played, artist, genre) in time order, reading only
+        # the months in range, one month at a time
+        with self.lock:
+            names = self._Partitions(since, until)
+        for name in names:
+            query = 'SELECT track_id, played, artist, genre FROM ' + name + ' WHERE 1'
+            params = []
+            if since is not None:
+                query += ' AND played >= ?'
+                params.append(since)
+            if until is not None:
+                query += ' AND played <= ?'
+                params.append(until)
+            with self.lock:
+                rows = self.db.execute(query + ' ORDER BY played', params).fetchall()
+            for row in rows:
+                yield row
+
+    def DropBefore(self, timestamp):
+        # Deletes the months which end before timestamp. The rollups keep
+        # counting their plays.
+        dropped = []
+        with self.lock, self.db:
+            for name, in self.db.execute('SELECT name FROM partitions WHERE last_day < ?',
+                                         (Day(timestamp),)).fetchall():
+                self.db.execute('DROP TABLE ' + name)
+                self.db.execute('DELETE FROM partitions WHERE name = ?', (name,))
+                self.partitions.discard(name)
+                dropped.append(name)
+        return dropped
+
+    def LastPlayed(self):
+        with self.lock:
+            return dict(self.db.execute('SELECT track_id, last_played FROM track_plays'))
+
+    def PlayCounts(self, days=None, now=None):
+        # {track id: plays}, over the last days days if given
+        with self.lock:
+            if days is None:
+                return dict(self.db.execute('SELECT track_id, plays FROM track_plays'))
+            since = Day(now or time.time()) - days + 1
+            return dict(self.db.execute('SELECT track_id, SUM(plays) FROM track_day_plays '
+                                        'WHERE day >= ? GROUP BY track_id', (since,)))
+
+    def TracksPlayedAtLeast(self, times, days=None, now=None):
+        return [track_id for track_id, plays in self.PlayCounts(days, now).iteritems() if plays >= times]
+
+    def PlaysByArtist(self, limit=None):
+        # [(artist, plays, last played)], most played first
+        query = 'SELECT artist, plays, last_played FROM artist_plays ORDER BY plays DESC, artist'
+        with self.lock:
+            if limit is not None:
+                return self.db.execute(query + ' LIMIT ?', (limit,)).fetchall()
+            return self.db.execute(query).fetchall()
+
+    def PlaysByGenre(self, period='day', days=None, now=None):
+        # [(genre, first day of the period, plays)], period 'day' or 'week'.
+        # Days are counted since the epoch.
+        query = 'SELECT genre, day, plays FROM genre_day_plays'
+        params = []
+        if days is not None:
+            query += ' WHERE day >= ?'
+            params.append(Day(now or time.time()) - days + 1)
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        totals = {}
+        for genre, day, plays in rows:
+            if period == 'week':
+                day = WeekStart(day)
+            totals[(genre, day)] = totals.get((genre, day), 0) + plays
+        return sorted((genre, day, plays) for (genre, day), plays in totals.iteritems())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+import sqlite3
+import time
+
+from track_match import MatchKey
+
+# On-disk cache of Last.FM play counts, so a sync only asks Last.FM about
+# tracks which changed since they were last looked up. Entries are keyed by
+# MatchKey(artist, title) and remember the play count, when it was fetched
+# and the track's Google playCount and lastModifiedTimestamp at that time.
+#
+# An entry is used only while it is younger than ttl_days and the Google side
+# of the track is unchanged. Expired entries are dropped, and beyond
+# max_entries the least recently used ones are.
+#
+# Usage:
+#    cache = PlayCountCache('lastfm_cache.db', ttl_days=7)
+#    counts, misses = cache.Split(library)  # cached counts, tracks to look up
+#                                           # (or MatchGroup.Query()s)
+#    cache.Store(misses, fetched_counts)
+#    cache.Invalidate(scrobbled_tracks)
+#    cache.Close()
+
+
+def GoogleState(track):
+    # The parts of a Google track which change when it is played
+    return (int(track.get('playCount', 0)), (track.get('lastModifiedTimestamp') or '').__str__())
+
+
+class PlayCountCache(object):
+
+    def __init__(self, file_name='lastfm_cache.db', ttl_days=7, max_entries=500000):
+        self.file_name = file_name
+        self.ttl = ttl_days * 24 * 3600
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(file_name)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS play_counts (
+                artist TEXT,
+                title TEXT,
+                plays INTEGER,
+                fetched REAL,
+                accessed REAL,
+                google_play_count INTEGER,
+                google_modified TEXT,
+                PRIMARY KEY (artist, title));
+            CREATE INDEX IF NOT EXISTS play_counts_accessed ON play_counts (accessed);
+        ''')
+
+    def Close(self):
+        self.Evict()
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM play_counts').fetchone()[0]
+
+    def Split(self, tracks):
+        # Returns ({track id: cached play count}, [tracks to look up])
+        now = time.time()
+        counts = {}
+        misses = []
+        used = set()
+        for track in tracks:
+            key = MatchKey(track.get('artist'), track.get('title'))
+            row = self.db.execute('SELECT plays, fetched, google_play_count, google_modified '
+                                  'FROM play_counts WHERE artist = ? AND title = ?', key).fetchone()
+            if row is not None and row[1] > now - self.ttl and (row[2], row[3]) == GoogleState(track):
+                counts[track['id']] = row[0]
+                used.add(key)
+            else:
+                misses.append(track)
+        with self.db:
+            self.db.executemany('UPDATE play_counts SET accessed = ? WHERE artist = ? AND title = ?',
+                                [(now,) + key for key in used])
+        self.hits += len(counts)
+        self.misses += len(misses)
+        return counts, misses
+
+    def Store(self, tracks, counts):
+        # Remembers the play counts looked up for tracks; counts maps track id
+        # to play count, or None if the lookup failed (which isn't cached)
+        now = time.time()
+        rows = []
+        for track in tracks:
+            plays = counts.get(track['id'])
+            if plays is None:
+                continue
+            rows.append(MatchKey(track.get('artist'), track.get('title')) +
+                        (plays, now, now) + GoogleState(track))
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO play_counts VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def Invalidate(self, tracks):
+        # Forgets the play counts of tracks whose Last.FM count is about to
+        # change, e.g. because they were scrobbled
+        with self.db:
+            cursor = self.db.executemany('DELETE FROM play_counts WHERE artist = ? AND title = ?',
+                                         [MatchKey(track.get('artist'), track.get('title')) for track in tracks])
+        return cursor.rowcount
+
+    def Evict(self):
+        # Drops expired entries, then the least recently used ones beyond
+        # max_entries. Returns the number of entries dropped.
+        with self.db:
+            dropped = self.db.execute('DELETE FROM play_counts WHERE fetched <= ?',
+                                      (time.time() - self.ttl,)).rowcount
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                dropped += self.db.execute('DELETE FROM play_counts WHERE rowid IN '
+                                           '(SELECT rowid FROM play_counts ORDER BY accessed LIMIT ?)',
+                                           (excess,)).rowcount
+        return dropped
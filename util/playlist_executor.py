@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+import random
+import threading
+import time
+import Queue
+
+from adaptive_batch import AdaptiveBatchSizer
+from rate_limit import TokenBucket
+
+# Runs playlist mutations (adding and removing tracks) against the Google
+# Music API. Calls are split into batches, every batch is retried with
+# exponential backoff and jitter, and the outcome of each batch is recorded.
+# Changes to different playlists can run concurrently; all workers share one
+# TokenBucket so the combined call rate stays under a global cap.
+#
+# Unless a fixed batch_size is given, batch sizes adapt to how quickly and
+# reliably the backend answers (see AdaptiveBatchSizer).
+#
+# api only needs the Mobileclient methods which are actually called, so a
+# stub Mobileclient which injects latency and failures works for testing.
+#
+# Usage:
+#    executor = PlaylistMutationExecutor(api, max_workers=4, rate=10)
+#    executor.RunAll([lambda: executor.AddSongs(playlist_id, song_ids), ...])
+#    executor.Failures()  # BatchResults of batches which never succeeded
+
+
+class BatchResult(object):
+
+    def __init__(self, playlist_name, operation, size, items=None):
+        self.playlist_name = playlist_name
+        self.operation = operation
+        self.size = size
+        self.items = items
+        self.value = None
+        self.success = False
+        self.attempts = 0
+        self.error = None
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return "<BatchResult %s %s size=%d success=%s attempts=%d>" % (
+            self.playlist_name, self.operation, self.size, self.success, self.attempts)
+
+
+class PlaylistMutationExecutor(object):
+
+    def __init__(self, api, max_workers=4, rate=10.0, max_retries=5,
+                 base_delay=0.5, max_delay=30.0, limiter=None, instrumentation=None):
+        self.api = api
+        self.instrumentation = instrumentation
+        self.max_workers = max_workers
+        self.limiter = limiter or TokenBucket(rate)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.results = []
+        self.lock = threading.Lock()
+        # Batch sizes adapt per operation and are shared by every playlist
+        self.sizers = {'adding': AdaptiveBatchSizer('adding'),
+                       'removing': AdaptiveBatchSizer('removing')}
+
+    def Backoff(self, attempt):
+        # Full jitter: anywhere between 0 and the exponential delay
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def Call(self, result, function, *args):
+        # Calls function, retrying on errors. Returns its return value, or
+        # None if every attempt failed.
+        start = time.time()
+        value = None
+        for attempt in range(self.max_retries):
+            self.limiter.Acquire()
+            result.attempts += 1
+            try:
+                value = function(*args)
+                result.value = value
+                result.success = True
+                break
+            except Exception as e:
+                result.error = e
+                if attempt < self.max_retries - 1:
+                    if self.instrumentation is not None:
+                        self.instrumentation.Count('playlist_retries', operation=result.operation)
+                    time.sleep(self.Backoff(attempt))
+        result.seconds = time.time() - start
+        with self.lock:
+            self.results.append(result)
+        if not result.success:
+            print "Error " + result.operation + " playlist " + (result.playlist_name or '').__str__() + \
+                " (" + result.size.__str__() + " tracks):", result.error
+        return value
+
+    def CreatePlaylist(self, playlist_name):
+        # Returns the new playlist's id, or None if it couldn't be created
+        return self.Call(BatchResult(playlist_name, 'creating', 0),
+                         self.api.create_playlist, playlist_name)
+
+    def EditPlaylist(self, playlist_id, playlist_name=None, **changes):
+        # Returns True if the playlist was updated
+        result = BatchResult(playlist_name, 'editing', 0)
+        self.Call(result, lambda: self.api.edit_playlist(playlist_id, **changes))
+        return result.success
+
+    def _SendInBatches(self, operation, function, items, batch_size, playlist_name):
+        # Sends items in batches of batch_size, or in adaptively sized
+        # batches if batch_size is None. Returns the BatchResults.
+        sizer = self.sizers[operation]
+        results = []
+        i = 0
+        while i < len(items):
+            size = batch_size or sizer.Size()
+            batch = items[i:i + size]
+            result = BatchResult(playlist_name, operation, len(batch), batch)
+            self.Call(result, function, batch)
+            if batch_size is None:
+                sizer.Record(result.seconds, result.success)
+            results.append(result)
+            i += size
+        return results
+
+    def AddSongs(self, playlist_id, song_ids, batch_size=None, playlist_name=None):
+        # Returns the BatchResults of every batch
+        return self._SendInBatches('adding',
+                                   lambda batch: self.api.add_songs_to_playlist(playlist_id, batch),
+                                   song_ids, batch_size, playlist_name)
+
+    def RemoveEntries(self, entry_ids, batch_size=None, playlist_name=None):
+        return self._SendInBatches('removing', self.api.remove_entries_from_playlist,
+                                   entry_ids, batch_size, playlist_name)
+
+    def IncrementPlayCounts(self, increments):
+        # increments maps song id to the number of plays to add. There is no
+        # bulk call for this, so each song is one call, run concurrently.
+        def Increment(song_id, plays):
+            result = BatchResult(None, 'incrementing play count of', 1)
+            self.Call(result, self.api.increment_song_playcount, song_id, plays)
+            return result
+        return self.RunAll([lambda song_id=song_id, plays=plays: Increment(song_id, plays)
+                            for song_id, plays in increments.items()])
+
+    def RunAll(self, jobs):
+        # Runs independent jobs (one per playlist) on up to max_workers
+        # threads. Returns their return values in the same order; a job which
+        # raised returns the exception.
+        queue = Queue.Queue()
+        for index, job in enumerate(jobs):
+            queue.put((index, job))
+        values = [None] * len(jobs)
+
+        def Worker():
+            while True:
+                try:
+                    index, job = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    values[index] = job()
+                except Exception as e:
+                    values[index] = e
+
+        threads = [threading.Thread(target=Worker) for _ in range(min(self.max_workers, len(jobs)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return values
+
+    def Failures(self):
+        with self.lock:
+            return [result for result in self.results if not result.success]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import threading
+
+# Lookup tables over the playlists returned by GetPlaylists, built once per
+# run: playlist by name, playlist by id, the playlist each entry belongs to
+# and the set of track ids in each playlist. The index is updated in place as
+# playlists are created and tracks are added or removed, so it never has to
+# be rebuilt in the middle of a run.
+#
+# Usage:
+#    index = PlaylistIndex(util.GetPlaylists())
+#    index.PlaylistID('Unrated')
+#    index.Entries('Unrated')
+#    track_id in index.TrackIds(playlist_id)
+
+
+class PlaylistIndex(object):
+
+    def __init__(self, playlists):
+        self.source = playlists
+        self.by_name = {}
+        self.by_id = {}
+        self.entry_playlists = {}
+        self.track_ids = {}
+        self.lock = threading.Lock()
+        for playlist in playlists:
+            self._Add(playlist)
+
+    def _Add(self, playlist):
+        playlist.setdefault('tracks', [])
+        # Like a linear scan, the first playlist with a name wins
+        self.by_name.setdefault(playlist['name'], playlist)
+        self.by_id[playlist['id']] = playlist
+        self.track_ids[playlist['id']] = set(entry['trackId'] for entry in playlist['tracks'])
+        for entry in playlist['tracks']:
+            self.entry_playlists[entry['id']] = playlist['id']
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def Get(self, playlist_name):
+        return self.by_name.get(playlist_name)
+
+    def PlaylistID(self, playlist_name):
+        # Returns None if there is no playlist with that name
+        playlist = self.by_name.get(playlist_name)
+        if playlist is None:
+            return None
+        return playlist['id']
+
+    def Entries(self, playlist_name):
+        playlist = self.by_name.get(playlist_name)
+        if playlist is None:
+            return []
+        return playlist['tracks']
+
+    def TrackIds(self, playlist_id):
+        return self.track_ids.get(playlist_id, set())
+
+    def AddPlaylist(self, playlist_id, playlist_name):
+        with self.lock:
+            playlist = {'id': playlist_id, 'name': playlist_name, 'tracks': []}
+            self._Add(playlist)
+            return playlist
+
+    def AddEntries(self, playlist_id, entry_ids, track_ids):
+        # Record entries created by add_songs_to_playlist, which returns the
+        # new entry ids in the same order as the songs it was given
+        with self.lock:
+            playlist = self.by_id[playlist_id]
+            for entry_id, track_id in zip(entry_ids, track_ids):
+                playlist['tracks'].append({'id': entry_id, 'trackId': track_id,
+                                           'playlistId': playlist_id})
+                self.track_ids[playlist_id].add(track_id)
+                self.entry_playlists[entry_id] = playlist_id
+
+    def RemoveEntries(self, entry_ids):
+        with self.lock:
+            removed = {}
+            for entry_id in entry_ids:
+                playlist_id = self.entry_playlists.pop(entry_id, None)
+                if playlist_id is not None:
+                    removed.setdefault(playlist_id, set()).add(entry_id)
+            for playlist_id, playlist_entry_ids in removed.items():
+                playlist = self.by_id[playlist_id]
+                playlist['tracks'] = [entry for entry in playlist['tracks']
+                                      if entry['id'] not in playlist_entry_ids]
+                self.track_ids[playlist_id] = set(entry['trackId'] for entry in playlist['tracks'])
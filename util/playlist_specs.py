@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+import heapq
+from columnar_library import ColumnarLibrary
+from library_index import LibraryIndex
+
+# Declarative playlist definitions which can all be evaluated in a single pass
+# over the library. Each spec keeps a bounded heap of its best candidates so
+# the library is never sorted as a whole.
+#
+# Usage:
+#    specs = [PlaylistSpec('Thumbs Up Least Played', 'playCount',
+#                          ratings=THUMBS_UP),
+#             PlaylistSpec('Rock Most Played', 'playCount', reverse=True,
+#                          ratings=THUMBS_UP, genre='Rock')]
+#    results = PlaylistGenerator().Evaluate(library, specs)
+#    results['Rock Most Played']  # list of tracks, best first
+
+THUMBS_UP = ('4', '5')  # 4-5 stars is thumbs up
+UNRATED = ('0', '3')    # 0 or 3 stars is unrated
+
+
+class PlaylistSpec(object):
+
+    # sort_key is the track field to order by. Ties are broken by track id.
+    # reverse=True puts the highest values first and needs a numeric field.
+    # track_filter is an optional callable for anything the other
+    # arguments can't express. values optionally maps track id to the value
+    # to sort by instead of the track's own sort_key field (e.g. play times
+    # from a PlayHistory); tracks missing from it sort by their own field.
+    def __init__(self, name, sort_key, reverse=False, limit=1000,
+                 ratings=None, genre=None, excluded_genres=None,
+                 track_filter=None, values=None):
+        self.name = name
+        self.sort_key = sort_key
+        self.reverse = reverse
+        self.limit = limit
+        self.ratings = ratings
+        self.genre = genre
+        self.excluded_genres = excluded_genres
+        self.track_filter = track_filter
+        self.values = values
+
+    def Matches(self, track):
+        if self.ratings is not None and track.get('rating') not in self.ratings:
+            return False
+        if self.genre is not None and track.get('genre') != self.genre:
+            return False
+        if self.excluded_genres is not None and track.get('genre') in self.excluded_genres:
+            return False
+        if self.track_filter is not None and not self.track_filter(track):
+            return False
+        return True
+
+    def Rank(self, track):
+        # Lower ranks come first in the playlist
+        value = None
+        if self.values is not None:
+            value = self.values.get(track.get('id'))
+        if value is None:
+            value = track.get(self.sort_key, 0)
+        if self.reverse:
+            value = -value
+        return (value, track.get('id'))
+
+
+class _HeapItem(object):
+    # Inverts the ordering so heapq keeps the worst candidate at the root,
+    # which is the one to drop when a better candidate comes along.
+    __slots__ = ('rank', 'track')
+
+    def __init__(self, rank, track):
+        self.rank = rank
+        self.track = track
+
+    def __lt__(self, other):
+        return self.rank > other.rank
+
+
+class PlaylistGenerator(object):
+
+    def Evaluate(self, library, specs):
+        # Returns a dict of spec name to list of tracks, in playlist order
+        if isinstance(library, ColumnarLibrary):
+            # Filters run as masks over whole columns instead
+            return dict((spec.name, library.TopRows(spec)) for spec in specs)
+        if isinstance(library, LibraryIndex):
+            library = library.Candidates(specs)
+
+        heaps = dict((spec.name, []) for spec in specs)
+
+        # Genre specs are looked up by the track's genre so each track is
+        # only checked against specs it could belong to
+        genre_specs = {}
+        other_specs = []
+        for spec in specs:
+            if spec.genre is not None:
+                genre_specs.setdefault(spec.genre, []).append(spec)
+            else:
+                other_specs.append(spec)
+
+        for track in library:
+            for spec in genre_specs.get(track.get('genre'), []) + other_specs:
+                if spec.limit < 1 or not spec.Matches(track):
+                    continue
+                heap = heaps[spec.name]
+                item = _HeapItem(spec.Rank(track), track)
+                if len(heap) < spec.limit:
+                    heapq.heappush(heap, item)
+                elif item.rank < heap[0].rank:
+                    heapq.heapreplace(heap, item)
+
+        results = {}
+        for spec in specs:
+            items = sorted(heaps[spec.name], key=lambda item: item.rank)
+            results[spec.name] = [item.track for item in items]
+        return results
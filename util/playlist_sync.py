@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+import bisect
+
+# Works out the smallest set of changes needed to turn an existing playlist
+# into a new list of songs. All membership checks are done with sets and
+# dicts so building a plan is linear in the size of the playlist instead of
+# quadratic.
+#
+# Usage:
+#    plan = PlaylistSyncPlan.Build(existing_entries, list_of_song_ids)
+#    plan.Print()           # dry-run
+#    plan.to_add            # song ids to append, in the requested order
+#    plan.to_remove         # playlist entry ids to delete
+#    plan.moves             # (entry, to_follow_entry, to_precede_entry)
+#
+# The moves only put the entries which are kept in the requested order. Added
+# songs are appended after them, since their entries don't exist until they
+# are added, so a playlist with new songs interleaved among the kept ones
+# doesn't end up in exactly the requested order.
+
+
+class PlaylistSyncPlan(object):
+
+    def __init__(self, playlist_name=None):
+        self.playlist_name = playlist_name
+        self.to_add = []
+        self.to_remove = []
+        self.moves = []
+
+    def IsEmpty(self):
+        return not (self.to_add or self.to_remove or self.moves)
+
+    def Print(self):
+        print "Plan for playlist", self.playlist_name, '-', \
+            len(self.to_add), 'to add,', \
+            len(self.to_remove), 'to remove,', \
+            len(self.moves), 'to move'
+
+    @classmethod
+    def Build(cls, existing_entries, list_of_songs, playlist_name=None):
+        plan = cls(playlist_name)
+        wanted_positions = {}
+        for position, song_id in enumerate(list_of_songs):
+            # Only the first occurrence of a song counts
+            wanted_positions.setdefault(song_id, position)
+
+        # Keep the first entry for each wanted track, remove everything else
+        kept = {}
+        for entry in existing_entries:
+            track_id = entry['trackId']
+            if track_id in wanted_positions and track_id not in kept:
+                kept[track_id] = entry
+            else:
+                plan.to_remove.append(entry['id'])
+
+        for song_id in list_of_songs:
+            if song_id not in kept:
+                plan.to_add.append(song_id)
+                # Guard against duplicate song ids in the requested list
+                kept[song_id] = None
+
+        plan.moves = cls.FindMoves(existing_entries, kept, wanted_positions)
+        return plan
+
+    @staticmethod
+    def FindMoves(existing_entries, kept, wanted_positions):
+        # Kept entries in their current playlist order, paired with where
+        # they should end up
+        current = [(wanted_positions[entry['trackId']], entry)
+                   for entry in existing_entries
+                   if kept.get(entry['trackId']) is entry]
+        if not current:
+            return []
+
+        # Entries on the longest increasing run of wanted positions are
+        # already in the right relative order and never need to move.
+        tails = []
+        tail_index = []
+        parents = [None] * len(current)
+        for i, (position, entry) in enumerate(current):
+            j = bisect.bisect_left(tails, position)
+            if j > 0:
+                parents[i] = tail_index[j - 1]
+            if j == len(tails):
+                tails.append(position)
+                tail_index.append(i)
+            else:
+                tails[j] = position
+                tail_index[j] = i
+        in_place = set()
+        i = tail_index[-1]
+        while i is not None:
+            in_place.add(i)
+            i = parents[i]
+
+        # Walk the kept entries in their wanted order. Each entry that has to
+        # move is placed after the one before it, which is in place by then.
+        # The first one has nothing before it, so it goes before the first
+        # entry which never moves.
+        ordered = sorted(range(len(current)), key=lambda k: current[k][0])
+        first_in_place = current[min(in_place, key=lambda k: current[k][0])][1]
+        moves = []
+        for n, i in enumerate(ordered):
+            if i in in_place:
+                continue
+            entry = current[i][1]
+            if n > 0:
+                moves.append((entry, current[ordered[n - 1]][1], None))
+            else:
+                moves.append((entry, None, first_in_place))
+        return moves
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+import threading
+import time
+
+# Thread-safe token bucket. Calls to Acquire block until a token is free, so
+# any number of workers sharing one bucket stay under rate calls per second
+# on average, with bursts of up to capacity calls.
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def Acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
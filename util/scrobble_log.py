@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import os
+import time
+
+# Record of plays which have already been scrobbled, so ScrobbleRecentPlays
+# never sends the same play twice. Plays are keyed by (track id, timestamp)
+# and held in a set, so checking a play is O(1). The file is only read when
+# first needed and entries older than the scrobble window are dropped by
+# Compact, so it doesn't grow forever.
+#
+# Each line of the file is "<track id>\t<timestamp in seconds>". Lines with
+# only a timestamp, as written by older versions, are still understood.
+#
+# Usage:
+#    log = ScrobbleLog('previous_scrobbles.txt', window_days=14)
+#    if not log.Contains(track_id, time_played):
+#        log.Add(track_id, time_played)
+#    log.Save()
+
+
+class ScrobbleLog(object):
+
+    def __init__(self, file_name='previous_scrobbles.txt', window_days=14):
+        self.file_name = file_name
+        self.window_days = window_days
+        self.entries = None
+        self.legacy_timestamps = None
+        self.pending = []
+        self.lines_on_disk = 0
+
+    def WindowStart(self):
+        # Epoch time of the oldest play still inside the window
+        return int(time.time() - self.window_days * 24 * 60 * 60)
+
+    def _Load(self):
+        if self.entries is not None:
+            return
+        self.entries = set()
+        self.legacy_timestamps = set()
+        if not os.path.exists(self.file_name):
+            return
+        window_start = self.WindowStart()
+        with open(self.file_name) as f:
+            for line in f:
+                self.lines_on_disk += 1
+                fields = line.strip().split('\t')
+                try:
+                    timestamp = int(fields[-1])
+                except ValueError:
+                    continue
+                if timestamp < window_start:
+                    continue
+                if len(fields) == 1:
+                    self.legacy_timestamps.add(timestamp)
+                else:
+                    self.entries.add((fields[0], timestamp))
+
+    def __len__(self):
+        self._Load()
+        return len(self.entries) + len(self.legacy_timestamps)
+
+    def Contains(self, track_id, timestamp):
+        self._Load()
+        timestamp = int(timestamp)
+        return (track_id, timestamp) in self.entries or timestamp in self.legacy_timestamps
+
+    def Add(self, track_id, timestamp):
+        self._Load()
+        entry = (track_id, int(timestamp))
+        if entry not in self.entries:
+            self.entries.add(entry)
+            self.pending.append(entry)
+
+    def Save(self):
+        # Append the plays added since the last save
+        if not self.pending:
+            return
+        with open(self.file_name, 'a') as f:
+            for track_id, timestamp in self.pending:
+                f.write("%s\t%d\n" % (track_id, timestamp))
+        self.lines_on_disk += len(self.pending)
+        self.pending = []
+
+    def NeedsCompaction(self):
+        # More than half of the file is outside the window
+        self._Load()
+        return self.lines_on_disk > 2 * len(self)
+
+    def Compact(self):
+        # Rewrite the file with only the plays inside the window. The new
+        # file is written next to the old one and renamed over it, so a crash
+        # never leaves a half written log.
+        self._Load()
+        window_start = self.WindowStart()
+        self.entries = set(entry for entry in self.entries if entry[1] >= window_start)
+        self.legacy_timestamps = set(timestamp for timestamp in self.legacy_timestamps
+                                     if timestamp >= window_start)
+        temp_file = self.file_name + '.tmp'
+        with open(temp_file, 'w') as f:
+            for timestamp in sorted(self.legacy_timestamps):
+                f.write("%d\n" % timestamp)
+            for track_id, timestamp in sorted(self.entries, key=lambda entry: entry[1]):
+                f.write("%s\t%d\n" % (track_id, timestamp))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_file, self.file_name)
+        self.lines_on_disk = len(self)
+        self.pending = []
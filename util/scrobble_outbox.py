@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+import random
+import sqlite3
+import time
+
+from lastfm_session import LastFMError, MAX_SCROBBLE_BATCH
+
+# Durable queue of scrobbles waiting to be sent to Last.FM. Plays are written
+# to SQLite before anything is sent and only removed once Last.FM has
+# answered, so a crash or network failure never loses a scrobble; whatever is
+# left over is sent on the next run.
+#
+# Scrobbles which failed max_attempts times, or which Last.FM rejected as
+# invalid, stay in the outbox as dead letters and are no longer sent, so they
+# don't hold up the scrobbles queued after them.
+#
+# Usage:
+#    outbox = ScrobbleOutbox('scrobble_outbox.db')
+#    outbox.Enqueue([(artist, title, timestamp), ...])
+#    outbox.Flush(session)  # sends up to 50 scrobbles per request
+#    outbox.DeadLetters()   # [(artist, title, timestamp, attempts)]
+
+
+class ScrobbleOutbox(object):
+
+    def __init__(self, file_name='scrobble_outbox.db', max_attempts=20):
+        self.file_name = file_name
+        self.max_attempts = max_attempts
+        self.db = sqlite3.connect(file_name)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                artist TEXT,
+                title TEXT,
+                timestamp INTEGER,
+                attempts INTEGER DEFAULT 0,
+                UNIQUE (artist, title, timestamp));
+        ''')
+
+    def Close(self):
+        self.db.close()
+
+    def Enqueue(self, scrobbles):
+        # scrobbles is a list of (artist, title, timestamp) tuples. The same
+        # play is only queued once.
+        with self.db:
+            cursor = self.db.executemany(
+                'INSERT OR IGNORE INTO outbox (artist, title, timestamp) VALUES (?, ?, ?)',
+                scrobbles)
+        return cursor.rowcount
+
+    def Pending(self):
+        return self.db.execute('SELECT COUNT(*) FROM outbox WHERE attempts < ?',
+                               (self.max_attempts,)).fetchone()[0]
+
+    def DeadLetters(self):
+        # Scrobbles which are no longer sent
+        return self.db.execute('SELECT artist, title, timestamp, attempts FROM outbox '
+                               'WHERE attempts >= ? ORDER BY timestamp, id',
+                               (self.max_attempts,)).fetchall()
+
+    def _CountAttempt(self, rows, attempts=1):
+        with self.db:
+            self.db.executemany('UPDATE outbox SET attempts = MIN(attempts + ?, ?) WHERE id = ?',
+                                [(attempts, self.max_attempts, row[0]) for row in rows])
+
+    def Flush(self, session, batch_size=MAX_SCROBBLE_BATCH, max_retries=5, base_delay=1.0):
+        # Sends the queued scrobbles oldest first. A batch which failed with a
+        # transient error is retried with exponential backoff and jitter;
+        # after max_retries it is left in the outbox for the next run. Other
+        # Last.FM errors (e.g. bad credentials) stop the flush without
+        # retrying. Returns the number of scrobbles sent.
+        sent = 0
+        while True:
+            rows = self.db.execute('SELECT id, artist, title, timestamp FROM outbox WHERE attempts < ? '
+                                   'ORDER BY timestamp, id LIMIT ?', (self.max_attempts, batch_size)).fetchall()
+            if not rows:
+                break
+            batch_sent, stop = self._Send(session, rows, max_retries, base_delay)
+            sent += batch_sent
+            if stop:
+                break
+        return sent
+
+    def _Send(self, session, rows, max_retries, base_delay):
+        # Sends one batch. Returns (scrobbles sent, whether to stop flushing).
+        for retries in range(max_retries + 1):
+            try:
+                accepted = session.Scrobble([(artist, title, timestamp)
+                                             for _, artist, title, timestamp in rows])
+                break
+            except LastFMError as e:
+                if e.IsRejected():
+                    return self._Reject(session, rows, e, max_retries, base_delay)
+                self._CountAttempt(rows)
+                if not e.IsTransient():
+                    print "Error scrobbling batch, leaving " + self.Pending().__str__() + \
+                        " scrobbles in outbox:", e
+                    return 0, True
+            except Exception as e:
+                self._CountAttempt(rows)
+            if retries == max_retries:
+                print "Error scrobbling batch, leaving " + self.Pending().__str__() + \
+                    " scrobbles in outbox:", e
+                return 0, True
+            delay = base_delay * (2 ** retries)
+            print "Error scrobbling batch. Trying again in %.1f seconds..." % delay
+            time.sleep(delay * random.uniform(0.5, 1.5))
+
+        # Last.FM answered, so the batch is done. Scrobbles it ignored
+        # (e.g. too old) would be ignored again on a retry.
+        with self.db:
+            self.db.executemany('DELETE FROM outbox WHERE id = ?', [(row[0],) for row in rows])
+        if accepted < len(rows):
+            print (len(rows) - accepted).__str__() + " scrobbles were ignored by Last.FM."
+        return len(rows), False
+
+    def _Reject(self, session, rows, error, max_retries, base_delay):
+        # A rejected batch may be one bad scrobble among good ones, so its
+        # scrobbles are sent one at a time and only the bad ones are
+        # dead-lettered
+        if len(rows) == 1:
+            print "Last.FM rejected scrobble " + rows[0][1] + " - " + rows[0][2] + \
+                ", moving it to dead letters:", error
+            self._CountAttempt(rows, self.max_attempts)
+            return 0, False
+        sent = 0
+        for row in rows:
+            row_sent, stop = self._Send(session, [row], max_retries, base_delay)
+            sent += row_sent
+            if stop:
+                return sent, True
+        return sent, False
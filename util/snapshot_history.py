@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+import json
+import sqlite3
+import time
+
+from library_diff import LibraryDiff
+
+# History of library snapshots in SQLite. The first snapshot is stored in
+# full (the base); every later one only as the fields which changed per track
+# id, so the database grows with the amount of change rather than with the
+# library size times the number of runs. The latest snapshot is also kept in
+# full (the head) so recording the next one doesn't need a reconstruction.
+#
+# Any version can be reconstructed from its base and the deltas after it,
+# and new plays between two versions are found from the deltas alone.
+# rebase_every stores a new full base after that many deltas, to bound how
+# many deltas a reconstruction has to apply.
+#
+# Usage:
+#    history = SnapshotHistory('history.db')
+#    version = history.Record(library)
+#    old_library = history.Snapshot(version - 1)
+#    new_plays = history.NewPlays(version - 1)  # tracks played since then
+
+
+class SnapshotHistory(object):
+
+    def __init__(self, file_name='history.db', rebase_every=None):
+        self.file_name = file_name
+        self.rebase_every = rebase_every
+        self.db = sqlite3.connect(file_name)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS versions (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                taken REAL,
+                is_base INTEGER,
+                tracks INTEGER,
+                changes INTEGER);
+            CREATE TABLE IF NOT EXISTS base_tracks (
+                version INTEGER,
+                id TEXT,
+                data TEXT,
+                PRIMARY KEY (version, id));
+            CREATE TABLE IF NOT EXISTS deltas (
+                version INTEGER,
+                id TEXT,
+                kind TEXT,
+                data TEXT,
+                PRIMARY KEY (version, id));
+            CREATE INDEX IF NOT EXISTS deltas_by_id ON deltas (id, version);
+            CREATE TABLE IF NOT EXISTS head (
+                id TEXT PRIMARY KEY,
+                data TEXT);
+        ''')
+
+    def Close(self):
+        self.db.close()
+
+    def Latest(self):
+        # Newest version number, or None if nothing was recorded yet
+        return self.db.execute('SELECT MAX(version) FROM versions').fetchone()[0]
+
+    def Versions(self):
+        # (version, taken, is_base, tracks, changes) for every version
+        return self.db.execute('SELECT version, taken, is_base, tracks, changes '
+                               'FROM versions ORDER BY version').fetchall()
+
+    @staticmethod
+    def Delta(old_track, new_track):
+        # The fields of new_track which differ from old_track, the values
+        # they replace, and the fields which were removed
+        changes = {'set': {}, 'old': {}, 'unset': []}
+        for field, value in new_track.iteritems():
+            if field not in old_track:
+                changes['set'][field] = value
+            elif old_track[field] != value:
+                changes['set'][field] = value
+                changes['old'][field] = old_track[field]
+        for field, value in old_track.iteritems():
+            if field not in new_track:
+                changes['unset'].append(field)
+                changes['old'][field] = value
+        return changes
+
+    def _WriteBase(self, version, rows):
+        self.db.executemany('INSERT INTO base_tracks (version, id, data) VALUES (?, ?, ?)',
+                            [(version, track_id, data) for track_id, data in rows])
+
+    def Record(self, library):
+        # Stores the library as a new version and returns its number
+        head = dict(self.db.execute('SELECT id, data FROM head'))
+        tracks = [track for track in library if 'id' in track]
+        with self.db:
+            latest = self.Latest()
+            since_base = 0
+            if latest is not None:
+                last_base = self.db.execute('SELECT MAX(version) FROM versions WHERE is_base = 1').fetchone()[0]
+                since_base = latest - last_base
+            is_base = latest is None or (self.rebase_every is not None and since_base >= self.rebase_every)
+            version = self.db.execute('INSERT INTO versions (taken, is_base, tracks, changes) VALUES (?, ?, ?, 0)',
+                                      (time.time(), int(is_base), len(tracks))).lastrowid
+
+            # Only tracks which differ from the head are encoded again
+            deltas = []
+            updated = []
+            seen = set()
+            for track in tracks:
+                track_id = track['id']
+                seen.add(track_id)
+                old_data = head.get(track_id)
+                if old_data is None:
+                    data = json.dumps(track)
+                    deltas.append((version, track_id, 'added', data))
+                    updated.append((track_id, data))
+                    continue
+                old_track = json.loads(old_data)
+                if old_track != track:
+                    deltas.append((version, track_id, 'changed', json.dumps(self.Delta(old_track, track))))
+                    updated.append((track_id, json.dumps(track)))
+            for track_id, old_data in head.iteritems():
+                if track_id not in seen:
+                    deltas.append((version, track_id, 'removed', old_data))
+
+            if is_base:
+                self._WriteBase(version, [(track['id'], json.dumps(track)) for track in tracks])
+            if latest is not None:
+                # Deltas are kept for bases too, so NewPlays can look across them
+                self.db.executemany('INSERT INTO deltas (version, id, kind, data) VALUES (?, ?, ?, ?)', deltas)
+            self.db.execute('UPDATE versions SET changes = ? WHERE version = ?', (len(deltas), version))
+
+            self.db.executemany('DELETE FROM head WHERE id = ?',
+                                [(track_id,) for _, track_id, kind, _ in deltas if kind == 'removed'])
+            self.db.executemany('INSERT OR REPLACE INTO head (id, data) VALUES (?, ?)', updated)
+        return version
+
+    def _Base(self, version):
+        row = self.db.execute('SELECT MAX(version) FROM versions WHERE is_base = 1 AND version <= ?',
+                              (version,)).fetchone()
+        if row[0] is None:
+            raise KeyError("No snapshot version " + version.__str__())
+        return row[0]
+
+    def _Apply(self, tracks, track_id, kind, data):
+        if kind == 'added':
+            tracks[track_id] = json.loads(data)
+        elif kind == 'removed':
+            tracks.pop(track_id, None)
+        else:
+            changes = json.loads(data)
+            track = tracks[track_id]
+            track.update(changes['set'])
+            for field in changes['unset']:
+                track.pop(field, None)
+
+    def Snapshot(self, version=None):
+        # Reconstructs the library as it was at version (default: latest)
+        if version is None:
+            version = self.Latest()
+        base = self._Base(version)
+        tracks = {}
+        order = []
+        for track_id, data in self.db.execute('SELECT id, data FROM base_tracks WHERE version = ? '
+                                              'ORDER BY rowid', (base,)):
+            tracks[track_id] = json.loads(data)
+            order.append(track_id)
+        # A track which is removed and added again keeps its first place
+        listed = set(order)
+        for track_id, kind, data in self.db.execute('SELECT id, kind, data FROM deltas '
+                                                    'WHERE version > ? AND version <= ? '
+                                                    'ORDER BY version, rowid', (base, version)):
+            if kind == 'added' and track_id not in listed:
+                order.append(track_id)
+                listed.add(track_id)
+            self._Apply(tracks, track_id, kind, data)
+        return [tracks[track_id] for track_id in order if track_id in tracks]
+
+    def Tracks(self, track_ids, version=None):
+        # Reconstructs only the given tracks at version. Returns {id: track}.
+        if version is None:
+            version = self.Latest()
+        base = self._Base(version)
+        tracks = {}
+        for track_id in track_ids:
+            row = self.db.execute('SELECT data FROM base_tracks WHERE version = ? AND id = ?',
+                                  (base, track_id)).fetchone()
+            if row is not None:
+                tracks[track_id] = json.loads(row[0])
+            for kind, data in self.db.execute('SELECT kind, data FROM deltas WHERE id = ? '
+                                              'AND version > ? AND version <= ? ORDER BY version',
+                                              (track_id, base, version)):
+                self._Apply(tracks, track_id, kind, data)
+        return tracks
+
+    def NewPlays(self, since, until=None):
+        # Tracks (as they were at until, default latest) whose playCount went
+        # up after version since, found from the deltas in between. Follows
+        # the same rules as LibraryDiff.IsNewPlay.
+        if until is None:
+            until = self.Latest()
+        old_tracks = {}
+        touched = []
+        for track_id, kind, data in self.db.execute('SELECT id, kind, data FROM deltas '
+                                                    'WHERE version > ? AND version <= ? '
+                                                    'ORDER BY version, rowid', (since, until)):
+            if track_id in old_tracks:
+                continue
+            if kind == 'added':
+                old_tracks[track_id] = None
+                touched.append(track_id)
+            elif kind == 'changed':
+                changes = json.loads(data)
+                if 'playCount' in changes['set'] or 'playCount' in changes['unset']:
+                    # The value replaced here is the one the track had at since
+                    old_tracks[track_id] = {}
+                    if 'playCount' in changes['old']:
+                        old_tracks[track_id]['playCount'] = changes['old']['playCount']
+                    touched.append(track_id)
+
+        new_tracks = self.Tracks(touched, until)
+        diff = LibraryDiff()
+        return [new_tracks[track_id] for track_id in touched
+                if track_id in new_tracks and diff.IsNewPlay(old_tracks[track_id], new_tracks[track_id])]
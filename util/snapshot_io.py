@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+import contextlib
+import gzip
+import json
+
+# Streaming library snapshots in JSON Lines format: one track dictionary per
+# line, optionally compressed with gzip or zstd. Tracks are written and read
+# one at a time, so a snapshot never has to be held in memory as a whole.
+#
+# Usage:
+#    DumpTracksToJSONL(library, 'library.jsonl.gz')
+#    for track in IterTracksFromJSONL('library.jsonl.gz'):
+#        ...
+
+READ_CHUNK_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def CompressionFor(file_name, compression=None):
+    # Use the given compression, otherwise guess it from the file extension
+    if compression is not None:
+        return compression
+    if file_name.endswith('.gz'):
+        return 'gzip'
+    if file_name.endswith('.zst'):
+        return 'zstd'
+    return None
+
+
+def _RequireZstandard():
+    # zstandard is optional, and only imported when a zstd file is used
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression needs the zstandard package: pip install zstandard")
+    return zstandard
+
+
+@contextlib.contextmanager
+def OpenForWriting(file_name, compression=None, buffer_size=WRITE_BUFFER_SIZE):
+    # Opens a buffered, optionally compressed file for writing
+    compression = CompressionFor(file_name, compression)
+    with open(file_name, 'wb', buffer_size) as raw:
+        if compression == 'gzip':
+            fp = gzip.GzipFile(fileobj=raw, mode='wb')
+        elif compression == 'zstd':
+            fp = _RequireZstandard().ZstdCompressor().stream_writer(raw)
+        else:
+            fp = raw
+        try:
+            yield fp
+        finally:
+            if fp is not raw:
+                fp.close()
+
+
+def DumpTracksToJSONL(list_of_tracks, file_name, compression=None):
+    # Writes each track on its own line. list_of_tracks can be any iterable,
+    # including a generator. Returns the number of tracks written.
+    count = 0
+    with OpenForWriting(file_name, compression) as fp:
+        for track in list_of_tracks:
+            fp.write(json.dumps(track))
+            fp.write('\n')
+            count += 1
+    return count
+
+
+def _IterLines(fp):
+    # Splits a binary stream into lines without relying on readline, which
+    # not every decompressor supports
+    pending = ''
+    while True:
+        chunk = fp.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def IterTracksFromJSONL(file_name, compression=None):
+    # Yields the tracks of a snapshot one at a time. Files written by
+    # DumpTracksToJSON (a single JSON list) are read as well.
+    compression = CompressionFor(file_name, compression)
+    with open(file_name, 'rb') as raw:
+        if compression == 'gzip':
+            fp = gzip.GzipFile(fileobj=raw, mode='rb')
+        elif compression == 'zstd':
+            fp = _RequireZstandard().ZstdDecompressor().stream_reader(raw)
+        else:
+            fp = raw
+        for line in _IterLines(fp):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, list):
+                for track in item:
+                    yield track
+            else:
+                yield item
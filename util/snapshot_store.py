@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+import json
+import sqlite3
+
+# Local SQLite copy of the Google Music library and playlists. Every row keeps
+# its lastModifiedTimestamp, so later runs only need to ask Google for items
+# modified after the newest one already stored.
+#
+# Usage:
+#    store = SnapshotStore('library.db')
+#    store.UpsertTracks(changed_tracks)  # or ReplaceTracks(all_tracks)
+#    library = store.Library()      # same shape as GetLibrary
+#    playlists = store.Playlists()  # same shape as GetPlaylists
+
+
+class SnapshotStore(object):
+
+    def __init__(self, file_name='library.db'):
+        self.file_name = file_name
+        self.db = sqlite3.connect(file_name)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS tracks (
+                id TEXT PRIMARY KEY,
+                last_modified INTEGER,
+                data TEXT);
+            CREATE TABLE IF NOT EXISTS playlists (
+                id TEXT PRIMARY KEY,
+                last_modified INTEGER,
+                data TEXT);
+            CREATE TABLE IF NOT EXISTS playlist_entries (
+                id TEXT PRIMARY KEY,
+                playlist_id TEXT,
+                position TEXT,
+                last_modified INTEGER,
+                data TEXT);
+            CREATE INDEX IF NOT EXISTS playlist_entries_by_playlist
+                ON playlist_entries (playlist_id);
+        ''')
+
+    def Close(self):
+        self.db.close()
+
+    def LastModified(self, table):
+        # Newest lastModifiedTimestamp stored in a table, in microseconds.
+        # Returns None if the table is empty.
+        row = self.db.execute('SELECT MAX(last_modified) FROM ' + table).fetchone()
+        return row[0]
+
+    def _Upsert(self, table, items, extra_columns=None, replace=False):
+        # Writes items to the table in one transaction. Items flagged as
+        # deleted by Google are removed instead, and items whose stored
+        # lastModifiedTimestamp is the same aren't rewritten. With replace,
+        # items are a full fetch, so stored items missing from it are removed.
+        upserted = 0
+        deleted = 0
+        if replace:
+            stored = dict(self.db.execute('SELECT id, last_modified FROM ' + table))
+        with self.db:
+            seen = set()
+            for item in items:
+                seen.add(item['id'])
+                if item.get('deleted'):
+                    self.db.execute('DELETE FROM ' + table + ' WHERE id = ?', (item['id'],))
+                    deleted += 1
+                    continue
+                last_modified = int(item.get('lastModifiedTimestamp', 0))
+                if replace:
+                    stored_modified = stored.get(item['id'])
+                else:
+                    row = self.db.execute('SELECT last_modified FROM ' + table + ' WHERE id = ?',
+                                          (item['id'],)).fetchone()
+                    stored_modified = row[0] if row is not None else None
+                if last_modified and stored_modified == last_modified:
+                    continue
+                columns = ['id', 'last_modified', 'data']
+                values = [item['id'], last_modified, json.dumps(item)]
+                if extra_columns:
+                    for column, key in extra_columns:
+                        columns.append(column)
+                        values.append(item.get(key))
+                self.db.execute('INSERT OR REPLACE INTO ' + table + ' (' + ', '.join(columns) +
+                                ') VALUES (' + ', '.join('?' * len(columns)) + ')', values)
+                upserted += 1
+            if replace:
+                missing = [(item_id,) for item_id in stored if item_id not in seen]
+                self.db.executemany('DELETE FROM ' + table + ' WHERE id = ?', missing)
+                deleted += len(missing)
+        return upserted, deleted
+
+    def UpsertTracks(self, tracks):
+        return self._Upsert('tracks', tracks)
+
+    def ReplaceTracks(self, tracks):
+        # Brings the stored tracks in line with a full GetLibrary fetch
+        return self._Upsert('tracks', tracks, replace=True)
+
+    def UpsertPlaylists(self, playlists, replace=False):
+        # Playlist metadata only. Entries are stored separately.
+        stripped = []
+        for playlist in playlists:
+            playlist = dict(playlist)
+            playlist.pop('tracks', None)
+            stripped.append(playlist)
+        return self._Upsert('playlists', stripped, replace=replace)
+
+    def UpsertPlaylistEntries(self, entries, replace=False):
+        return self._Upsert('playlist_entries', entries,
+                            [('playlist_id', 'playlistId'), ('position', 'absolutePosition')],
+                            replace=replace)
+
+    def ReplacePlaylists(self, playlists):
+        # Brings the stored playlists in line with a full GetPlaylists fetch
+        self.UpsertPlaylists(playlists, replace=True)
+        self.UpsertPlaylistEntries([entry for playlist in playlists for entry in playlist.get('tracks', [])],
+                                   replace=True)
+
+    def Library(self):
+        return [json.loads(data) for (data,) in self.db.execute('SELECT data FROM tracks')]
+
+    def Playlists(self):
+        # Rebuilds the get_all_user_playlist_contents structure: each user
+        # playlist with its entries in playlist order under 'tracks'
+        playlists = []
+        by_id = {}
+        for (data,) in self.db.execute('SELECT data FROM playlists'):
+            playlist = json.loads(data)
+            if playlist.get('type', 'USER_GENERATED') != 'USER_GENERATED':
+                continue
+            playlist['tracks'] = []
+            by_id[playlist['id']] = playlist
+            playlists.append(playlist)
+
+        for playlist_id, data in self.db.execute(
+                'SELECT playlist_id, data FROM playlist_entries ORDER BY playlist_id, position'):
+            if playlist_id in by_id:
+                by_id[playlist_id]['tracks'].append(json.loads(data))
+        return playlists
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+import random
+import time
+import uuid
+
+# Generates libraries and playlists shaped like gmusicapi's get_all_songs and
+# get_all_user_playlist_contents output, for benchmarks and offline testing.
+# A seed makes the output repeatable.
+#
+# Usage:
+#    generator = SyntheticLibrary(seed=1)
+#    library = generator.Library(10000)
+#    playlists = generator.Playlists(library, 50)
+#    newer = generator.PlayTracks(library, 0.01)  # 1% of tracks played again
+
+GENRES = ('Rock', 'Pop', 'Jazz', 'Classical', 'Hip-Hop', 'Electronic', 'Folk',
+          'Blues', 'Country', 'Metal', 'Punk', 'Soul', 'Reggae', 'Ambient',
+          'Soundtrack', 'Indie', 'R&B', 'Latin', 'World', 'Alternative')
+
+RATINGS = ('0', '0', '0', '1', '3', '4', '5', '5')
+
+WORDS = ('love', 'night', 'city', 'fire', 'blue', 'heart', 'road', 'dream',
+         'light', 'rain', 'gold', 'summer', 'ghost', 'river', 'wild', 'home',
+         'star', 'shadow', 'electric', 'silver', 'ocean', 'time', 'black')
+
+
+class SyntheticLibrary(object):
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+
+    def _Id(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128)))
+
+    def _Name(self, words=3):
+        return ' '.join(self.random.choice(WORDS).title()
+                        for _ in range(self.random.randint(1, words)))
+
+    def Library(self, number_of_tracks, tracks_per_album=12, albums_per_artist=4):
+        now = int(time.time() * 1000000)
+        library = []
+        artist = album = genre = year = None
+        track_number = 0
+        for i in range(number_of_tracks):
+            if i % (tracks_per_album * albums_per_artist) == 0:
+                artist = self._Name(2) + ' ' + i.__str__()
+                genre = self.random.choice(GENRES)
+            if i % tracks_per_album == 0:
+                album = self._Name(4) + ' ' + i.__str__()
+                year = self.random.randint(1960, 2018)
+                track_number = 0
+            track_number += 1
+
+            modified = now - self.random.randint(0, 365 * 24 * 3600) * 1000000
+            track = {
+                'kind': 'sj#track',
+                'id': self._Id(),
+                'clientId': self._Id(),
+                'title': self._Name(4),
+                'artist': artist,
+                'albumArtist': artist,
+                'album': album,
+                'genre': genre,
+                'year': year,
+                'trackNumber': track_number,
+                'discNumber': 1,
+                'durationMillis': str(self.random.randint(90, 600) * 1000),
+                'estimatedSize': str(self.random.randint(2, 15) * 1000000),
+                'rating': self.random.choice(RATINGS),
+                'creationTimestamp': str(modified - 1000000),
+                'lastModifiedTimestamp': str(modified),
+                'recentTimestamp': str(modified),
+                'deleted': False,
+                'lastPlayed': modified / 1000000.0,
+            }
+            # Never played tracks don't have a playCount key
+            if self.random.random() < 0.7:
+                track['playCount'] = self.random.randint(1, 200)
+            library.append(track)
+        return library
+
+    def Playlists(self, library, number_of_playlists, tracks_per_playlist=200):
+        now = str(int(time.time() * 1000000))
+        playlists = []
+        for i in range(number_of_playlists):
+            playlist_id = self._Id()
+            tracks = self.random.sample(library, min(tracks_per_playlist, len(library)))
+            entries = []
+            for position, track in enumerate(tracks):
+                entries.append({'kind': 'sj#playlistEntry',
+                                'id': self._Id(),
+                                'clientId': self._Id(),
+                                'playlistId': playlist_id,
+                                'trackId': track['id'],
+                                'absolutePosition': '%020d' % position,
+                                'lastModifiedTimestamp': now,
+                                'deleted': False,
+                                'source': '1'})
+            playlists.append({'kind': 'sj#playlist',
+                              'id': playlist_id,
+                              'name': 'Playlist ' + i.__str__() + ' ' + self._Name(2),
+                              'type': 'USER_GENERATED',
+                              'ownerName': 'Benchmark',
+                              'accessControlled': False,
+                              'deleted': False,
+                              'lastModifiedTimestamp': now,
+                              'tracks': entries})
+        return playlists
+
+    def PlayTracks(self, library, fraction=0.01):
+        # Returns a copy of the library in which a fraction of the tracks has
+        # been played again
+        now = int(time.time() * 1000000)
+        newer = []
+        for track in library:
+            track = dict(track)
+            if self.random.random() < fraction:
+                track['playCount'] = track.get('playCount', 0) + 1
+                track['lastModifiedTimestamp'] = str(now)
+            newer.append(track)
+        return newer
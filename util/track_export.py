@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+import csv
+
+from snapshot_io import CompressionFor, OpenForWriting
+
+# Streaming export of tracks to CSV, TSV or Parquet, driven by a field spec.
+# A field spec is a list of (header, key, type) tuples, or just keys, in
+# which case the key is also the header. type is 'string', 'int' or 'float'
+# and is only needed for Parquet, whose columns must have a fixed type.
+#
+# Tracks can be any iterable, including a generator or a ColumnarLibrary, and
+# are written one row at a time through a buffered, optionally compressed
+# file. Missing fields are written as empty cells (or nulls in Parquet).
+#
+# Usage:
+#    ExportTracks(library, 'library.csv')
+#    ExportTracks(library, 'library.tsv.gz', fields=['artist', 'title', 'playCount'])
+#    ExportTracks(library, 'library.parquet')  # needs pyarrow
+
+DEFAULT_FIELDS = [('Artist', 'artist', 'string'),
+                  ('Album', 'album', 'string'),
+                  ('Title', 'title', 'string'),
+                  ('Genre', 'genre', 'string'),
+                  ('Plays', 'playCount', 'int'),
+                  ('Rating', 'rating', 'string'),
+                  ('Last Played', 'lastPlayed', 'float')]
+
+# Tracks per Parquet row group
+PARQUET_ROW_GROUP_SIZE = 100000
+
+
+def NormalizeFields(fields):
+    # Returns the field spec as a list of (header, key, type) tuples
+    normalized = []
+    for field in fields or DEFAULT_FIELDS:
+        if isinstance(field, basestring):
+            normalized.append((field, field, None))
+        elif len(field) == 2:
+            normalized.append((field[0], field[1], None))
+        else:
+            normalized.append(tuple(field))
+    return normalized
+
+
+def FormatFor(file_name, format=None):
+    # Use the given format, otherwise guess it from the file extension
+    if format is not None:
+        return format
+    name = file_name
+    if CompressionFor(file_name) is not None:
+        name = name.rsplit('.', 1)[0]
+    if name.endswith('.tsv'):
+        return 'tsv'
+    if name.endswith('.parquet'):
+        return 'parquet'
+    return 'csv'
+
+
+def _Cell(value):
+    # A csv module cell: missing values become '' and unicode is encoded as
+    # UTF-8
+    if value.__class__ is unicode:
+        return value.encode('utf-8')
+    if value is None:
+        return ''
+    return value
+
+
+def Extractor(fields):
+    # Returns a function turning a track into a row for the csv module. Each
+    # field costs one get(), so a missing field costs no exception.
+    keys = [key for _, key, _ in fields]
+
+    def Extract(track):
+        get = track.get
+        return [_Cell(get(key)) for key in keys]
+    return Extract
+
+
+def _ExportDelimited(tracks, file_name, fields, delimiter, compression):
+    extract = Extractor(fields)
+    count = [0]
+
+    def Rows():
+        for track in tracks:
+            count[0] += 1
+            yield extract(track)
+
+    with OpenForWriting(file_name, compression) as fp:
+        writer = csv.writer(fp, delimiter=delimiter)
+        writer.writerow([header for header, _, _ in fields])
+        writer.writerows(Rows())
+    return count[0]
+
+
+def _ParquetType(pyarrow, type):
+    if type is None:
+        return None
+    return {'string': pyarrow.string(), 'int': pyarrow.int64(), 'float': pyarrow.float64()}[type]
+
+
+def _Converter(type):
+    # Converts a value to the column's type; values which can't be
+    # converted become nulls
+    convert = {'string': unicode, 'int': int, 'float': float}.get(type)
+
+    def Convert(value):
+        if value is None or convert is None:
+            return value
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            return None
+    return Convert
+
+
+def _ExportParquet(tracks, file_name, fields, compression):
+    # pyarrow is slow to import, so it is only imported here
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export needs the pyarrow package: pip install pyarrow")
+    keys = [key for _, key, _ in fields]
+    headers = [header for header, _, _ in fields]
+    converters = [_Converter(type) for _, _, type in fields]
+    types = [_ParquetType(pyarrow, type) for _, _, type in fields]
+    columns = [[] for _ in fields]
+    writer = None
+    count = 0
+
+    def Flush(writer):
+        arrays = [pyarrow.array(column, type=type) for column, type in zip(columns, types)]
+        table = pyarrow.Table.from_arrays(arrays, headers)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(file_name, table.schema,
+                                                   compression=compression or 'snappy')
+        writer.write_table(table)
+        for column in columns:
+            del column[:]
+        return writer
+
+    try:
+        for track in tracks:
+            get = track.get
+            for column, key, convert in zip(columns, keys, converters):
+                column.append(convert(get(key)))
+            count += 1
+            if count % PARQUET_ROW_GROUP_SIZE == 0:
+                writer = Flush(writer)
+        if writer is None or count % PARQUET_ROW_GROUP_SIZE:
+            writer = Flush(writer)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def ExportTracks(tracks, file_name, fields=None, format=None, compression=None):
+    # Writes tracks to file_name as CSV, TSV or Parquet. Returns the number
+    # of tracks written. For CSV and TSV, compression is 'gzip' or 'zstd'
+    # (guessed from the extension by default); for Parquet it is the codec
+    # used inside the file.
+    fields = NormalizeFields(fields)
+    format = FormatFor(file_name, format)
+    if format == 'parquet':
+        return _ExportParquet(tracks, file_name, fields, compression)
+    if format == 'tsv':
+        return _ExportDelimited(tracks, file_name, fields, '\t', compression)
+    if format == 'csv':
+        return _ExportDelimited(tracks, file_name, fields, ',', compression)
+    raise ValueError("Unknown export format: " + format.__str__())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+import unicodedata
+
+# Normalization of artist and title names for matching Google tracks with
+# Last.FM. "Song (feat. Someone)", "Song - 2011 Remaster" and "SONG!" are
+# the same Last.FM track, so they get the same match key. MatchIndex groups
+# a library's tracks by match key once, so the Last.FM sync asks about each
+# identity once instead of once per Google track.
+#
+# Usage:
+#    CleanName(u'Song (feat. Someone) - Remastered')  # u'Song'
+#    MatchKey(u'The Band', u'Song!')                  # (u'band', u'song')
+#    index = MatchIndex(library)
+#    for group in index.Groups():
+#        group.artist, group.title, group.tracks
+
+# "(feat. X)", "[ft. X]" or a trailing "feat. X". Without brackets it has to
+# follow a word, so titles such as "Ft. Lauderdale" are left alone.
+FEATURING = re.compile(r'\s*[\(\[]\s*(?:feat\.?|ft\.?|featuring)\s[^\)\]]*[\)\]]'
+                       r'|(?<=\S)\s+(?:feat\.|ft\.|featuring)\s.*?(?=\s+-\s|\s*[\(\[]|$)',
+                       re.IGNORECASE | re.UNICODE)
+
+# Edition suffixes such as "(Remastered 2009)" or " - Single Version"
+EDITIONS = r'remaster(?:ed)?|mono|stereo|single version|album version|bonus track|deluxe(?: edition)?'
+EDITION = re.compile(r'\s*(?:[\(\[][^\)\]]*\b(?:' + EDITIONS + r')\b[^\)\]]*[\)\]]'
+                     r'|\s-\s[^-]*\b(?:' + EDITIONS + r')\b.*)$',
+                     re.IGNORECASE | re.UNICODE)
+
+PUNCTUATION = re.compile(r'[^\w\s]', re.UNICODE)
+
+
+def CleanName(name):
+    # Strips featured artists and edition suffixes, keeping the name
+    # readable. This is what is sent to Last.FM. A name which is nothing but
+    # those is kept as it is.
+    if not name:
+        return u''
+    cleaned = None
+    previous = name
+    while cleaned != previous:
+        cleaned = previous
+        previous = EDITION.sub(u'', FEATURING.sub(u'', cleaned))
+    cleaned = u' '.join(cleaned.split())
+    return cleaned or u' '.join(name.split())
+
+
+def CanonicalName(name):
+    # Lower case ASCII-folded words of the cleaned name, without punctuation
+    name = CleanName(name)
+    if not isinstance(name, unicode):
+        name = name.decode('utf-8', 'replace')
+    name = unicodedata.normalize('NFKD', name)
+    name = u''.join(c for c in name if not unicodedata.combining(c))
+    name = PUNCTUATION.sub(u' ', name.lower().replace(u'&', u' and '))
+    return u' '.join(name.split())
+
+
+def MatchKey(artist, title):
+    artist = CanonicalName(artist)
+    if artist.startswith(u'the '):
+        artist = artist[4:]
+    return (artist, CanonicalName(title))
+
+
+class MatchGroup(object):
+    # Google tracks which are the same Last.FM track
+
+    def __init__(self, key, track):
+        self.key = key
+        self.artist = CleanName(track.get('artist'))
+        self.title = CleanName(track.get('title'))
+        self.tracks = []
+
+    def PlayCount(self):
+        return sum(int(track.get('playCount', 0)) for track in self.tracks)
+
+    def MostPlayed(self):
+        return max(self.tracks, key=lambda track: int(track.get('playCount', 0)))
+
+    def LastModified(self):
+        return max(self.tracks, key=lambda track: int(track.get('lastModifiedTimestamp') or 0))
+
+    def Query(self):
+        # A track-like dictionary describing the whole group, for
+        # PlayCountFetcher and PlayCountCache
+        return {'id': self.key, 'artist': self.artist, 'title': self.title,
+                'playCount': self.PlayCount(),
+                'lastModifiedTimestamp': self.LastModified().get('lastModifiedTimestamp')}
+
+
+class MatchIndex(object):
+
+    def __init__(self, library):
+        self.library = library
+        self.groups = {}
+        self.keys = {}
+        for track in library:
+            key = MatchKey(track.get('artist'), track.get('title'))
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = MatchGroup(key, track)
+            group.tracks.append(track)
+            self.keys[track['id']] = key
+
+    def __len__(self):
+        return len(self.keys)
+
+    def Groups(self):
+        return self.groups.values()
+
+    def Group(self, track):
+        return self.groups[self.keys[track['id']]]